@@ -2,14 +2,14 @@ import os
 
 from flask import Flask
 from flask_assets import Environment
-from flask_compress import Compress
 from flask_login import LoginManager
 from flask_mail import Mail
 from flask_rq import RQ
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import CSRFProtect
 
-from app.assets import app_css, app_js, vendor_css, vendor_js
+from app.assets import bundles
+from app.compression import Compress
 from config import config as Config
 
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -46,10 +46,17 @@ def create_app(config):
     compress.init_app(app)
     RQ(app)
 
+    # Keep the user search index up to date
+    from .search import init_search
+    init_search(app)
+
     # Register Jinja template functions
     from .utils import register_template_utils
     register_template_utils(app)
 
+    from .template_cache import init_template_cache
+    init_template_cache(app)
+
     # Set up asset pipeline
     assets_env = Environment(app)
     dirs = ['assets/styles', 'assets/scripts']
@@ -57,10 +64,11 @@ def create_app(config):
         assets_env.append_path(os.path.join(basedir, path))
     assets_env.url_expire = True
 
-    assets_env.register('app_css', app_css)
-    assets_env.register('app_js', app_js)
-    assets_env.register('vendor_css', vendor_css)
-    assets_env.register('vendor_js', vendor_js)
+    assets_env.register(bundles)
+
+    # Link prebuilt assets when there is a manifest (manage.py build_assets)
+    from .asset_manifest import load_manifest
+    load_manifest(app)
 
     # Configure SSL if platform supports it
     if not app.debug and not app.testing and not app.config['SSL_DISABLE']:
@@ -77,4 +85,14 @@ def create_app(config):
     from .admin import admin as admin_blueprint
     app.register_blueprint(admin_blueprint, url_prefix='/admin')
 
+    # Serve static files from an in-memory index
+    from .static_files import init_static_files
+    init_static_files(app)
+
+    # Compile templates now rather than on the first requests for them
+    if app.config['TEMPLATE_WARMUP']:
+        from .template_cache import warm_templates
+        count, seconds = warm_templates(app)
+        app.logger.info('Loaded %d templates in %.3fs', count, seconds)
+
     return app
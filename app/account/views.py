@@ -12,7 +12,6 @@ from flask_login import (
     login_user,
     logout_user,
 )
-from flask_rq import get_queue
 
 from app import db
 from app.account.forms import (
@@ -24,13 +23,16 @@ from app.account.forms import (
     RequestResetPasswordForm,
     ResetPasswordForm,
 )
-from app.email import send_email
+from app.email import enqueue_email
+from app.hashing import HashingBusy
 from app.models import User
+from app.page_cache import cache_page
 
 account = Blueprint('account', __name__)
 
 
 @account.route('/login', methods=['GET', 'POST'])
+@cache_page()
 def login():
     """Log in an existing user."""
     form = LoginForm()
@@ -38,6 +40,13 @@ def login():
         user = User.query.filter_by(email=form.email.data).first()
         if user is not None and user.password_hash is not None and \
                 user.verify_password(form.password.data):
+            if user.password_needs_rehash():
+                # Only now is the plain password at hand to hash it again
+                try:
+                    user.password = form.password.data
+                    db.session.commit()
+                except HashingBusy:
+                    pass
             login_user(user, form.remember_me.data)
             flash('You are now logged in. Welcome back!', 'success')
             return redirect(request.args.get('next') or url_for('main.index'))
@@ -47,6 +56,7 @@ def login():
 
 
 @account.route('/register', methods=['GET', 'POST'])
+@cache_page()
 def register():
     """Register a new user, and send them a confirmation email."""
     form = RegistrationForm()
@@ -60,8 +70,7 @@ def register():
         db.session.commit()
         token = user.generate_confirmation_token()
         confirm_link = url_for('account.confirm', token=token, _external=True)
-        get_queue().enqueue(
-            send_email,
+        enqueue_email(
             recipient=user.email,
             subject='Confirm Your Account',
             template='account/email/confirm',
@@ -101,8 +110,7 @@ def reset_password_request():
             token = user.generate_password_reset_token()
             reset_link = url_for(
                 'account.reset_password', token=token, _external=True)
-            get_queue().enqueue(
-                send_email,
+            enqueue_email(
                 recipient=user.email,
                 subject='Reset Your Password',
                 template='account/email/reset_password',
@@ -164,14 +172,11 @@ def change_email_request():
             token = current_user.generate_email_change_token(new_email)
             change_email_link = url_for(
                 'account.change_email', token=token, _external=True)
-            get_queue().enqueue(
-                send_email,
+            enqueue_email(
                 recipient=new_email,
                 subject='Confirm Your New Email',
                 template='account/email/change_email',
-                # current_user is a LocalProxy, we want the underlying user
-                # object
-                user=current_user._get_current_object(),
+                user=current_user,
                 change_email_link=change_email_link)
             flash('A confirmation link has been sent to {}.'.format(new_email),
                   'warning')
@@ -198,13 +203,11 @@ def confirm_request():
     """Respond to new user's request to confirm their account."""
     token = current_user.generate_confirmation_token()
     confirm_link = url_for('account.confirm', token=token, _external=True)
-    get_queue().enqueue(
-        send_email,
+    enqueue_email(
         recipient=current_user.email,
         subject='Confirm Your Account',
         template='account/email/confirm',
-        # current_user is a LocalProxy, we want the underlying user object
-        user=current_user._get_current_object(),
+        user=current_user,
         confirm_link=confirm_link)
     flash('A new confirmation link has been sent to {}.'.format(
         current_user.email), 'warning')
@@ -263,8 +266,7 @@ def join_from_invite(user_id, token):
             user_id=user_id,
             token=token,
             _external=True)
-        get_queue().enqueue(
-            send_email,
+        enqueue_email(
             recipient=new_user.email,
             subject='You Are Invited To Join',
             template='account/email/invite',
@@ -0,0 +1,85 @@
+from app import db
+from app.admin.importing import AccountEmails
+from app.admin.listing import filter_users
+from app.email import enqueue_emails
+from app.models import User
+from app.search import get_backend
+
+# Confirmation emails queued per Redis round trip
+EMAIL_CHUNK = 1000
+
+
+class BulkUserAction(object):
+    """
+    An admin action applied to many users with one statement.
+
+    The users are those in `ids`, or with `ids` of None every user matching
+    the registered users filters (`role`, `search`). The acting user is
+    always left out, as the single-user views leave them out: nobody
+    changes the type of, or deletes, their own account.
+
+    Role changes and deletions are one `UPDATE` or `DELETE` whatever the
+    number of users; the user cache drops its entries through the bulk
+    hooks on the session, and deleted users leave the search index in the
+    same transaction.
+    """
+
+    def __init__(self, acting_user, ids=None, role=None, search=None):
+        self.acting_user = acting_user
+        self.ids = ids
+        self.role = role
+        self.search = search
+
+    def matching(self):
+        query = filter_users(User.query, role=self.role, search=self.search)
+        if self.ids is not None:
+            query = query.filter(User.id.in_(self.ids))
+        return query
+
+    def includes_acting_user(self):
+        """Whether the acting user was among those selected."""
+        return db.session.query(self.matching().filter(
+            User.id == self.acting_user.id).exists()).scalar()
+
+    def query(self):
+        return self.matching().filter(User.id != self.acting_user.id)
+
+    def change_role(self, role):
+        """Give every selected user `role`; returns how many there were."""
+        count = self.query().update({User.role_id: role.id},
+                                    synchronize_session=False)
+        db.session.commit()
+        return count
+
+    def delete(self):
+        """Delete every selected user; returns how many there were."""
+        query = self.query()
+        ids = [user_id for user_id, in query.with_entities(User.id)]
+        get_backend().remove(db.session.connection(), ids)
+        count = query.delete(synchronize_session=False)
+        db.session.commit()
+        return count
+
+    def resend_confirmation(self, enqueue=enqueue_emails):
+        """
+        Email every unconfirmed user among those selected again: an
+        invitation if they have yet to set a password, or a confirmation
+        link. Returns how many emails were queued.
+        """
+        rows = self.matching().filter(User.confirmed.isnot(True)) \
+            .with_entities(User.id, User.email, User.password_hash.is_(None))
+        emails = AccountEmails()
+        count, invites, confirms = 0, [], []
+        for user_id, email, invited in rows.yield_per(EMAIL_CHUNK):
+            (invites if invited else confirms).append((user_id, email))
+            if len(invites) + len(confirms) >= EMAIL_CHUNK:
+                count += self._send(emails, invites, confirms, enqueue)
+                invites, confirms = [], []
+        return count + self._send(emails, invites, confirms, enqueue)
+
+    @staticmethod
+    def _send(emails, invites, confirms, enqueue):
+        batch = emails.invitations(invites) + emails.confirmations(confirms)
+        if batch:
+            enqueue(batch)
+        return len(batch)
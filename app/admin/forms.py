@@ -2,7 +2,12 @@ from flask_wtf import FlaskForm
 from wtforms import ValidationError
 from wtforms.ext.sqlalchemy.fields import QuerySelectField
 from wtforms.fields import (
+    BooleanField,
+    FileField,
+    HiddenField,
+    IntegerField,
     PasswordField,
+    SelectField,
     StringField,
     SubmitField,
 )
@@ -12,10 +17,10 @@ from wtforms.validators import (
     EqualTo,
     InputRequired,
     Length,
+    Optional,
 )
 
-from app import db
-from app.models import Role, User
+from app.models import User, role_registry
 
 
 class ChangeUserEmailForm(FlaskForm):
@@ -35,7 +40,7 @@ class ChangeAccountTypeForm(FlaskForm):
         'New account type',
         validators=[InputRequired()],
         get_label='name',
-        query_factory=lambda: db.session.query(Role).order_by('permissions'))
+        query_factory=role_registry.all)
     submit = SubmitField('Update role')
 
 
@@ -44,7 +49,7 @@ class InviteUserForm(FlaskForm):
         'Account type',
         validators=[InputRequired()],
         get_label='name',
-        query_factory=lambda: db.session.query(Role).order_by('permissions'))
+        query_factory=role_registry.all)
     first_name = StringField(
         'First name', validators=[InputRequired(),
                                   Length(1, 64)])
@@ -72,3 +77,45 @@ class NewUserForm(InviteUserForm):
     password2 = PasswordField('Confirm password', validators=[InputRequired()])
 
     submit = SubmitField('Create')
+
+
+class ImportUsersForm(FlaskForm):
+    file = FileField(
+        'CSV file',
+        description='Columns: email, and optionally first_name, last_name '
+        'and role',
+        validators=[InputRequired()])
+    role = QuerySelectField(
+        'Account type for rows without a role',
+        validators=[InputRequired()],
+        get_label='name',
+        query_factory=role_registry.all)
+    invite = BooleanField('Email each new user an invitation', default=True)
+    submit = SubmitField('Import')
+
+    def validate_file(self, field):
+        if not getattr(field.data, 'filename', '').lower().endswith('.csv'):
+            raise ValidationError('Upload a .csv file.')
+
+
+class BulkUserActionForm(FlaskForm):
+    action = SelectField(
+        'Action',
+        choices=[('change_role', 'Change account type'),
+                 ('delete', 'Delete'),
+                 ('resend_confirmation', 'Resend confirmation')])
+    role = QuerySelectField(
+        'New account type',
+        allow_blank=True,
+        blank_text='New account type',
+        get_label='name',
+        query_factory=role_registry.all)
+    # Apply to every user matching the list filters, not just those checked
+    all_matching = BooleanField('Every user matching the filters')
+    filter_role = IntegerField(validators=[Optional()])
+    q = HiddenField()
+    submit = SubmitField('Apply')
+
+    def validate_role(self, field):
+        if self.action.data == 'change_role' and field.data is None:
+            raise ValidationError('Choose the new account type.')
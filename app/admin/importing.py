@@ -0,0 +1,264 @@
+import csv
+import os
+import re
+import tempfile
+import uuid
+from itertools import islice
+
+from flask import current_app, request, url_for
+from flask_rq import get_queue
+from rq import get_current_job
+from sqlalchemy import bindparam, select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.email import enqueue_emails
+from app.models import User, role_registry
+from app.search import get_backend
+from app.worker import worker_app
+
+# Emails looked up or fetched per query
+LOOKUP_CHUNK = 500
+# Problems kept for the report; the rest are only counted
+MAX_ERRORS = 100
+# Seconds the worker gives an uploaded import
+IMPORT_TIMEOUT = 3600
+
+# The check WTForms' Email validator makes
+_email = re.compile(r'^.+@([^.@][^@]+)$')
+
+_ids_by_email = select([User.email, User.id]).where(
+    User.email.in_(bindparam('emails', expanding=True)))
+
+
+class UserImport(object):
+    """
+    Creates users from a CSV file and invites them by email.
+
+    The file needs an `email` column and may have `first_name`, `last_name`
+    and `role` (a role name) columns. It is read `chunk_size` rows at a time,
+    so memory use does not grow with the file. Each chunk costs a few
+    queries to find emails that are already taken, one executemany insert
+    and one commit, and its invitations are queued in one Redis pipeline.
+
+    Rows that are invalid or whose email is taken are skipped and reported.
+    If an email is taken between the lookup and the insert, that chunk is
+    inserted again a row at a time, so only the clashing rows are lost.
+    """
+
+    def __init__(self, invite=True, role=None, chunk_size=1000,
+                 enqueue=enqueue_emails, progress=None):
+        self.invite = invite
+        self.role = role
+        self.chunk_size = max(1, chunk_size)
+        self.enqueue = enqueue
+        self.progress = progress
+        self.created = 0
+        self.skipped = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+    def run(self, stream):
+        """Import every row of a CSV text stream."""
+        reader = csv.DictReader(stream)
+        if reader.fieldnames is None or 'email' not in [
+                (name or '').strip().lower() for name in reader.fieldnames]:
+            self.error(1, 'The file has no email column.')
+            return self
+        reader.fieldnames = [(name or '').strip().lower()
+                             for name in reader.fieldnames]
+        while True:
+            chunk = [(reader.line_num, row)
+                     for row in islice(reader, self.chunk_size)]
+            if not chunk:
+                break
+            self.import_chunk(chunk)
+            if self.progress is not None:
+                self.progress(self)
+        return self
+
+    def _valid_rows(self, chunk):
+        default_role = self.role or role_registry.default()
+        rows, seen = [], set()
+        for line, row in chunk:
+            email = (row.get('email') or '').strip()
+            first_name = (row.get('first_name') or '').strip()
+            last_name = (row.get('last_name') or '').strip()
+            role_name = (row.get('role') or '').strip()
+            role = role_registry.by_name(role_name) if role_name \
+                else default_role
+            if not _email.match(email) or len(email) > 64:
+                self.error(line, 'Invalid email address {!r}.'.format(email))
+            elif len(first_name) > 64 or len(last_name) > 64:
+                self.error(line, 'Name longer than 64 characters.')
+            elif role is None:
+                self.error(line, 'Unknown role {!r}.'.format(role_name))
+            elif email in seen:
+                self.error(line, 'Email {} appears twice.'.format(email))
+            else:
+                seen.add(email)
+                rows.append((line, {
+                    'email': email,
+                    'first_name': first_name or None,
+                    'last_name': last_name or None,
+                    'role_id': role.id,
+                    'confirmed': False,
+                }))
+        return rows
+
+    def _lookup(self, emails):
+        """Map those of `emails` that are registered to user ids."""
+        found = {}
+        for i in range(0, len(emails), LOOKUP_CHUNK):
+            rows = db.session.execute(
+                _ids_by_email, {'emails': emails[i:i + LOOKUP_CHUNK]})
+            found.update((email, user_id) for email, user_id in rows)
+        return found
+
+    def import_chunk(self, chunk):
+        """Insert and invite the users in one chunk of (line, row) pairs."""
+        rows = self._valid_rows(chunk)
+        taken = self._lookup([row['email'] for _, row in rows])
+        new = []
+        for line, row in rows:
+            if row['email'] in taken:
+                self.error(line, 'Email {} is already registered.'.format(
+                    row['email']))
+            else:
+                new.append((line, row))
+        if not new:
+            return
+
+        try:
+            ids = self._insert(new)
+        except IntegrityError:
+            # An email was registered since the lookup (a signup, say):
+            # insert the rows one at a time to find out which
+            db.session.rollback()
+            ids = {}
+            for line, row in new:
+                try:
+                    ids.update(self._insert([(line, row)]))
+                except IntegrityError:
+                    db.session.rollback()
+                    self.error(line, 'Email {} is already registered.'.format(
+                        row['email']))
+        self.created += len(ids)
+
+        if self.invite and ids:
+            self.enqueue(AccountEmails().invitations(
+                (ids[row['email']], row['email']) for _, row in new
+                if row['email'] in ids))
+
+    def _insert(self, rows):
+        """Insert, index and commit (line, row) pairs; returns the new ids
+        by email."""
+        db.session.execute(User.__table__.insert(), [row for _, row in rows])
+        ids = self._lookup([row['email'] for _, row in rows])
+        # Core inserts skip the model hooks that keep search current
+        get_backend().index(db.session.connection(), [
+            (ids[row['email']], row['first_name'], row['last_name'],
+             row['email']) for _, row in rows
+        ])
+        db.session.commit()
+        return ids
+
+
+def _upload_dir():
+    folder = current_app.config['IMPORT_UPLOAD_DIR'] or os.path.join(
+        tempfile.gettempdir(), 'flask-base-imports')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def enqueue_import(upload, role=None, invite=True):
+    """
+    Save the uploaded CSV file `upload` to IMPORT_UPLOAD_DIR, queue its
+    import for the worker and return the job. Only the file's path goes
+    into Redis. Invitation links point at the site of the current request.
+    """
+    path = os.path.join(_upload_dir(), uuid.uuid4().hex + '.csv')
+    upload.save(path)
+    return get_queue().enqueue(
+        run_import,
+        path,
+        request.url_root,
+        role_id=role.id if role is not None else None,
+        invite=invite,
+        job_timeout=IMPORT_TIMEOUT)
+
+
+def run_import(path, base_url, role_id=None, invite=True):
+    """
+    Run a queued import of the file at `path`, deleting it afterwards. The
+    job's `meta` counts the rows done so far; its result holds the counts
+    and the problems found.
+    """
+    job = get_current_job()
+
+    def progress(result):
+        job.meta.update(created=result.created, skipped=result.skipped)
+        job.save_meta()
+
+    try:
+        with worker_app.app_context(), \
+                current_app.test_request_context(base_url=base_url), \
+                open(path, newline='', encoding='utf-8-sig') as stream:
+            result = UserImport(
+                invite=invite,
+                role=role_registry.get(role_id) if role_id else None,
+                progress=progress if job is not None else None).run(stream)
+    finally:
+        os.remove(path)
+    return {
+        'created': result.created,
+        'skipped': result.skipped,
+        'errors': result.errors,
+    }
+
+
+class AccountEmails(object):
+    """
+    Builds invitation and confirmation emails for many users at once, from
+    (id, email) pairs so the users need not be loaded. Tokens are the ones
+    `User.confirmation_token` makes. Needs a request context for the links.
+    """
+
+    @staticmethod
+    def token(user_id):
+        return User.confirmation_token(user_id).decode('ascii')
+
+    def invitations(self, users):
+        """Invitation email arguments for (id, email) pairs."""
+        return [
+            dict(
+                recipient=email,
+                subject='You Are Invited To Join',
+                template='account/email/invite',
+                user_id=user_id,
+                invite_link=url_for(
+                    'account.join_from_invite',
+                    user_id=user_id,
+                    token=self.token(user_id),
+                    _external=True))
+            for user_id, email in users
+        ]
+
+    def confirmations(self, users):
+        """Confirmation email arguments for (id, email) pairs."""
+        return [
+            dict(
+                recipient=email,
+                subject='Confirm Your Account',
+                template='account/email/confirm',
+                user_id=user_id,
+                confirm_link=url_for(
+                    'account.confirm',
+                    token=self.token(user_id),
+                    _external=True))
+            for user_id, email in users
+        ]
@@ -0,0 +1,165 @@
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import joinedload
+
+from app.models import User
+
+# Columns the registered users page can be sorted by, all indexed. Ties are
+# broken on `User.id` so that every row has a unique position. Account types
+# sort by `role_id`, the order the roles were created in (User, then
+# Administrator, by `Role.insert_roles`), not alphabetically: ordering by
+# the role name would need a join no index can serve.
+SORT_COLUMNS = {
+    'first_name': User.first_name,
+    'last_name': User.last_name,
+    'email': User.email,
+    'role': User.role_id,
+}
+
+MAX_PER_PAGE = 200
+
+
+def _cursor_serializer():
+    return URLSafeSerializer(
+        current_app.config['SECRET_KEY'], salt='users-cursor')
+
+
+def filter_users(query, role=None, search=None):
+    """
+    Restrict a `User` query to one role and/or a search prefix. The prefix
+    is matched as `lower(column) LIKE 'prefix%'`, which the lower-case
+    indexes on `users` serve on Postgres, where ILIKE would scan.
+    """
+    if role is not None:
+        query = query.filter(User.role_id == role)
+    if search:
+        pattern = search.lower().replace('\\', '\\\\') \
+            .replace('%', '\\%').replace('_', '\\_') + '%'
+        query = query.filter(
+            or_(*(func.lower(column).like(pattern, escape='\\')
+                  for column in (User.first_name, User.last_name,
+                                 User.email))))
+    return query
+
+
+class UserListing(object):
+    """
+    One page of the registered users list, filtered and sorted in the database
+    and paginated with keyset cursors.
+
+    A cursor holds the sort value and id of the row at the edge of a page.
+    The next page starts strictly after it in (sort column, id) order, so
+    pages stay stable while users are added or removed and fetching a page
+    costs the same however deep into the list it is.
+    """
+
+    def __init__(self, role=None, search=None, sort='last_name', order='asc',
+                 after=None, before=None, per_page=50):
+        self.role = role
+        self.search = (search or '').strip()
+        self.sort = sort if sort in SORT_COLUMNS else 'last_name'
+        self.order = 'desc' if order == 'desc' else 'asc'
+        self.after = self._load_cursor(after)
+        self.before = None if self.after else self._load_cursor(before)
+        self.per_page = max(1, min(per_page, MAX_PER_PAGE))
+        self.users = []
+        self.next_cursor = None
+        self.prev_cursor = None
+
+    @classmethod
+    def from_args(cls, args):
+        """Build a listing from request arguments."""
+        return cls(
+            role=args.get('role', type=int),
+            search=args.get('q'),
+            sort=args.get('sort', 'last_name'),
+            order=args.get('order', 'asc'),
+            after=args.get('after'),
+            before=args.get('before'),
+            per_page=args.get('per_page', 50, type=int))
+
+    def _load_cursor(self, token):
+        if not token:
+            return None
+        try:
+            value, user_id = _cursor_serializer().loads(token)
+        except (BadSignature, ValueError, TypeError):
+            return None
+        return value, user_id
+
+    def _dump_cursor(self, user):
+        value = getattr(user, SORT_COLUMNS[self.sort].key)
+        return _cursor_serializer().dumps([value, user.id])
+
+    def query(self):
+        """All users matching the filters, without sorting or paging."""
+        query = User.query.options(joinedload(User.role))
+        return filter_users(query, role=self.role, search=self.search)
+
+    def _ordered(self, query, ascending):
+        column = SORT_COLUMNS[self.sort]
+        if ascending:
+            return query.order_by(column.asc().nullsfirst(), User.id.asc())
+        return query.order_by(column.desc().nullslast(), User.id.desc())
+
+    def _past(self, cursor, ascending):
+        """Rows strictly after `cursor` in the given direction; NULLs sort
+        before every other value."""
+        column = SORT_COLUMNS[self.sort]
+        value, user_id = cursor
+        if ascending:
+            if value is None:
+                return or_(column.isnot(None),
+                           and_(column.is_(None), User.id > user_id))
+            return or_(column > value,
+                       and_(column == value, User.id > user_id))
+        if value is None:
+            return and_(column.is_(None), User.id < user_id)
+        return or_(column < value, column.is_(None),
+                   and_(column == value, User.id < user_id))
+
+    def fetch(self):
+        """Load the users on this page and the cursors around it."""
+        ascending = self.order == 'asc'
+        query = self.query()
+        if self.before is not None:
+            # Walk backwards from the cursor, then restore display order
+            query = query.filter(self._past(self.before, not ascending))
+            rows = self._ordered(query, not ascending) \
+                .limit(self.per_page + 1).all()
+            has_more = len(rows) > self.per_page
+            self.users = list(reversed(rows[:self.per_page]))
+            has_prev, has_next = has_more, True
+        else:
+            if self.after is not None:
+                query = query.filter(self._past(self.after, ascending))
+            rows = self._ordered(query, ascending) \
+                .limit(self.per_page + 1).all()
+            self.users = rows[:self.per_page]
+            has_prev = self.after is not None
+            has_next = len(rows) > self.per_page
+
+        if self.users:
+            if has_next:
+                self.next_cursor = self._dump_cursor(self.users[-1])
+            if has_prev:
+                self.prev_cursor = self._dump_cursor(self.users[0])
+        return self
+
+    def url_args(self, **overrides):
+        """Query arguments for a link to this listing, minus paging."""
+        args = {
+            'role': self.role,
+            'q': self.search or None,
+            'sort': self.sort,
+            'order': self.order,
+        }
+        args.update(overrides)
+        return {k: v for k, v in args.items() if v is not None}
+
+    def sort_args(self, sort):
+        """Query arguments for sorting on `sort`, toggling the order if the
+        list is already sorted on it."""
+        order = 'desc' if sort == self.sort and self.order == 'asc' else 'asc'
+        return self.url_args(sort=sort, order=order)
@@ -1,25 +1,35 @@
 from flask import (
     Blueprint,
+    Response,
     abort,
     flash,
+    jsonify,
     redirect,
     render_template,
     request,
+    stream_with_context,
     url_for,
 )
 from flask_login import current_user, login_required
 from flask_rq import get_queue
 
 from app import db
+from app.admin.bulk import BulkUserAction
+from app.admin.exporting import FORMATS, export_users
 from app.admin.forms import (
+    BulkUserActionForm,
     ChangeAccountTypeForm,
     ChangeUserEmailForm,
+    ImportUsersForm,
     InviteUserForm,
     NewUserForm,
 )
+from app.admin.importing import enqueue_import
+from app.admin.listing import UserListing
 from app.decorators import admin_required
-from app.email import send_email
-from app.models import EditableHTML, Role, User
+from app.email import enqueue_email
+from app.models import EditableHTML, User, role_registry
+from app.search import search_users
 
 admin = Blueprint('admin', __name__)
 
@@ -72,8 +82,7 @@ def invite_user():
             user_id=user.id,
             token=token,
             _external=True)
-        get_queue().enqueue(
-            send_email,
+        enqueue_email(
             recipient=user.email,
             subject='You Are Invited To Join',
             template='account/email/invite',
@@ -85,15 +94,116 @@ def invite_user():
     return render_template('admin/new_user.html', form=form)
 
 
+@admin.route('/import-users', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_users():
+    """Queue the creation and invitation of users from a CSV file."""
+    form = ImportUsersForm()
+    if form.validate_on_submit():
+        job = enqueue_import(
+            form.file.data, role=form.role.data, invite=form.invite.data)
+        return redirect(url_for('admin.import_status', job_id=job.id))
+    return render_template('admin/import_users.html', form=form)
+
+
+@admin.route('/import-users/<job_id>')
+@login_required
+@admin_required
+def import_status(job_id):
+    """Follow a queued import, and report on it once it is done."""
+    job = get_queue().fetch_job(job_id)
+    if job is None or job.func_name != 'app.admin.importing.run_import':
+        abort(404)
+    return render_template(
+        'admin/import_users.html', form=ImportUsersForm(), job=job,
+        result=job.result if job.is_finished else None)
+
+
 @admin.route('/users')
 @login_required
 @admin_required
 def registered_users():
-    """View all registered users."""
-    users = User.query.all()
-    roles = Role.query.all()
+    """View registered users, a page at a time."""
+    listing = UserListing.from_args(request.args).fetch()
+    roles = role_registry.all()
+    form = BulkUserActionForm(filter_role=listing.role, q=listing.search)
     return render_template(
-        'admin/registered_users.html', users=users, roles=roles)
+        'admin/registered_users.html',
+        listing=listing,
+        roles=roles,
+        form=form)
+
+
+@admin.route('/users/export.<any(csv, jsonl):fmt>')
+@login_required
+@admin_required
+def export_registered_users(fmt):
+    """Download the users matching the list filters, streamed."""
+    listing = UserListing.from_args(request.args)
+    rows = export_users(fmt, role=listing.role, search=listing.search)
+    return Response(
+        stream_with_context(rows),
+        mimetype=FORMATS[fmt],
+        headers={
+            'Content-Disposition': 'attachment; filename=users.' + fmt
+        })
+
+
+@admin.route('/users/bulk', methods=['POST'])
+@login_required
+@admin_required
+def bulk_users():
+    """Change the type of, delete or re-confirm many users at once."""
+    form = BulkUserActionForm()
+    listing = UserListing(role=form.filter_role.data, search=form.q.data)
+    if not form.validate_on_submit():
+        for errors in form.errors.values():
+            flash(errors[0], 'error')
+        return redirect(
+            url_for('admin.registered_users', **listing.url_args()))
+
+    ids = None if form.all_matching.data else \
+        request.form.getlist('user_id', type=int)
+    if ids == []:
+        flash('Select some users first.', 'error')
+        return redirect(
+            url_for('admin.registered_users', **listing.url_args()))
+    action = BulkUserAction(
+        current_user, ids=ids, role=listing.role, search=listing.search)
+
+    if form.action.data == 'resend_confirmation':
+        count = action.resend_confirmation()
+        flash('Sent {} confirmation emails.'.format(count), 'success')
+    else:
+        if action.includes_acting_user():
+            flash('Your own account was left out. Please ask another '
+                  'administrator to change it.', 'error')
+        if form.action.data == 'change_role':
+            count = action.change_role(form.role.data)
+            flash('Changed {} users to {}.'.format(
+                count, form.role.data.name), 'success')
+        else:
+            count = action.delete()
+            flash('Deleted {} users.'.format(count), 'success')
+    return redirect(url_for('admin.registered_users', **listing.url_args()))
+
+
+@admin.route('/users/search')
+@login_required
+@admin_required
+def user_search():
+    """Ranked prefix and fuzzy matches on users' names and emails."""
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    results = [{
+        'id': user_id,
+        'name': '%s %s' % (first_name, last_name),
+        'email': email,
+        'score': round(score, 3),
+        'url': url_for('admin.user_info', user_id=user_id),
+    } for score, (user_id, first_name, last_name, email) in search_users(
+        request.args.get('q', ''), limit=limit)]
+    return jsonify(results=results)
 
 
 @admin.route('/user/<int:user_id>')
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+
+from flask import current_app, url_for
+from markupsafe import Markup
+
+from app.assets import bundles, purged
+from app.compression import gzip_compress
+from app.css_purge import critical_css as extract_critical_css
+from app.css_purge import purge_css, source_paths, used_words
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only .gz is written
+    brotli = None
+
+# Where built assets go, under the static folder
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+# Stylesheets in the order _head.html links them, and the templates every
+# page is drawn in, which decide what goes into the critical CSS
+STYLESHEETS = ('vendor_css', 'app_css')
+SHELL_TEMPLATES = ('layouts/base.html', 'partials/_head.html',
+                   'partials/_flashes.html', 'macros/nav_macros.html')
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _write_built(app, name, data):
+    """Write `data` to the build folder as `name` with a digest of it
+    added, next to compressed copies, and return its path there."""
+    stem, ext = os.path.splitext(name)
+    built = '%s/%s.%s%s' % (BUILD_DIR, stem,
+                            hashlib.sha256(data).hexdigest()[:12], ext)
+    path = os.path.join(app.static_folder, built)
+    _write(path, data)
+    _write(path + '.gz', gzip_compress(data))
+    if brotli is not None:
+        _write(path + '.br', brotli.compress(data))
+    return built
+
+
+def build_assets(app, force=False, critical=False):
+    """
+    Build every bundle and copy each into the build folder under
+    a name carrying a digest of its contents, with gzip and (when brotli is
+    installed) brotli compressed siblings. Writes a manifest mapping bundle
+    names to those files and returns it.
+
+    Bundles run their filters only when their sources changed, or always
+    with `force`. Those in `purged` lose the rules for classes no template
+    or app.js names; the manifest's `purged` has their sizes before and
+    after. With `critical` the rules the page shell needs are written to
+    a file of their own too, for `critical_css` to inline.
+    """
+    assets = app.jinja_env.assets_environment
+    build_dir = os.path.join(app.static_folder, BUILD_DIR)
+    os.makedirs(build_dir, exist_ok=True)
+    manifest = {'bundles': {}, 'files': {}, 'purged': {}}
+    words = used_words(source_paths(app))
+    styles = {}
+    with app.app_context():
+        for name in sorted(bundles):
+            bundle = assets[name]
+            bundle.build(force=force)
+            output = os.path.relpath(bundle.resolve_output(),
+                                     assets.directory)
+            with open(os.path.join(assets.directory, output), 'rb') as f:
+                data = f.read()
+            if name in purged:
+                size = len(data)
+                data = purge_css(data.decode('utf-8'),
+                                 words).encode('utf-8')
+                manifest['purged'][name] = [size, len(data)]
+            if name in STYLESHEETS:
+                styles[name] = data.decode('utf-8')
+            built = _write_built(app, os.path.basename(output), data)
+            manifest['bundles'][name] = built
+            manifest['files'][output] = built
+
+    if critical:
+        shell = used_words(
+            os.path.join(app.root_path, 'templates', template)
+            for template in SHELL_TEMPLATES)
+        css = extract_critical_css(
+            ''.join(styles[name] for name in STYLESHEETS), shell)
+        manifest['critical'] = _write_built(app, 'critical.css',
+                                            css.encode('utf-8'))
+
+    _write(os.path.join(build_dir, MANIFEST),
+           json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(app):
+    """Read the manifest `build_assets` wrote, if `ASSETS_MANIFEST` is on
+    and there is one. Pages then link the built files and Flask-Assets no
+    longer looks at the sources."""
+    app.extensions['asset_manifest'] = None
+    app.extensions['critical_css'] = None
+    if not app.config['ASSETS_MANIFEST']:
+        return
+    path = os.path.join(app.static_folder, BUILD_DIR, MANIFEST)
+    if not os.path.exists(path):
+        app.logger.warning('No asset manifest at %s; run manage.py '
+                           'build_assets. Building assets on request.', path)
+        return
+    with open(path) as f:
+        manifest = json.load(f)
+    app.extensions['asset_manifest'] = manifest
+    if manifest.get('critical'):
+        with open(os.path.join(app.static_folder, manifest['critical']),
+                  encoding='utf-8') as f:
+            app.extensions['critical_css'] = Markup(f.read())
+    app.jinja_env.assets_environment.auto_build = False
+
+
+def asset_urls(name):
+    """The URLs of a bundle: its built file when there is a manifest, or
+    whatever Flask-Assets makes of it."""
+    manifest = current_app.extensions.get('asset_manifest')
+    if manifest is not None:
+        return [url_for('static', filename=manifest['bundles'][name])]
+    return current_app.jinja_env.assets_environment[name].urls()
+
+
+def critical_css():
+    """The CSS to inline in `<head>` when the manifest has some. Pages
+    then load their stylesheets without holding up the first paint."""
+    return current_app.extensions.get('critical_css')
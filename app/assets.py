@@ -6,10 +6,28 @@ app_js = Bundle('app.js', filters='jsmin', output='scripts/app.js')
 
 vendor_css = Bundle('vendor/semantic.min.css', output='styles/vendor.css')
 
+# Loaded before the page, since inline scripts use jQuery as they run
+jquery_js = Bundle(
+    'vendor/jquery.min.js', filters='jsmin', output='scripts/jquery.js')
+
 vendor_js = Bundle(
-    'vendor/jquery.min.js',
-    'vendor/semantic.min.js',
-    'vendor/tablesort.min.js',
-    'vendor/zxcvbn.js',
-    filters='jsmin',
-    output='scripts/vendor.js')
+    'vendor/semantic.min.js', filters='jsmin', output='scripts/vendor.js')
+
+# Only for the pages that need it: the password strength meter fetches it
+# once someone starts typing a password, and other pages can list bundles
+# like this one in `page_bundles`
+zxcvbn_js = Bundle(
+    'vendor/zxcvbn.js', filters='jsmin', output='scripts/zxcvbn.js')
+
+# Every bundle, by the name templates use for it
+bundles = {
+    'app_css': app_css,
+    'app_js': app_js,
+    'jquery_js': jquery_js,
+    'vendor_css': vendor_css,
+    'vendor_js': vendor_js,
+    'zxcvbn_js': zxcvbn_js,
+}
+
+# Bundles `build_assets` strips of the rules no template uses
+purged = {'vendor_css'}
@@ -0,0 +1,236 @@
+import gzip
+import io
+import threading
+import time
+import zlib
+
+from flask import current_app, request
+
+from app.cache import LRUCache
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip is offered
+    brotli = None
+
+# Content types worth compressing
+MIMETYPES = ('text/html', 'text/css', 'text/plain', 'text/xml', 'text/csv',
+             'text/javascript', 'application/javascript', 'application/json',
+             'application/x-ndjson', 'image/svg+xml')
+# (gzip, brotli) levels. Stylesheets and scripts are the same for every
+# visitor, so they are compressed hardest and kept; pages and JSON are
+# compressed per request at a level that costs little CPU. Large bodies,
+# and streams whose size is unknown, get the fastest levels that still
+# pay off.
+STATIC_TYPES = ('text/css', 'text/javascript', 'application/javascript',
+                'image/svg+xml')
+STATIC_LEVELS = (9, 11)
+DYNAMIC_LEVELS = (6, 5)
+LARGE_LEVELS = (4, 4)
+LARGE_SIZE = 256 * 1024
+
+
+def compression_level(encoding, mimetype, size):
+    """The level to compress a `mimetype` body of `size` bytes (None for a
+    stream) with."""
+    if size is None or size > LARGE_SIZE:
+        levels = LARGE_LEVELS
+    elif mimetype in STATIC_TYPES:
+        levels = STATIC_LEVELS
+    else:
+        levels = DYNAMIC_LEVELS
+    return levels[encoding == 'br']
+
+
+def gzip_compress(data, level=9):
+    """
+    gzip `data` with no timestamp in the header, so the same bytes always
+    compress to the same file (`gzip.compress` only takes `mtime` from
+    Python 3.8).
+    """
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level,
+                       mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def _compressor(encoding, level):
+    """(compress, flush, finish) functions of a new compressor."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return (compressor.compress,
+            lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush)
+
+
+class ResponseCompressor(object):
+    """
+    Compresses an application's responses with brotli or gzip, whichever
+    the client prefers of those it accepts.
+
+    Bodies with a strong ETag, which promises the same bytes every time,
+    are kept compressed in an `LRUCache` of `cache_size` entries keyed by
+    that ETag with the encoding added, which is the ETag they are sent
+    with, so they are compressed once per process. Streamed
+    responses are compressed chunk by chunk as they are sent. `stats`
+    reports the time spent compressing and the bytes it saved.
+    """
+
+    def __init__(self, min_size=500, cache_size=256):
+        self.min_size = min_size
+        self.cache = LRUCache(cache_size)
+        self.responses = 0
+        self.streamed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def encoding_for(accept_encodings):
+        """The encoding the client gives the highest quality, brotli winning
+        ties; None if it accepts neither or would rather have identity."""
+        best, best_quality = None, 0
+        for encoding in ('br', 'gzip') if brotli is not None else ('gzip', ):
+            quality = accept_encodings.quality(encoding)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        if accept_encodings.quality('identity') > best_quality:
+            return None
+        return best
+
+    def _count(self, size, compressed_size, compress_seconds, streamed=False):
+        with self._lock:
+            self.responses += 1
+            self.streamed += streamed
+            self.bytes_in += size
+            self.bytes_out += compressed_size
+            self.compress_seconds += compress_seconds
+
+    def compress(self, data, encoding, level):
+        start = time.perf_counter()
+        process, _, finish = _compressor(encoding, level)
+        body = process(data) + finish()
+        self._count(len(data), len(body), time.perf_counter() - start)
+        return body
+
+    def _stream(self, chunks, app_iter, encoding, level):
+        process, flush, finish = _compressor(encoding, level)
+        size = compressed_size = 0
+        compress_seconds = 0.0
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                start = time.perf_counter()
+                # Flushed so each chunk reaches the client as it is made
+                body = process(chunk) + flush()
+                compress_seconds += time.perf_counter() - start
+                size += len(chunk)
+                compressed_size += len(body)
+                yield body
+            start = time.perf_counter()
+            body = finish()
+            compress_seconds += time.perf_counter() - start
+            compressed_size += len(body)
+            yield body
+        finally:
+            self._count(size, compressed_size, compress_seconds, streamed=True)
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+    def process_response(self, response):
+        # A 206 holds part of the uncompressed body. Files sent straight
+        # from disk are left alone: static_files serves precompressed
+        # copies of those worth compressing, and reading one in here
+        # would hold it all in memory.
+        if response.mimetype not in MIMETYPES or \
+                not 200 <= response.status_code < 300 or \
+                response.status_code == 206 or \
+                response.direct_passthrough or \
+                'Content-Encoding' in response.headers:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.encoding_for(request.accept_encodings)
+        size = response.content_length
+        if encoding is None or (size is not None and size < self.min_size):
+            return response
+
+        # The compressed bytes are not the plain ones, so a strong ETag gets
+        # the encoding added, like the precompressed files of static_files
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            etag = '%s-%s' % (etag, encoding)
+            response.set_etag(etag)
+            if request.if_none_match.contains(etag):
+                if hasattr(response.response, 'close'):
+                    response.response.close()
+                response.response = []
+                response.status_code = 304
+                response.headers.pop('Content-Length', None)
+                return response
+
+        if size is None and response.is_streamed:
+            level = compression_level(encoding, response.mimetype, None)
+            app_iter = response.response
+            response.response = self._stream(response.iter_encoded(),
+                                             app_iter, encoding, level)
+            response.headers.pop('Content-Length', None)
+            response.headers['Content-Encoding'] = encoding
+            return response
+
+        key = etag if etag and not weak else None
+        entry = self.cache.get(key) if key else None
+        if entry is not None and entry[0] == size:
+            body = entry[1]
+            if hasattr(response.response, 'close'):
+                response.response.close()
+        else:
+            data = response.get_data()
+            level = compression_level(encoding, response.mimetype,
+                                      len(data))
+            body = self.compress(data, encoding, level)
+            if key:
+                self.cache.set(key, (len(data), body))
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        # Ranges would count bytes of the compressed body
+        response.headers.pop('Accept-Ranges', None)
+        return response
+
+    def stats(self):
+        """Bytes compressed and saved, and the time it took."""
+        return {
+            'responses': self.responses,
+            'streamed': self.streamed,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_saved': self.bytes_in - self.bytes_out,
+            'compress_seconds': self.compress_seconds,
+            'cache': self.cache.stats(),
+        }
+
+
+class Compress(object):
+    """Compresses the responses of the apps it is set up on; see
+    `ResponseCompressor`."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['compress'] = ResponseCompressor(
+            app.config['COMPRESS_MIN_SIZE'], app.config['COMPRESS_CACHE_SIZE'])
+        app.after_request(self.after_request)
+
+    @staticmethod
+    def after_request(response):
+        return current_app.extensions['compress'].process_response(response)
+
+    @staticmethod
+    def stats():
+        """`ResponseCompressor.stats` of the current application."""
+        return current_app.extensions['compress'].stats()
@@ -0,0 +1,150 @@
+import os
+import re
+
+# Classes Semantic UI's own scripts add while the page runs (states,
+# transitions, dimmers), which no template or app script mentions
+SAFELIST = {
+    'active', 'animating', 'ascending', 'bottom', 'center', 'checked',
+    'descending', 'dimmable', 'dimmed', 'dimmer', 'disabled', 'down',
+    'error', 'fade', 'filtered', 'focus', 'hidden', 'in', 'indeterminate',
+    'left', 'loading', 'out', 'pointing', 'popup', 'right', 'scale',
+    'scrolling', 'selected', 'slide', 'sorted', 'top', 'transition',
+    'upward', 'visible',
+}
+
+# Statements kept whole: fonts, animations and the like
+KEPT_AT_RULES = ('@font-face', '@keyframes', '@-webkit-keyframes', '@page',
+                 '@import', '@charset')
+
+_word = re.compile(r'[A-Za-z0-9_-]+')
+_class = re.compile(r'\.(-?[_a-zA-Z][_a-zA-Z0-9-]*)')
+# Parts of a selector whose classes do not have to be on the page:
+# `:not(.x)` matches when .x is missing, and `[class*="x"]` is no class
+_ignored = re.compile(r':not\([^)]*\)|\[[^\]]*\]')
+# Selectors for states a page is not in when first drawn, or for tooltips,
+# which the critical CSS does without
+_interactive = re.compile(
+    r':(hover|focus|active|visited|checked|disabled|indeterminate|'
+    r':?selection|:?placeholder|-(webkit|moz|ms)-[\w-]+)|'
+    r'\[data-(tooltip|position)')
+
+
+def used_words(paths):
+    """Every word in the files at `paths`, taken as a possible class name."""
+    words = set()
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            words.update(_word.findall(f.read()))
+    return words
+
+
+def source_paths(app):
+    """The templates and app script that class names are looked for in."""
+    paths = [os.path.join(app.root_path, 'assets', 'scripts', 'app.js')]
+    for root, _, names in os.walk(os.path.join(app.root_path, 'templates')):
+        paths.extend(
+            os.path.join(root, name) for name in names
+            if name.endswith('.html'))
+    return sorted(paths)
+
+
+def _statements(css):
+    """
+    Split a stylesheet into its top-level statements, as (prelude, block)
+    pairs with a block of None for statements like `@import ...;`.
+    Comments are dropped, except the one the file starts with.
+    """
+    statements = []
+    i, start, depth, prelude, n = 0, 0, 0, '', len(css)
+    while i < n:
+        char = css[i]
+        if css.startswith('/*', i):
+            end = css.find('*/', i + 2)
+            end = n if end < 0 else end + 2
+            if depth == 0:
+                if not statements and not css[:i].strip():
+                    statements.append((css[i:end], False))
+                start = end
+            i = end
+            continue
+        if char in '"\'':
+            i += 1
+            while i < n and css[i] != char:
+                i += 2 if css[i] == '\\' else 1
+        elif char == '{':
+            if depth == 0:
+                prelude = css[start:i].strip()
+                start = i + 1
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                statements.append((prelude, css[start:i]))
+                start = i + 1
+        elif char == ';' and depth == 0:
+            statements.append((css[start:i].strip(), None))
+            start = i + 1
+        i += 1
+    return statements
+
+
+def _selectors(prelude):
+    """Split a selector list on the commas outside brackets."""
+    selectors, depth, start = [], 0, 0
+    for i, char in enumerate(prelude):
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            selectors.append(prelude[start:i])
+            start = i + 1
+    selectors.append(prelude[start:])
+    return [selector.strip() for selector in selectors]
+
+
+def purge_css(css, words, safelist=SAFELIST, drop=(), skip=None):
+    """
+    Drop the rules of `css` whose selectors name a class that is not among
+    `words` or `safelist`. A selector list keeps the selectors that may
+    match. At-rules starting with any of `drop`, and selectors `skip`
+    matches, are removed too.
+    """
+    keep = set(words) | set(safelist)
+    out = []
+    for prelude, block in _statements(css):
+        if block is False:
+            out.append(prelude)
+        elif prelude.startswith(tuple(drop)):
+            continue
+        elif block is None:
+            out.append(prelude + ';')
+        elif prelude.startswith(KEPT_AT_RULES):
+            out.append('%s{%s}' % (prelude, block))
+        elif prelude.startswith('@'):
+            inner = purge_css(block, keep, (), drop, skip)
+            if inner:
+                out.append('%s{%s}' % (prelude, inner))
+        else:
+            selectors = [
+                selector for selector in _selectors(prelude)
+                if set(_class.findall(_ignored.sub('', selector))) <= keep
+                and not (skip and skip.search(selector))
+            ]
+            if selectors:
+                out.append('%s{%s}' % (','.join(selectors), block))
+    return ''.join(out)
+
+
+def critical_css(css, words):
+    """
+    The part of `css` the shell of every page (layout, nav, flashes)
+    needs to be drawn, to inline in `<head>` while the full stylesheet
+    loads. Nothing scripts have run yet, so there is no safelist and no
+    interactive states. Fonts and animations are left to the full
+    stylesheet; inlined, their relative URLs would point elsewhere.
+    """
+    return purge_css(css, words, (),
+                     drop=('@import', '@font-face', '@keyframes',
+                           '@-webkit-keyframes'),
+                     skip=_interactive)
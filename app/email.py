@@ -1,19 +1,271 @@
-import os
+import smtplib
+import threading
 
-from flask import render_template
+from flask import current_app
 from flask_mail import Message
+from flask_rq import get_queue
+from rq.job import JobStatus
+from rq.timeouts import BaseTimeoutException
 
-from app import create_app
 from app import mail
+from app.models import User
+from app.worker import worker_app
 
+# Types allowed in an email job's template context. Anything richer (ORM
+# instances in particular) would be pickled into Redis with all its state.
+JOB_CONTEXT_TYPES = (str, int, float, bool, type(None))
 
-def send_email(recipient, subject, template, **kwargs):
-    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
-    with app.app_context():
-        msg = Message(
-            app.config['EMAIL_SUBJECT_PREFIX'] + ' ' + subject,
-            sender=app.config['EMAIL_SENDER'],
-            recipients=[recipient])
-        msg.body = render_template(template + '.txt', **kwargs)
-        msg.html = render_template(template + '.html', **kwargs)
-        mail.send(msg)
+
+def _job_kwargs(recipient, subject, template, user=None, user_id=None,
+                **context):
+    for key, value in context.items():
+        if not isinstance(value, JOB_CONTEXT_TYPES):
+            raise TypeError('Email context value {!r} is a {}, not a plain '
+                            'value'.format(key, type(value).__name__))
+    return dict(
+        recipient=recipient,
+        subject=subject,
+        template=template,
+        user_id=user.id if user is not None else user_id,
+        **context)
+
+
+def enqueue_email(recipient, subject, template, user=None, **context):
+    """
+    Queue an email job. Only `user.id` is stored in the job; the worker loads
+    the user again before rendering. The remaining template context must be
+    made of plain values.
+    """
+    return get_queue().enqueue(
+        send_email, **_job_kwargs(recipient, subject, template, user,
+                                  **context))
+
+
+def enqueue_emails(emails, queue=None):
+    """
+    Queue many email jobs in one Redis round trip. Each item of `emails`
+    holds the arguments `enqueue_email` takes, or `user_id` in place of
+    `user`.
+    """
+    queue = queue or get_queue()
+    jobs = []
+    with queue.connection.pipeline() as pipe:
+        for email in emails:
+            job = queue.job_class.create(
+                send_email,
+                kwargs=_job_kwargs(**email),
+                connection=queue.connection,
+                status=JobStatus.QUEUED,
+                origin=queue.name)
+            jobs.append(queue.enqueue_job(job, pipeline=pipe))
+        pipe.execute()
+    return jobs
+
+
+def load_users(jobs_kwargs):
+    """Load the users referenced by several email jobs in one query."""
+    ids = set(kw.get('user_id') for kw in jobs_kwargs) - set([None])
+    if not ids:
+        return {}
+    return {u.id: u for u in User.query.filter(User.id.in_(ids))}
+
+
+class EmailRenderer(object):
+    """
+    Renders the `.txt` and `.html` parts of email templates.
+
+    Jinja already keeps compiled templates. What `render_many` saves is the
+    shared template context: it runs the context processors once for a whole
+    batch of recipients, instead of once per message as `render_template`
+    does.
+    """
+
+    def templates(self, template):
+        """Return the text and HTML templates for an email."""
+        env = current_app.jinja_env
+        return (env.get_template(template + '.txt'),
+                env.get_template(template + '.html'))
+
+    def base_context(self):
+        context = {}
+        current_app.update_template_context(context)
+        return context
+
+    def render(self, template, **context):
+        """Render one email, returning its text and HTML bodies."""
+        return self.render_many(template, [context])[0]
+
+    def render_many(self, template, contexts):
+        """Render one email template for each of the given contexts."""
+        txt, html = self.templates(template)
+        base = self.base_context()
+        rendered = []
+        for context in contexts:
+            full = dict(base)
+            full.update(context)
+            rendered.append((txt.render(full), html.render(full)))
+        return rendered
+
+
+renderer = EmailRenderer()
+
+
+def _job_fields(args, kwargs, users):
+    """Split a `send_email` job into its fields and template context."""
+    def bind(recipient, subject, template, user_id=None, **context):
+        if user_id is not None:
+            if user_id not in users:
+                raise LookupError('User {} no longer exists'.format(user_id))
+            context['user'] = users[user_id]
+        return recipient, subject, template, context
+
+    return bind(*args, **kwargs)
+
+
+def message_for_job(args, kwargs, users):
+    """Build the message for a queued `send_email` job."""
+    recipient, subject, template, context = _job_fields(args, kwargs, users)
+    return build_message(recipient, subject, template, **context)
+
+
+def messages_for_jobs(jobs, users):
+    """
+    Build the messages for several `send_email` jobs, given as (args, kwargs)
+    pairs. Jobs sharing a template are rendered together. Returns, per job,
+    either its message or the exception raised while building it.
+    """
+    results = [None] * len(jobs)
+    groups = {}
+    for i, (args, kwargs) in enumerate(jobs):
+        try:
+            fields = _job_fields(args, kwargs, users)
+        except Exception as e:  # noqa
+            results[i] = e
+            continue
+        groups.setdefault(fields[2], []).append((i, fields))
+
+    for template, items in groups.items():
+        try:
+            rendered = renderer.render_many(
+                template, [fields[3] for _, fields in items])
+        except Exception:  # noqa
+            # Find out which of the contexts is at fault
+            rendered = None
+        for n, (i, (recipient, subject, _, context)) in enumerate(items):
+            try:
+                body, html = rendered[n] if rendered is not None else \
+                    renderer.render(template, **context)
+                results[i] = _message(recipient, subject, body, html)
+            except Exception as e:  # noqa
+                results[i] = e
+    return results
+
+
+def build_message(recipient, subject, template, **kwargs):
+    """Render an email template into a message, ready to be sent."""
+    body, html = renderer.render(template, **kwargs)
+    return _message(recipient, subject, body, html)
+
+
+def _message(recipient, subject, body, html):
+    msg = Message(
+        current_app.config['EMAIL_SUBJECT_PREFIX'] + ' ' + subject,
+        sender=current_app.config['EMAIL_SENDER'],
+        recipients=[recipient])
+    msg.body = body
+    msg.html = html
+    return msg
+
+
+def send_email(recipient, subject, template, user_id=None, **kwargs):
+    with worker_app.app_context():
+        kwargs['user_id'] = user_id
+        mail.send(
+            message_for_job((recipient, subject, template), kwargs,
+                            load_users([kwargs])))
+
+
+def deliver_batch(messages, results=None):
+    """
+    Send several messages over a single SMTP connection.
+
+    Flask-Mail reconnects by itself every `MAIL_MAX_EMAILS` messages; after a
+    failed message the connection is dropped and reopened for the next one,
+    since the server may have left the session in an unknown state. Returns
+    one entry per message: None if it was sent, or the exception raised.
+    The entries are appended to `results` as they come, so a caller whose
+    job timeout cuts the batch short knows which messages went out.
+    """
+    results = [] if results is None else results
+    conn = None
+    try:
+        for msg in messages:
+            try:
+                if conn is None:
+                    conn = mail.connect().__enter__()
+                conn.send(msg)
+                results.append(None)
+            except BaseTimeoutException:
+                raise
+            except Exception as e:  # noqa
+                results.append(e)
+                _close_connection(conn)
+                conn = None
+    except BaseException:
+        # Cut short: close without waiting on a server that may hang
+        _close_connection(conn)
+        conn = None
+        raise
+    finally:
+        if conn is not None:
+            _close_connection(conn, quit=True)
+    return results
+
+
+class SMTPConnectionPool(object):
+    """
+    A bounded pool of SMTP connections to `MAIL_SERVER`, shared by threads.
+
+    At most `size` conversations with the relay are open at once; callers
+    beyond that wait for a connection to be returned. Idle connections are
+    kept open and reused, and a connection that fails is dropped.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def send(self, msg):
+        """Send a message on a pooled connection (needs an app context)."""
+        with self._slots:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = mail.connect().__enter__()
+            try:
+                conn.send(msg)
+            except Exception:  # noqa
+                _close_connection(conn)
+                raise
+            with self._lock:
+                self._idle.append(conn)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            _close_connection(conn, quit=True)
+
+
+def _close_connection(conn, quit=False):
+    if conn is None or conn.host is None:
+        return
+    try:
+        if quit:
+            conn.host.quit()
+        else:
+            conn.host.close()
+    except (smtplib.SMTPException, OSError):
+        conn.host.close()
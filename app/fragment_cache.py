@@ -0,0 +1,44 @@
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from app.cache import LRUCache
+
+
+class FragmentCacheExtension(Extension):
+    """
+    A `{% cache key, ... %}...{% endcache %}` tag that renders its body once
+    per distinct key and then reuses the output.
+
+    The key is every expression after `cache` along with where the tag is,
+    so the body must depend on nothing else. Fragments are kept in the
+    environment's `fragment_cache`, an `LRUCache`; with a `maxsize` of 0 the
+    body is always rendered.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache=LRUCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        keys = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            keys.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        where = nodes.Const('%s:%d' % (parser.name, lineno))
+        return nodes.CallBlock(
+            self.call_method('_cache', [where, nodes.List(keys)]), [], [],
+            body).set_lineno(lineno)
+
+    def _cache(self, where, keys, caller):
+        cache = self.environment.fragment_cache
+        if not cache.maxsize:
+            return caller()
+        key = (where, ) + tuple(keys)
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, fragment)
+        return fragment
@@ -0,0 +1,324 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app, has_app_context
+from werkzeug.security import (
+    check_password_hash,
+    gen_salt,
+    generate_password_hash,
+)
+
+try:
+    import argon2
+except ImportError:  # argon2-cffi is optional
+    argon2 = None
+
+SALT_LENGTH = 16
+
+
+class HashingBusy(Exception):
+    """Every hashing slot stayed taken for the whole wait; shown as a 503."""
+
+
+class HashPolicy(object):
+    """
+    How new password hashes are made: the method and its cost.
+
+    `method` is 'pbkdf2:<digest>' (hashed by werkzeug, costing `iterations`),
+    'scrypt' (costing `scrypt_n`, `scrypt_r` and `scrypt_p`) or 'argon2'
+    (costing `argon2_time_cost`, `argon2_memory_cost` KiB and
+    `argon2_parallelism`, and needing argon2-cffi). Every hash records its
+    method and cost, so hashes made under an older policy still verify.
+    """
+
+    def __init__(self, method='pbkdf2:sha256', iterations=150000,
+                 scrypt_n=2**15, scrypt_r=8, scrypt_p=1, argon2_time_cost=3,
+                 argon2_memory_cost=65536, argon2_parallelism=4):
+        if method == 'argon2' and argon2 is None:
+            raise ValueError('argon2 hashing needs argon2-cffi installed')
+        if method not in ('scrypt', 'argon2') and \
+                not method.startswith('pbkdf2:'):
+            raise ValueError('Unknown password hash method %r' % method)
+        self.method = method
+        self.iterations = iterations
+        self.scrypt_n = scrypt_n
+        self.scrypt_r = scrypt_r
+        self.scrypt_p = scrypt_p
+        self.argon2_time_cost = argon2_time_cost
+        self.argon2_memory_cost = argon2_memory_cost
+        self.argon2_parallelism = argon2_parallelism
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            method=config['PASSWORD_HASH_METHOD'],
+            iterations=config['PASSWORD_HASH_ITERATIONS'],
+            scrypt_n=config['PASSWORD_HASH_SCRYPT_N'],
+            scrypt_r=config['PASSWORD_HASH_SCRYPT_R'],
+            scrypt_p=config['PASSWORD_HASH_SCRYPT_P'],
+            argon2_time_cost=config['PASSWORD_HASH_ARGON2_TIME_COST'],
+            argon2_memory_cost=config['PASSWORD_HASH_ARGON2_MEMORY_COST'],
+            argon2_parallelism=config['PASSWORD_HASH_ARGON2_PARALLELISM'])
+
+    def _argon2(self):
+        return argon2.PasswordHasher(
+            time_cost=self.argon2_time_cost,
+            memory_cost=self.argon2_memory_cost,
+            parallelism=self.argon2_parallelism)
+
+    def prefix(self):
+        """The start of every hash this policy makes, up to the salt."""
+        if self.method == 'scrypt':
+            return 'scrypt:%d:%d:%d$' % (self.scrypt_n, self.scrypt_r,
+                                         self.scrypt_p)
+        if self.method == 'argon2':
+            return '$argon2id$v=%d$m=%d,t=%d,p=%d$' % (
+                argon2.low_level.ARGON2_VERSION, self.argon2_memory_cost,
+                self.argon2_time_cost, self.argon2_parallelism)
+        return '%s:%d$' % (self.method, self.iterations)
+
+    def hash(self, password):
+        if self.method == 'scrypt':
+            salt = gen_salt(SALT_LENGTH)
+            return '%s%s$%s' % (self.prefix(), salt, _scrypt(
+                password, salt, self.scrypt_n, self.scrypt_r, self.scrypt_p))
+        if self.method == 'argon2':
+            return self._argon2().hash(password)
+        return generate_password_hash(
+            password, '%s:%d' % (self.method, self.iterations), SALT_LENGTH)
+
+    def needs_rehash(self, pwhash):
+        """Whether `pwhash` was made by another method or at another cost."""
+        return not (pwhash or '').startswith(self.prefix())
+
+    def describe(self):
+        """The config variables that select this policy."""
+        settings = [('PASSWORD_HASH_METHOD', self.method)]
+        if self.method == 'scrypt':
+            settings += [('PASSWORD_HASH_SCRYPT_N', self.scrypt_n),
+                         ('PASSWORD_HASH_SCRYPT_R', self.scrypt_r),
+                         ('PASSWORD_HASH_SCRYPT_P', self.scrypt_p)]
+        elif self.method == 'argon2':
+            settings += [
+                ('PASSWORD_HASH_ARGON2_TIME_COST', self.argon2_time_cost),
+                ('PASSWORD_HASH_ARGON2_MEMORY_COST', self.argon2_memory_cost),
+                ('PASSWORD_HASH_ARGON2_PARALLELISM', self.argon2_parallelism)
+            ]
+        else:
+            settings.append(('PASSWORD_HASH_ITERATIONS', self.iterations))
+        return settings
+
+
+def _scrypt(password, salt, n, r, p):
+    key = hashlib.scrypt(
+        password.encode('utf-8'), salt=salt.encode('utf-8'), n=n, r=r, p=p,
+        maxmem=256 * n * r * p, dklen=64)
+    return base64.b16encode(key).decode('ascii').lower()
+
+
+def make_hash(policy, password):
+    return policy.hash(password)
+
+
+def verify_hash(pwhash, password):
+    """Check a password against a hash made under any policy."""
+    if not pwhash:
+        return False
+    if pwhash.startswith('$argon2'):
+        if argon2 is None:
+            return False
+        try:
+            return argon2.PasswordHasher().verify(pwhash, password)
+        except argon2.exceptions.VerificationError:
+            return False
+    if pwhash.startswith('scrypt:'):
+        try:
+            method, salt, hashval = pwhash.split('$', 2)
+            n, r, p = (int(v) for v in method.split(':')[1:])
+        except ValueError:
+            return False
+        return hmac.compare_digest(_scrypt(password, salt, n, r, p),
+                                   hashval)
+    return check_password_hash(pwhash, password)
+
+
+def calibrate(method='pbkdf2:sha256', target=0.25, policy=None):
+    """
+    Find the cost for `method` that takes about `target` seconds to verify a
+    password on this machine. Returns the policy and the time it measured.
+    """
+    base = policy or HashPolicy()
+
+    def timed(candidate):
+        start = time.time()
+        candidate.hash('calibration password')
+        return time.time() - start
+
+    def with_cost(**cost):
+        settings = dict(vars(base), method=method)
+        settings.update(cost)
+        return HashPolicy(**settings)
+
+    if method == 'scrypt':
+        # Memory grows with n, so only step it in powers of two
+        n = 2**10
+        elapsed = timed(with_cost(scrypt_n=n))
+        while elapsed * 2 <= target and n < 2**20:
+            n *= 2
+            elapsed = timed(with_cost(scrypt_n=n))
+        candidate = with_cost(scrypt_n=n)
+    elif method == 'argon2':
+        cost = 1
+        elapsed = timed(with_cost(argon2_time_cost=cost))
+        while elapsed * (cost + 1) / cost <= target and cost < 100:
+            cost += 1
+            elapsed = timed(with_cost(argon2_time_cost=cost))
+        candidate = with_cost(argon2_time_cost=cost)
+    else:
+        # PBKDF2 costs the same per iteration, so scale a short sample
+        sample = 20000
+        per_iteration = min(timed(with_cost(iterations=sample))
+                            for _ in range(3)) / sample
+        iterations = max(int(target / per_iteration), 1000)
+        # Then correct for the overhead a short sample hides
+        elapsed = min(timed(with_cost(iterations=iterations))
+                      for _ in range(3))
+        iterations = max(int(iterations * target / elapsed), 1000)
+        candidate = with_cost(iterations=iterations // 1000 * 1000)
+    return candidate, min(timed(candidate) for _ in range(3))
+
+
+def _timed(func, args):
+    """Run `func` in a pool process, reporting when it started and how long
+    it took."""
+    start = time.time()
+    result = func(*args)
+    return result, start, time.time() - start
+
+
+class HashingService(object):
+    """
+    Runs password hashes in a pool of `workers` processes.
+
+    Key derivation is deliberately slow and holds the GIL, so hashing in the
+    request's own process stalls every other request it could be serving.
+    The pool does it elsewhere, and bounds how much of it there is: once
+    `workers` hashes are running and `queue_size` more are waiting, a new
+    one waits at most `wait` seconds for room and then raises `HashingBusy`,
+    so a flood of logins fails fast instead of queueing without limit.
+
+    With `workers` set to 0 hashes run in the calling thread, still bounded
+    the same way.
+
+    The pool and the bound are per process. They pay off when a process
+    serves requests on several threads; a sync worker serving one request
+    at a time never fills the queue and gains nothing from the pool.
+    """
+
+    def __init__(self, workers=2, queue_size=8, wait=1.0):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_size)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.hashes = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.hash_seconds = 0.0
+
+    def _pool(self):
+        # A pool made before a fork (gunicorn --preload) belongs to the
+        # parent, so each process makes its own on first use.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(self.workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    def run(self, func, *args):
+        """Call `func(*args)` in a slot, raising `HashingBusy` if none frees
+        up in time."""
+        submitted = time.time()
+        if not self._slots.acquire(timeout=self.wait):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy()
+        try:
+            if self.workers:
+                result, start, elapsed = self._pool().submit(
+                    _timed, func, args).result()
+            else:
+                result, start, elapsed = _timed(func, args)
+        finally:
+            self._slots.release()
+        waited = max(start - submitted, 0.0)
+        with self._lock:
+            self.hashes += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self.hash_seconds += elapsed
+        return result
+
+    def stats(self):
+        """Time spent waiting for a slot against time spent hashing."""
+        return {
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'hashes': self.hashes,
+            'rejected': self.rejected,
+            'avg_wait_seconds': self.wait_seconds / self.hashes
+            if self.hashes else None,
+            'max_wait_seconds': self.max_wait_seconds,
+            'avg_hash_seconds': self.hash_seconds / self.hashes
+            if self.hashes else None,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def get_hashing_service():
+    """The hashing service of the current application, made on first use."""
+    extensions = current_app.extensions
+    if extensions.get('hashing') is None:
+        config = current_app.config
+        extensions['hashing'] = HashingService(
+            config['PASSWORD_HASH_WORKERS'], config['PASSWORD_HASH_QUEUE'],
+            config['PASSWORD_HASH_WAIT'])
+    return extensions['hashing']
+
+
+def get_hash_policy():
+    """The hash policy of the current application."""
+    extensions = current_app.extensions
+    if extensions.get('hash_policy') is None:
+        extensions['hash_policy'] = HashPolicy.from_config(current_app.config)
+    return extensions['hash_policy']
+
+
+def hash_password(password):
+    if not has_app_context():
+        return HashPolicy().hash(password)
+    return get_hashing_service().run(make_hash, get_hash_policy(), password)
+
+
+def check_password(pwhash, password):
+    if not has_app_context():
+        return verify_hash(pwhash, password)
+    return get_hashing_service().run(verify_hash, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """Whether a hash should be remade under the current policy."""
+    return get_hash_policy().needs_rehash(pwhash)
@@ -1,5 +1,6 @@
 from flask import render_template
 
+from app.hashing import HashingBusy
 from app.main.views import main
 
 
@@ -16,3 +17,8 @@ def page_not_found(_):
 @main.app_errorhandler(500)
 def internal_server_error(_):
     return render_template('errors/500.html'), 500
+
+
+@main.app_errorhandler(HashingBusy)
+def service_unavailable(_):
+    return render_template('errors/503.html'), 503, {'Retry-After': '5'}
@@ -1,17 +1,18 @@
 from flask import Blueprint, render_template
 
-from app.models import EditableHTML
+from app.page_cache import cache_page
+from app.utils import render_editable_page
 
 main = Blueprint('main', __name__)
 
 
 @main.route('/')
+@cache_page()
 def index():
     return render_template('main/index.html')
 
 
 @main.route('/about')
+@cache_page()
 def about():
-    editable_html_obj = EditableHTML.get_editable_html('about')
-    return render_template(
-        'main/about.html', editable_html_obj=editable_html_obj)
+    return render_editable_page('main/about.html', 'about')
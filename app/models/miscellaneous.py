@@ -1,3 +1,13 @@
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
 from .. import db
 
 
@@ -14,3 +24,112 @@ class EditableHTML(db.Model):
         if editable_html_obj is None:
             editable_html_obj = EditableHTML(editor_name=editor_name, value='')
         return editable_html_obj
+
+
+# What `render_inline_editor` needs, plus validators for conditional GETs:
+# `etag` is a digest of the value, so every process agrees on it, and
+# `last_modified` is when this process first saw that value.
+EditableContent = namedtuple(
+    'EditableContent', 'editor_name value version etag last_modified')
+
+
+class EditableHTMLStore(object):
+    """
+    A process-wide copy of editable page content.
+
+    Content is read once per editor and then served from memory, so pages
+    built around an inline editor cost no queries until an editor is saved.
+    Saving bumps that editor's version and drops its copy; copies read while
+    a save was in progress are not kept. Saves made by other processes are
+    picked up after `EDITABLE_HTML_CACHE_TTL` seconds.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, editor_name):
+        """The content of `editor_name`, empty if it was never saved."""
+        ttl = current_app.config.get('EDITABLE_HTML_CACHE_TTL')
+        cached = self._entries.get(editor_name)
+        if cached is not None and \
+                not (ttl and time.time() - cached[1] > ttl):
+            return cached[0]
+
+        with self._lock:
+            version = self._versions.get(editor_name, 0)
+        value = db.session.query(EditableHTML.value).filter_by(
+            editor_name=editor_name).scalar() or ''
+        etag = hashlib.sha1(value.encode('utf-8')).hexdigest()
+        with self._lock:
+            previous = self._entries.get(editor_name)
+            if previous is not None and previous[0].etag == etag:
+                last_modified = previous[0].last_modified
+            else:
+                last_modified = datetime.utcnow().replace(microsecond=0)
+            content = EditableContent(editor_name, value, version, etag,
+                                      last_modified)
+            if self._versions.get(editor_name, 0) == version:
+                self._entries[editor_name] = (content, time.time())
+        return content
+
+    def invalidate(self, editor_names=None):
+        """Forget some editors, or with None all of them, along with the
+        cached pages showing them."""
+        with self._lock:
+            names = editor_names
+            if names is None:
+                names = set(self._entries) | set(self._versions)
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+                self._entries.pop(name, None)
+        if has_app_context():
+            from ..page_cache import invalidate_pages
+            if editor_names is None:
+                invalidate_pages('editable_html')
+            else:
+                invalidate_pages(*('editable_html:' + name
+                                   for name in editor_names))
+
+
+editable_html_store = EditableHTMLStore()
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_editable_html_writes(session, flush_context):
+    names = {
+        obj.editor_name
+        for obj in list(session.new) + list(session.dirty) +
+        list(session.deleted) if isinstance(obj, EditableHTML)
+    }
+    if names:
+        session.info.setdefault('editors_changed', set()).update(names)
+
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def _note_bulk_editable_html_writes(context):
+    if context.mapper.class_ is EditableHTML:
+        context.session.info['all_editors_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_editable_html_on_commit(session):
+    if session.info.pop('all_editors_changed', False):
+        session.info.pop('editors_changed', None)
+        editable_html_store.invalidate()
+    elif 'editors_changed' in session.info:
+        editable_html_store.invalidate(session.info.pop('editors_changed'))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_editable_html_writes(session):
+    session.info.pop('editors_changed', None)
+    session.info.pop('all_editors_changed', None)
+
+
+@event.listens_for(EditableHTML.__table__, 'after_create')
+@event.listens_for(EditableHTML.__table__, 'after_drop')
+def _invalidate_editable_html_on_ddl(target, connection, **kwargs):
+    editable_html_store.invalidate()
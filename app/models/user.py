@@ -1,10 +1,20 @@
-from flask import current_app
+import json
+import threading
+import time
+from itertools import chain
+
+from flask import current_app, has_app_context
 from flask_login import AnonymousUserMixin, UserMixin
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from itsdangerous import BadSignature, SignatureExpired
-from werkzeug.security import check_password_hash, generate_password_hash
+from redis.exceptions import RedisError
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 
 from .. import db, login_manager
+from ..cache import LRUCache
+from ..hashing import check_password, hash_password, needs_rehash
 
 
 class Permission:
@@ -45,6 +55,121 @@ class Role(db.Model):
         return '<Role \'%s\'>' % self.name
 
 
+class RoleRegistry(object):
+    """
+    A process-wide copy of the roles table.
+
+    Roles are few and almost never change, but nearly every request needs
+    one. The registry loads them all in one query and hands out copies
+    attached to the current session, so resolving a role costs no queries
+    until a role is written. Writes made by other processes are picked up
+    after `ROLE_CACHE_TTL` seconds.
+    """
+
+    def __init__(self):
+        self._roles = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        roles = self._roles
+        ttl = current_app.config.get('ROLE_CACHE_TTL')
+        if roles is not None and \
+                not (ttl and time.time() - self._loaded_at > ttl):
+            return roles
+
+        with self._lock:
+            generation = self._generation
+        rows = db.session.query(Role.id, Role.name, Role.index, Role.default,
+                                Role.permissions).order_by(Role.permissions)
+        roles = []
+        for row in rows:
+            # Detached copies: they belong to no session and are never
+            # expired, so every session can merge them in without a query.
+            role = Role(id=row.id, name=row.name, index=row.index,
+                        default=row.default, permissions=row.permissions)
+            make_transient_to_detached(role)
+            roles.append(role)
+        with self._lock:
+            # Don't keep roles read while they were being changed
+            if self._generation == generation:
+                self._roles = roles
+                self._loaded_at = time.time()
+        return roles
+
+    def _attach(self, role):
+        if role is None:
+            return None
+        return db.session.merge(role, load=False)
+
+    def all(self):
+        """Every role, ordered by permissions."""
+        return [self._attach(r) for r in self._load()]
+
+    def get(self, role_id):
+        return self._attach(
+            next((r for r in self._load() if r.id == role_id), None))
+
+    def by_name(self, name):
+        return self._attach(
+            next((r for r in self._load() if r.name == name), None))
+
+    def by_permissions(self, permissions):
+        return self._attach(
+            next((r for r in self._load() if r.permissions == permissions),
+                 None))
+
+    def default(self):
+        return self._attach(next((r for r in self._load() if r.default),
+                                 None))
+
+    def invalidate(self):
+        """Forget the loaded roles; the next lookup reads them again."""
+        with self._lock:
+            self._generation += 1
+            self._roles = None
+
+
+role_registry = RoleRegistry()
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_role_writes(session, flush_context):
+    # A role counts as dirty when users are added to it; only its own
+    # columns matter here.
+    if any(isinstance(obj, Role) for obj in chain(session.new,
+                                                  session.deleted)) or any(
+            isinstance(obj, Role) and
+            session.is_modified(obj, include_collections=False)
+            for obj in session.dirty):
+        session.info['roles_changed'] = True
+
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def _note_bulk_role_writes(context):
+    if context.mapper.class_ is Role:
+        context.session.info['roles_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_roles_on_commit(session):
+    if session.info.pop('roles_changed', False):
+        role_registry.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_role_writes(session):
+    session.info.pop('roles_changed', None)
+
+
+@event.listens_for(Role.__table__, 'after_create')
+@event.listens_for(Role.__table__, 'after_drop')
+def _invalidate_roles_on_ddl(target, connection, **kwargs):
+    role_registry.invalidate()
+
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -52,17 +177,32 @@ class User(UserMixin, db.Model):
     first_name = db.Column(db.String(64), index=True)
     last_name = db.Column(db.String(64), index=True)
     email = db.Column(db.String(64), unique=True, index=True)
-    password_hash = db.Column(db.String(128))
-    role_id = db.Column(db.Integer, db.ForeignKey('roles.id'))
+    password_hash = db.Column(db.String(255))
+    role_id = db.Column(db.Integer, db.ForeignKey('roles.id'), index=True)
+
+    # The registered users filter matches `lower(column) LIKE 'prefix%'`
+    # (app/admin/listing.py); with text_pattern_ops Postgres answers that
+    # from these indexes
+    __table_args__ = (
+        db.Index('ix_users_first_name_lower',
+                 func.lower(first_name).label('first_name_lower'),
+                 postgresql_ops={'first_name_lower': 'text_pattern_ops'}),
+        db.Index('ix_users_last_name_lower',
+                 func.lower(last_name).label('last_name_lower'),
+                 postgresql_ops={'last_name_lower': 'text_pattern_ops'}),
+        db.Index('ix_users_email_lower',
+                 func.lower(email).label('email_lower'),
+                 postgresql_ops={'email_lower': 'text_pattern_ops'}),
+    )
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
         if self.role is None:
             if self.email == current_app.config['ADMIN_EMAIL']:
-                self.role = Role.query.filter_by(
-                    permissions=Permission.ADMINISTER).first()
+                self.role = role_registry.by_permissions(
+                    Permission.ADMINISTER)
             if self.role is None:
-                self.role = Role.query.filter_by(default=True).first()
+                self.role = role_registry.default()
 
     def full_name(self):
         return '%s %s' % (self.first_name, self.last_name)
@@ -80,16 +220,27 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return check_password(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        """Whether the password hash predates the current hash policy."""
+        return needs_rehash(self.password_hash)
 
     def generate_confirmation_token(self, expiration=604800):
         """Generate a confirmation token to email a new user."""
+        return User.confirmation_token(self.id, expiration)
 
+    @staticmethod
+    def confirmation_token(user_id, expiration=604800):
+        """
+        Generate the confirmation token of the user with this id, for when
+        only ids are at hand (bulk invitations, say).
+        """
         s = Serializer(current_app.config['SECRET_KEY'], expiration)
-        return s.dumps({'confirm': self.id})
+        return s.dumps({'confirm': user_id})
 
     def generate_email_change_token(self, new_email, expiration=3600):
         """Generate an email change token to email an existing user."""
@@ -153,28 +304,9 @@ class User(UserMixin, db.Model):
     @staticmethod
     def generate_fake(count=100, **kwargs):
         """Generate a number of fake users for testing."""
-        from sqlalchemy.exc import IntegrityError
-        from random import seed, choice
-        from faker import Faker
-
-        fake = Faker()
-        roles = Role.query.all()
-
-        seed()
-        for i in range(count):
-            u = User(
-                first_name=fake.first_name(),
-                last_name=fake.last_name(),
-                email=fake.email(),
-                password='password',
-                confirmed=True,
-                role=choice(roles),
-                **kwargs)
-            db.session.add(u)
-            try:
-                db.session.commit()
-            except IntegrityError:
-                db.session.rollback()
+        from app.seeding import seed_users
+
+        return seed_users(count, **kwargs)
 
     def __repr__(self):
         return '<User \'%s\'>' % self.full_name()
@@ -191,6 +323,175 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser
 
 
+class UserCache(object):
+    """
+    The users Flask-Login loads on every authenticated request.
+
+    A user's columns, less the password hash, are kept in an in-process LRU
+    and optionally in Redis, where other processes can read them too.
+    Entries last `ttl` seconds, and a commit that changes or deletes a user
+    drops theirs at once. Users are handed out attached to the current
+    session, so they can be changed and committed like any loaded user.
+
+    With Redis, dropping an entry also bumps a version of the user (or,
+    for `clear`, of every user) there. Each entry records the versions it
+    was loaded under, and one that no longer matches is loaded again, so
+    no process serves a user another has changed. Without Redis, other
+    processes see a change once their entry expires.
+    """
+
+    prefix = 'user-cache:'
+    # Loaded from the database when needed, never copied out of it
+    excluded = ('password_hash',)
+
+    def __init__(self, maxsize=1024, ttl=60, redis=None):
+        self.local = LRUCache(maxsize, ttl)
+        self.ttl = ttl
+        self.redis = redis
+
+    def _key(self, user_id):
+        return '{}{}'.format(self.prefix, user_id)
+
+    def _version_key(self, user_id):
+        return '{}version:{}'.format(self.prefix, user_id)
+
+    def _fetch(self, user_id):
+        """Return the cached columns of the user, or None, and the version
+        to store them under once loaded."""
+        entry = self.local.get(user_id)
+        if self.redis is None:
+            return (entry[1] if entry else None), None
+        try:
+            generation, version, raw = self.redis.mget(
+                self.prefix + 'generation', self._version_key(user_id),
+                self._key(user_id))
+        except RedisError:
+            # Nothing to check against; trust the entry until it expires
+            return (entry[1] if entry else None), None
+        current = '{}:{}'.format(int(generation or 0), int(version or 0))
+        if entry is not None and entry[0] == current:
+            return entry[1], current
+        if raw is not None:
+            entry = json.loads(raw.decode('utf-8'))
+            if entry[0] == current:
+                self.local.set(user_id, entry)
+                return entry[1], current
+        return None, current
+
+    def _store(self, user, version):
+        data = {
+            attr.key: getattr(user, attr.key)
+            for attr in db.inspect(User).column_attrs
+            if attr.key not in self.excluded
+        }
+        self.local.set(user.id, (version, data))
+        if self.redis is not None and version is not None:
+            try:
+                self.redis.setex(self._key(user.id), self.ttl,
+                                 json.dumps((version, data)))
+            except RedisError:
+                pass
+
+    def _attach(self, data):
+        user = db.inspect(User).class_manager.new_instance()
+        for key, value in data.items():
+            set_committed_value(user, key, value)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def get(self, user_id):
+        """Return the user with this id, or None if there is none."""
+        data, version = self._fetch(user_id)
+        if data is not None:
+            return self._attach(data)
+        user = User.query.get(user_id)
+        if user is not None:
+            self._store(user, version)
+        return user
+
+    def _bump(self, key):
+        # Kept past the life of any entry made under the old version
+        pipe = self.redis.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, self.ttl * 2)
+        pipe.execute()
+
+    def invalidate(self, user_id):
+        self.local.delete(user_id)
+        if self.redis is not None:
+            try:
+                self._bump(self._version_key(user_id))
+                self.redis.delete(self._key(user_id))
+            except RedisError:
+                pass
+
+    def clear(self):
+        self.local.clear()
+        if self.redis is not None:
+            try:
+                self._bump(self.prefix + 'generation')
+                keys = list(self.redis.scan_iter(self.prefix + '[0-9]*'))
+                if keys:
+                    self.redis.delete(*keys)
+            except RedisError:
+                pass
+
+
+def get_user_cache():
+    """The user cache of the current application, made on first use."""
+    extensions = current_app.extensions
+    if extensions.get('user_cache') is None:
+        config = current_app.config
+        redis = None
+        if config['USER_CACHE_REDIS']:
+            from flask_rq import get_connection
+            redis = get_connection()
+        extensions['user_cache'] = UserCache(
+            config['USER_CACHE_SIZE'], config['USER_CACHE_TTL'], redis)
+    return extensions['user_cache']
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_user_writes(session, flush_context):
+    changed = [obj.id for obj in chain(session.dirty, session.deleted)
+               if isinstance(obj, User)]
+    if changed:
+        session.info.setdefault('users_changed', set()).update(changed)
+
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def _note_bulk_user_writes(context):
+    if context.mapper.class_ is User:
+        context.session.info['all_users_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_users_on_commit(session):
+    changed = session.info.pop('users_changed', None)
+    everyone = session.info.pop('all_users_changed', False)
+    if (changed or everyone) and has_app_context():
+        cache = get_user_cache()
+        if everyone:
+            cache.clear()
+        else:
+            for user_id in changed:
+                cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_user_writes(session):
+    session.info.pop('users_changed', None)
+    session.info.pop('all_users_changed', None)
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Every page checks the user's role (permissions, navigation), so take it
+    # from the role registry rather than loading it.
+    user = get_user_cache().get(int(user_id))
+    if user is not None and user.role_id is not None:
+        role = role_registry.get(user.role_id)
+        if role is not None:
+            set_committed_value(user, 'role', role)
+    return user
@@ -0,0 +1,261 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, get_template_attribute, request, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+from redis.exceptions import RedisError
+
+# What a hole looks like in a cached page
+HOLE = '<!--page-cache:%s-->'
+# Response headers kept with a cached page
+KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control')
+
+
+class MemoryPageStore(object):
+    """
+    Cached pages held in this process: at most `maxsize`, dropping the
+    least recently used, each for at most `ttl` seconds.
+    """
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._pages = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is None:
+                return None
+            if self.ttl and time.time() - entry[2] > self.ttl:
+                self._drop(key)
+                return None
+            self._pages.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, page, tags):
+        with self._lock:
+            self._drop(key)
+            self._pages[key] = (page, tags, time.time())
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._pages) > self.maxsize:
+                self._drop(next(iter(self._pages)))
+
+    def _drop(self, key):
+        entry = self._pages.pop(key, None)
+        if entry is not None:
+            for tag in entry[1]:
+                keys = self._tags.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._tags[tag]
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._tags.clear()
+
+
+class RedisPageStore(object):
+    """
+    Cached pages shared by every process through Redis, each kept for `ttl`
+    seconds. A tag is a set of the keys tagged with it. Redis being down
+    only means pages are rendered.
+    """
+
+    prefix = 'page-cache:'
+
+    def __init__(self, redis, ttl=300):
+        self.redis = redis
+        self.ttl = ttl
+
+    def get(self, key):
+        try:
+            raw = self.redis.get(self.prefix + key)
+        except RedisError:
+            return None
+        if raw is None:
+            return None
+        return tuple(json.loads(raw.decode('utf-8')))
+
+    def set(self, key, page, tags):
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.setex(self.prefix + key, self.ttl, json.dumps(page))
+            for tag in tags:
+                pipe.sadd(self.prefix + 'tag:' + tag, self.prefix + key)
+                pipe.expire(self.prefix + 'tag:' + tag, self.ttl)
+            pipe.execute()
+        except RedisError:
+            pass
+
+    def invalidate(self, tag):
+        tag_key = self.prefix + 'tag:' + tag
+        try:
+            keys = self.redis.smembers(tag_key)
+            self.redis.delete(tag_key, *keys)
+        except RedisError:
+            pass
+
+    def clear(self):
+        try:
+            keys = list(self.redis.scan_iter(self.prefix + '*'))
+            if keys:
+                self.redis.delete(*keys)
+        except RedisError:
+            pass
+
+
+def get_page_store():
+    """The page store of the current application, or None when caching is
+    off (`PAGE_CACHE` of 'none')."""
+    extensions = current_app.extensions
+    if 'page_cache' not in extensions:
+        config = current_app.config
+        backend = config['PAGE_CACHE']
+        if backend == 'redis':
+            from flask_rq import get_connection
+            store = RedisPageStore(get_connection(), config['PAGE_CACHE_TTL'])
+        elif backend == 'memory':
+            store = MemoryPageStore(config['PAGE_CACHE_SIZE'],
+                                    config['PAGE_CACHE_TTL'])
+        else:
+            store = None
+        extensions['page_cache'] = store
+    return extensions['page_cache']
+
+
+def invalidate_pages(*tags):
+    """Drop every cached page carrying any of `tags`."""
+    store = get_page_store()
+    if store is not None:
+        for tag in tags:
+            store.invalidate(tag)
+
+
+def clear_pages():
+    store = get_page_store()
+    if store is not None:
+        store.clear()
+
+
+def filling():
+    """Whether the page being rendered is going into the cache."""
+    return g.get('page_cache_filling', False)
+
+
+def tag_page(*tags):
+    """Add tags to the page being rendered, when it is going into the
+    cache."""
+    if filling():
+        g.page_cache_tags.update(tags)
+
+
+def page_cache_hole(name, render):
+    """
+    Template helper for a part of a page that differs per visitor: it
+    renders `render()` normally, and a placeholder that `fill_holes` fills
+    in when the page is going into the cache.
+    """
+    if filling():
+        return Markup(HOLE % name)
+    return render()
+
+
+def _flashes():
+    if '_flashes' not in session:
+        return ''
+    return str(get_template_attribute('partials/_flashes.html',
+                                      'flash_messages')())
+
+
+def fill_holes(body):
+    """Fill the holes in a cached page for this visitor."""
+    if HOLE % 'csrf_token' in body:
+        body = body.replace(HOLE % 'csrf_token', generate_csrf())
+    if HOLE % 'flashes' in body:
+        body = body.replace(HOLE % 'flashes', _flashes())
+    return body
+
+
+def _page_key():
+    from app.utils import _templates_modified
+    return '%s:%s%s' % (_templates_modified().isoformat(), request.host,
+                        request.full_path)
+
+
+def cache_page(*tags):
+    """
+    Cache what a view renders for anonymous GETs, invalidated by any of
+    `tags` or of those the view adds with `tag_page` (see
+    `invalidate_pages`).
+
+    Anonymous visitors all see the same page except for their CSRF token and
+    flashed messages. Those are left as holes in the cached copy and filled
+    in per request, so a hit costs a lookup and two string replacements
+    instead of running the view and its templates.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def cached_view(*args, **kwargs):
+            store = get_page_store()
+            if store is None or request.method not in ('GET', 'HEAD') or \
+                    current_user.is_authenticated:
+                return view(*args, **kwargs)
+
+            key = _page_key()
+            page = store.get(key)
+            if page is None:
+                g.page_cache_filling = True
+                g.page_cache_tags = set(tags)
+                try:
+                    response = current_app.make_response(
+                        view(*args, **kwargs))
+                finally:
+                    g.page_cache_filling = False
+                if response.status_code != 200 or \
+                        response.mimetype != 'text/html' or \
+                        response.is_streamed:
+                    # Not cached, but rendered with holes all the same
+                    if not response.is_streamed:
+                        response.set_data(
+                            fill_holes(response.get_data(as_text=True)))
+                    return response
+                body = response.get_data(as_text=True)
+                token = g.get(current_app.config.get(
+                    'WTF_CSRF_FIELD_NAME', 'csrf_token'))
+                if token:
+                    body = body.replace(token, HOLE % 'csrf_token')
+                page = (body, [(name, response.headers[name])
+                               for name in KEPT_HEADERS
+                               if name in response.headers])
+                store.set(key, page, sorted(g.page_cache_tags))
+
+            # A 304 would leave waiting flashes unseen
+            flashes = '_flashes' in session
+            body, headers = page
+            response = current_app.response_class(
+                fill_holes(body), headers=headers)
+            response.vary.add('Cookie')
+            if not flashes:
+                response.make_conditional(request)
+            return response
+
+        return cached_view
+
+    return decorator
@@ -0,0 +1,478 @@
+import functools
+import re
+from collections import Counter, defaultdict
+from itertools import islice
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, or_, text
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.models import User
+
+# How many candidate rows a backend hands over for ranking
+CANDIDATES = 50
+
+_words = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def trigrams(value, partial=False):
+    """
+    The padded trigrams of every word in `value`, as pg_trgm computes them:
+    each word gets two leading spaces and one trailing space, so short
+    prefixes of a word ('  g', ' gr') are trigrams of it too. With `partial`
+    the trailing space is left off, since a query may be a word still being
+    typed.
+    """
+    grams = set()
+    end = '' if partial else ' '
+    for word in _words.findall((value or '').lower()):
+        padded = '  ' + word + end
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def score(query, fields):
+    """
+    Rank a user for a query: 1 if every query word starts a word of the
+    user's fields (or the query starts a field), plus the share of the
+    query's trigrams found in those fields.
+    """
+    query = query.lower().strip()
+    values = [(f or '').lower() for f in fields]
+    words = [w for v in values for w in _words.findall(v)]
+    prefix = any(v.startswith(query) for v in values) or all(
+        any(w.startswith(q) for w in words) for q in _words.findall(query))
+    q_grams = trigrams(query, partial=True)
+    f_grams = set()
+    for v in values:
+        f_grams |= trigrams(v)
+    similarity = len(q_grams & f_grams) / float(len(q_grams)) \
+        if q_grams else 0.0
+    return (1.0 if prefix else 0.0) + similarity
+
+
+class SearchBackend(object):
+    """Finds candidate users for a query; `search` ranks them."""
+
+    name = None
+
+    def candidates(self, query, limit):
+        """Return (id, first_name, last_name, email) rows likely to match."""
+        raise NotImplementedError
+
+    def index(self, connection, rows):
+        """Add or refresh (id, first_name, last_name, email) rows."""
+
+    def remove(self, connection, ids):
+        """Drop users from the index."""
+
+    def reset(self):
+        """Bring the index back in step with `users`, now or when next
+        used."""
+
+    def search(self, query, limit=10, threshold=0.4):
+        query = (query or '').strip()
+        if not query:
+            return []
+        if len(query) < 3:
+            # Too few trigrams for similarity to mean anything
+            threshold = 1.0
+        ranked = []
+        for row in self.candidates(query, max(limit, CANDIDATES)):
+            s = score(query, row[1:])
+            if s >= threshold:
+                ranked.append((s, row))
+        ranked.sort(key=lambda r: (-r[0], r[1][0]))
+        return ranked[:limit]
+
+
+class NGramBackend(SearchBackend):
+    """
+    An in-process trigram index, for databases without a native one. It is
+    built from the users table on first use and then kept current by the
+    model hooks.
+
+    Only writes made through this process reach its index: with several
+    workers, each one misses the others' changes until it is restarted.
+    Use it for development or a single process; otherwise use SQLite's
+    FTS5 or PostgreSQL's pg_trgm, which live in the database.
+    """
+
+    name = 'ngram'
+
+    # Posting lists longer than this are only used if nothing rarer is
+    # available; a trigram shared by most users says little about a match.
+    max_posting = 5000
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.rows = {}
+        self.loaded = False
+
+    def load(self):
+        query = db.session.query(User.id, User.first_name, User.last_name,
+                                 User.email)
+        for row in query.yield_per(5000):
+            self._add(tuple(row))
+        self.loaded = True
+
+    def _add(self, row):
+        self._discard(row[0])
+        self.rows[row[0]] = row
+        for gram in trigrams(' '.join(f or '' for f in row[1:])):
+            self.postings[gram].add(row[0])
+
+    def _discard(self, user_id):
+        old = self.rows.pop(user_id, None)
+        if old is not None:
+            for gram in trigrams(' '.join(f or '' for f in old[1:])):
+                self.postings[gram].discard(user_id)
+
+    def reset(self):
+        self.postings = defaultdict(set)
+        self.rows = {}
+        self.loaded = False
+
+    def index(self, connection, rows):
+        if self.loaded:
+            for row in rows:
+                self._add(tuple(row))
+
+    def remove(self, connection, ids):
+        if self.loaded:
+            for user_id in ids:
+                self._discard(user_id)
+
+    def candidates(self, query, limit):
+        if not self.loaded:
+            self.load()
+        lists = sorted(
+            (self.postings.get(g, ())
+             for g in trigrams(query, partial=True)), key=len)
+        lists = [p for p in lists if p]
+        if not lists:
+            return []
+        rare = [p for p in lists if len(p) <= self.max_posting]
+        if rare:
+            counts = Counter()
+            for posting in rare:
+                counts.update(posting)
+            ids = [i for i, _ in counts.most_common(limit)]
+        else:
+            # Only common trigrams (a short prefix, say): take users having
+            # all of them, which set intersection finds quickly.
+            ids = list(islice(lists[0].intersection(*lists[1:]), limit))
+        return [self.rows[i] for i in ids]
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """
+    An FTS5 table with the trigram tokenizer (SQLite 3.34+), mirroring the
+    searchable user columns. It is created along with `users` and dropped
+    with it. A database made before it existed gets it, filled from
+    `users`, when a process first picks this backend, or from
+    `python manage.py setup_search`.
+
+    Writes to a missing table (dropped by another process, say) are
+    skipped, never failing the user write they follow, and searches fall
+    back to prefix matching on `users`: the table is refilled from `users`
+    when it is next created.
+    """
+
+    name = 'sqlite'
+    table = 'user_search'
+
+    @staticmethod
+    def available(connection):
+        try:
+            connection.execute(
+                text("CREATE VIRTUAL TABLE temp.user_search_probe "
+                     "USING fts5(x, tokenize='trigram')"))
+            connection.execute(text('DROP TABLE temp.user_search_probe'))
+        except Exception:  # noqa
+            return False
+        return True
+
+    @classmethod
+    def exists(cls, connection):
+        return connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+            name=cls.table).first() is not None
+
+    @classmethod
+    def create(cls, connection):
+        """Create the table if it is missing and fill it from `users`."""
+        if cls.exists(connection):
+            return
+        connection.execute(
+            text("CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5("
+                 "first_name, last_name, email, tokenize='trigram')".format(
+                     cls.table)))
+        cls._fill(connection)
+
+    @classmethod
+    def _fill(cls, connection):
+        # OR REPLACE, in case another process is filling it too
+        connection.execute(
+            text('INSERT OR REPLACE INTO {} (rowid, first_name, last_name, '
+                 'email) SELECT id, first_name, last_name, email FROM users'
+                 .format(cls.table)))
+
+    def reset(self):
+        """Refill the table from `users` in place, so processes writing to
+        it meanwhile carry on."""
+        with db.engine.begin() as connection:
+            if self.exists(connection):
+                connection.execute(
+                    text('DELETE FROM {}'.format(self.table)))
+                self._fill(connection)
+            else:
+                self.create(connection)
+
+    def _write(self, connection, statement, params):
+        try:
+            connection.execute(text(statement.format(self.table)), params)
+        except OperationalError:
+            # A missing table is refilled from `users` when next created
+            current_app.logger.warning(
+                'Search index write skipped', exc_info=True)
+
+    def index(self, connection, rows):
+        if rows:
+            self._write(
+                connection,
+                'INSERT OR REPLACE INTO {} (rowid, first_name, last_name, '
+                'email) VALUES (:id, :first_name, :last_name, :email)',
+                [dict(id=r[0], first_name=r[1], last_name=r[2], email=r[3])
+                 for r in rows])
+
+    def remove(self, connection, ids):
+        if ids:
+            self._write(connection, 'DELETE FROM {} WHERE rowid = :id',
+                        [dict(id=i) for i in ids])
+
+    @staticmethod
+    def _prefixed(query, limit):
+        # Prefixes use the indexes on the users table
+        pattern = query.lower().replace('%', '').replace('_', '') + '%'
+        rows = db.session.query(
+            User.id, User.first_name, User.last_name, User.email).filter(
+                or_(User.first_name.ilike(pattern),
+                    User.last_name.ilike(pattern),
+                    User.email.ilike(pattern))).limit(limit)
+        return [tuple(r) for r in rows]
+
+    def candidates(self, query, limit):
+        words = [w for w in _words.findall(query.lower()) if len(w) >= 3]
+        if not words:
+            # Too short for the trigram tokenizer
+            return self._prefixed(query, limit)
+        try:
+            return self._matches(words, limit)
+        except OperationalError:
+            current_app.logger.warning(
+                'Search index missing; matching prefixes only', exc_info=True)
+            return self._prefixed(query, limit)
+
+    def _matches(self, words, limit):
+        # Ordering by rank would score every matching row, which is far too
+        # slow on common trigrams. Instead take the best kind of match first
+        # (column prefix, then substring, then shared trigram pairs) and let
+        # `search` rank the candidates.
+        phrases = ['"{}"'.format(w.replace('"', '""')) for w in words]
+        grams = ['"{}"'.format(w[i:i + 3].replace('"', '""'))
+                 for w in words for i in range(len(w) - 2)]
+        pairs = ['({} AND {})'.format(a, b) for a, b in zip(grams, grams[1:])]
+        matches = []
+        if len(words) == 1:
+            matches.append('{first_name last_name email} : ^' + phrases[0])
+        matches.append(' AND '.join(phrases))
+        matches.append(' OR '.join(pairs or grams))
+
+        found = {}
+        for match in matches:
+            rows = db.session.execute(
+                text('SELECT rowid, first_name, last_name, email FROM {0} '
+                     'WHERE {0} MATCH :match LIMIT :limit'.format(
+                         self.table)),
+                dict(match=match, limit=limit))
+            for row in rows:
+                found.setdefault(row[0], tuple(row))
+            if len(found) >= limit:
+                break
+        return list(found.values())[:limit]
+
+
+class PostgresTrigramBackend(SearchBackend):
+    """
+    pg_trgm similarity over a GIN index on the searchable columns. Neither
+    is made on demand: `python manage.py setup_search` creates them, and
+    until it has run the search uses the 'ngram' backend.
+    """
+
+    name = 'postgres'
+    index_name = 'ix_users_search_trgm'
+    document = ("lower(coalesce(first_name, '') || ' ' || "
+                "coalesce(last_name, '') || ' ' || coalesce(email, ''))")
+
+    @classmethod
+    def available(cls, connection):
+        """Whether pg_trgm and a usable index on `users` are in place."""
+        return connection.execute(
+            text("SELECT 1 FROM pg_extension e, pg_class c "
+                 "JOIN pg_index i ON i.indexrelid = c.oid "
+                 "WHERE e.extname = 'pg_trgm' AND c.relname = :name "
+                 "AND i.indisvalid"),
+            name=cls.index_name).first() is not None
+
+    @classmethod
+    def create(cls, connection):
+        """
+        Install pg_trgm and build the index without locking out writes to
+        `users`. CREATE INDEX CONCURRENTLY cannot run in a transaction, so
+        `connection` must be in autocommit mode. An index left invalid by
+        an interrupted build is dropped and built again.
+        """
+        connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        if not cls.available(connection):
+            connection.execute(text(
+                'DROP INDEX CONCURRENTLY IF EXISTS {}'.format(cls.index_name)))
+            connection.execute(text(
+                'CREATE INDEX CONCURRENTLY {} ON users '
+                'USING gin (({}) gin_trgm_ops)'.format(
+                    cls.index_name, cls.document)))
+
+    def candidates(self, query, limit):
+        # The index maintains itself, so the model hooks have nothing to do.
+        rows = db.session.execute(
+            text('SELECT id, first_name, last_name, email FROM users '
+                 'WHERE {0} % :query OR {0} LIKE :contains '
+                 'ORDER BY similarity({0}, :query) DESC LIMIT :limit'.format(
+                     self.document)),
+            dict(
+                query=query.lower(),
+                contains='%' + query.lower().replace('%', '').replace(
+                    '_', '') + '%',
+                limit=limit))
+        return [tuple(r) for r in rows]
+
+
+def _choose_backend():
+    choice = current_app.config.get('USER_SEARCH_BACKEND', 'auto')
+    dialect = db.engine.dialect.name
+    if choice in ('auto', 'sqlite') and dialect == 'sqlite':
+        with db.engine.begin() as connection:
+            if SQLiteFTSBackend.available(connection):
+                # Once per process, for databases made before the table
+                SQLiteFTSBackend.create(connection)
+                return SQLiteFTSBackend()
+    if choice in ('auto', 'postgres') and dialect == 'postgresql':
+        with db.engine.connect() as connection:
+            if PostgresTrigramBackend.available(connection):
+                return PostgresTrigramBackend()
+    return NGramBackend()
+
+
+def get_backend():
+    """The search backend of the current application, chosen on first use."""
+    extensions = current_app.extensions
+    if extensions.get('user_search') is None:
+        extensions['user_search'] = _choose_backend()
+    return extensions['user_search']
+
+
+def setup_search():
+    """
+    Create the database's search index if it can have one: the FTS5 table
+    on SQLite, or pg_trgm and its GIN index on PostgreSQL. Returns the name
+    of the backend searches will use.
+    """
+    choice = current_app.config.get('USER_SEARCH_BACKEND', 'auto')
+    dialect = db.engine.dialect.name
+    if choice in ('auto', 'sqlite') and dialect == 'sqlite':
+        with db.engine.begin() as connection:
+            if SQLiteFTSBackend.available(connection):
+                SQLiteFTSBackend.create(connection)
+    if choice in ('auto', 'postgres') and dialect == 'postgresql':
+        with db.engine.connect() as connection:
+            PostgresTrigramBackend.create(
+                connection.execution_options(isolation_level='AUTOCOMMIT'))
+    current_app.extensions['user_search'] = None
+    return get_backend().name
+
+
+def search_users(query, limit=10):
+    """Return (score, (id, first_name, last_name, email)) pairs, best
+    first."""
+    return get_backend().search(query, limit=limit)
+
+
+def reset_search_index():
+    """Bring the index back in step with `users` after writes that skipped
+    the model hooks (bulk inserts through Core, say)."""
+    get_backend().reset()
+
+
+def _row(user):
+    return (user.id, user.first_name, user.last_name, user.email)
+
+
+def _index_hook(hook):
+    """Log what goes wrong keeping the index current rather than fail the
+    user write it follows."""
+
+    @functools.wraps(hook)
+    def wrapper(mapper, connection, target):
+        try:
+            hook(mapper, connection, target)
+        except Exception:  # noqa
+            current_app.logger.exception('Could not update search index')
+
+    return wrapper
+
+
+@_index_hook
+def _after_insert(mapper, connection, target):
+    get_backend().index(connection, [_row(target)])
+
+
+@_index_hook
+def _after_update(mapper, connection, target):
+    state = db.inspect(target)
+    if any(state.attrs[key].history.has_changes()
+           for key in ('first_name', 'last_name', 'email')):
+        get_backend().index(connection, [_row(target)])
+
+
+@_index_hook
+def _after_delete(mapper, connection, target):
+    get_backend().remove(connection, [target.id])
+
+
+def _after_create(target, connection, **kwargs):
+    # Outside an app (tables made by hand) the table waits for a search
+    choice = current_app.config.get('USER_SEARCH_BACKEND', 'auto') \
+        if has_app_context() else None
+    if connection.dialect.name == 'sqlite' and \
+            choice in ('auto', 'sqlite') and \
+            SQLiteFTSBackend.available(connection):
+        SQLiteFTSBackend.create(connection)
+
+
+def _before_drop(target, connection, **kwargs):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(
+            text('DROP TABLE IF EXISTS {}'.format(SQLiteFTSBackend.table)))
+    current_app.extensions['user_search'] = None
+
+
+def init_search(app):
+    """Keep the user search index in step with the users table."""
+    app.extensions['user_search'] = None
+    if not event.contains(User, 'after_insert', _after_insert):
+        event.listen(User, 'after_insert', _after_insert)
+        event.listen(User, 'after_update', _after_update)
+        event.listen(User, 'after_delete', _after_delete)
+        event.listen(User.__table__, 'after_create', _after_create)
+        event.listen(User.__table__, 'before_drop', _before_drop)
@@ -0,0 +1,156 @@
+import multiprocessing
+import random
+import re
+import time
+
+from faker import Faker
+from flask import current_app
+from sqlalchemy import func
+
+from app import db
+from app.hashing import hash_password
+from app.models import User, role_registry
+from app.search import reset_search_index
+
+# Distinct names drawn from Faker up front; rows pick from these
+NAME_POOL = 1000
+# Emails checked against existing users per query
+LOOKUP_CHUNK = 500
+
+_not_word = re.compile(r'[^a-z0-9]+')
+
+# The seeder a fan-out process works for (see _init_process)
+_process_seeder = None
+
+
+class UserSeeder(object):
+    """
+    Inserts fake users in bulk.
+
+    Faker is slow per call and hashing a password is slow on purpose, so the
+    seeder draws a pool of names once and hashes the password once for every
+    row. Emails carry a running number, so they are unique without retrying
+    inserts; each batch is checked against existing users in a few queries,
+    then inserted with one executemany and committed.
+
+    Batches are handed to `processes` worker processes when the database
+    allows concurrent writers. `progress(done, total, seconds)` is called
+    after each batch.
+    """
+
+    def __init__(self, count, batch_size=5000, processes=1,
+                 password='password', progress=None, **fields):
+        self.count = count
+        self.batch_size = max(1, batch_size)
+        self.processes = max(1, processes)
+        self.password = password
+        self.progress = progress
+        self.fields = fields
+        self.first_names = []
+        self.last_names = []
+        self.domains = []
+        self.role_ids = []
+        self.password_hash = None
+
+    def prepare(self):
+        fake = Faker()
+        self.first_names = list(
+            {fake.first_name() for _ in range(NAME_POOL)})
+        self.last_names = list({fake.last_name() for _ in range(NAME_POOL)})
+        self.domains = list({fake.free_email_domain() for _ in range(20)})
+        self.role_ids = [role.id for role in role_registry.all()] or [None]
+        self.password_hash = hash_password(self.password)
+
+    def rows(self, start, size):
+        """Fake users numbered `start` to `start + size - 1`."""
+        rng = random.Random(start)
+        rows = []
+        for number in range(start, start + size):
+            first = rng.choice(self.first_names)
+            last = rng.choice(self.last_names)
+            row = {
+                'first_name': first,
+                'last_name': last,
+                'email': '{}.{}.{}@{}'.format(
+                    _not_word.sub('', first.lower()),
+                    _not_word.sub('', last.lower()), number,
+                    rng.choice(self.domains)),
+                'password_hash': self.password_hash,
+                'confirmed': True,
+                'role_id': rng.choice(self.role_ids),
+            }
+            row.update(self.fields)
+            rows.append(row)
+        return rows
+
+    def insert_batch(self, start, size):
+        """Insert one batch, skipping emails already taken. Returns the
+        number of users inserted."""
+        rows = self.rows(start, size)
+        emails = [row['email'] for row in rows]
+        taken = set()
+        for i in range(0, len(emails), LOOKUP_CHUNK):
+            chunk = emails[i:i + LOOKUP_CHUNK]
+            taken.update(email for email, in db.session.query(
+                User.email).filter(User.email.in_(chunk)))
+        if taken:
+            rows = [row for row in rows if row['email'] not in taken]
+        if rows:
+            db.session.execute(User.__table__.insert(), rows)
+        db.session.commit()
+        return len(rows)
+
+    def batches(self):
+        first = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+        return [(first + offset, min(self.batch_size, self.count - offset))
+                for offset in range(0, self.count, self.batch_size)]
+
+    def run(self):
+        """Insert `count` users; returns how many were inserted."""
+        self.prepare()
+        batches = self.batches()
+        processes = self.processes
+        if db.engine.dialect.name == 'sqlite' and processes > 1:
+            # SQLite takes one writer at a time; more would only wait
+            current_app.logger.info('SQLite: seeding in a single process')
+            processes = 1
+
+        start, done = time.time(), 0
+        if processes == 1:
+            for batch in batches:
+                done += self.insert_batch(*batch)
+                self._report(done, start)
+        else:
+            # Children open their own connections rather than share these
+            db.session.remove()
+            db.engine.dispose()
+            context = multiprocessing.get_context('fork')
+            with context.Pool(processes, _init_process,
+                              (current_app._get_current_object(), self)) \
+                    as pool:
+                for inserted in pool.imap_unordered(_insert_batch, batches):
+                    done += inserted
+                    self._report(done, start)
+
+        # The bulk insert skipped the model hooks that feed the index
+        reset_search_index()
+        return done
+
+    def _report(self, done, start):
+        if self.progress is not None:
+            self.progress(done, self.count, time.time() - start)
+
+
+def _init_process(app, seeder):
+    global _process_seeder
+    app.app_context().push()
+    _process_seeder = seeder
+
+
+def _insert_batch(batch):
+    return _process_seeder.insert_batch(*batch)
+
+
+def seed_users(count, **kwargs):
+    """Insert `count` fake users in bulk (see `UserSeeder`)."""
+    return UserSeeder(count, **kwargs).run()
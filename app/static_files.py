@@ -0,0 +1,198 @@
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import namedtuple
+
+from flask import current_app, request
+from werkzeug.http import http_date
+from werkzeug.utils import get_content_type
+from werkzeug.wsgi import wrap_file
+
+from app.assets import bundles
+from app.compression import gzip_compress
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only .gz is written
+    brotli = None
+
+# A year, the longest caches honour
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Types worth compressing ahead of time, and the smallest file to bother
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json',
+                'application/xml', 'image/svg+xml', 'application/x-font-ttf',
+                'application/vnd.ms-fontobject', 'font/otf', 'font/ttf')
+MIN_COMPRESS_SIZE = 1024
+
+# One file under the static folder. `fingerprint` is a digest of its
+# contents; `variants` maps 'br' and 'gzip' to the (path, size) of a
+# compressed sibling.
+StaticFile = namedtuple(
+    'StaticFile',
+    'path size last_modified fingerprint content_type variants')
+
+
+def _mimetype(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def precompress(folder, min_size=MIN_COMPRESS_SIZE):
+    """
+    Write `.gz` (and with brotli installed `.br`) siblings next to every
+    compressible file in `folder` that lacks an up to date one. Returns how
+    many were written.
+    """
+    encoders = [('.gz', gzip_compress)]
+    if brotli is not None:
+        encoders.append(('.br', brotli.compress))
+    written = 0
+    for root, _, names in os.walk(folder):
+        for name in names:
+            if name.endswith(('.gz', '.br')) or \
+                    not _mimetype(name).startswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(root, name)
+            if os.path.getsize(path) < min_size:
+                continue
+            modified = os.path.getmtime(path)
+            data = None
+            for suffix, encode in encoders:
+                sibling = path + suffix
+                if os.path.exists(sibling) and \
+                        os.path.getmtime(sibling) >= modified:
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                with open(sibling, 'wb') as f:
+                    f.write(encode(data))
+                written += 1
+    return written
+
+
+class StaticFiles(object):
+    """
+    Serves the static folder from an index of its files made once.
+
+    The index holds each file's size, modification time, content type,
+    fingerprint and compressed siblings, so a hit costs opening the file
+    and sending it, with no stat calls. `url_for('static', ...)` adds the
+    fingerprint as `v`; a request carrying the current fingerprint, or for
+    a file `build_assets` named after its contents, is cached for a year as
+    immutable. A client that accepts brotli or gzip gets the matching
+    sibling when there is one.
+
+    Bundle outputs, which Flask-Assets may rewrite while the app runs, and
+    files added after the index was made are served by Flask as before.
+    """
+
+    def __init__(self, folder, skip=()):
+        self.folder = folder
+        self.files = {}
+        for root, _, names in os.walk(folder):
+            for name in names:
+                if name.endswith(('.gz', '.br')):
+                    continue
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, folder).replace(os.sep, '/')
+                if filename not in skip:
+                    self.files[filename] = self._entry(path)
+
+    @staticmethod
+    def _entry(path):
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            fingerprint = hashlib.md5(f.read()).hexdigest()[:12]
+        variants = {}
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            sibling = path + suffix
+            if os.path.exists(sibling) and \
+                    os.path.getmtime(sibling) >= stat.st_mtime:
+                variants[encoding] = (sibling, os.path.getsize(sibling))
+        return StaticFile(path, stat.st_size, http_date(stat.st_mtime),
+                          fingerprint,
+                          get_content_type(_mimetype(path), 'utf-8'),
+                          variants)
+
+    def fingerprint(self, filename):
+        """The fingerprint to add to links to `filename`, if any."""
+        entry = self.files.get(filename)
+        if entry is None or filename.startswith('build/'):
+            return None
+        return entry.fingerprint
+
+    def serve(self, filename):
+        entry = self.files.get(filename)
+        if entry is None:
+            return current_app.send_static_file(filename)
+
+        path, size, encoding = entry.path, entry.size, None
+        if entry.variants:
+            accepted = request.accept_encodings
+            for name in ('br', 'gzip'):
+                if name in entry.variants and accepted[name]:
+                    encoding = name
+                    path, size = entry.variants[name]
+                    break
+        etag = entry.fingerprint + ('-' + encoding if encoding else '')
+
+        response = current_app.response_class(
+            status=200, mimetype=None, content_type=entry.content_type)
+        response.set_etag(etag)
+        response.headers['Last-Modified'] = entry.last_modified
+        if entry.variants:
+            response.vary.add('Accept-Encoding')
+        if filename.startswith('build/') or \
+                request.args.get('v') == entry.fingerprint:
+            response.headers['Cache-Control'] = IMMUTABLE
+        else:
+            response.cache_control.public = True
+            response.cache_control.max_age = \
+                current_app.get_send_file_max_age(filename)
+
+        if request.if_none_match.contains(etag):
+            response.status_code = 304
+            return response
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Content-Length'] = size
+        response.response = wrap_file(request.environ, open(path, 'rb'))
+        response.direct_passthrough = True
+        return response
+
+
+_lock = threading.Lock()
+
+
+def get_static_files():
+    """The static file index of the current application, made on first
+    use."""
+    extensions = current_app.extensions
+    if extensions.get('static_files') is None:
+        with _lock:
+            if extensions.get('static_files') is None:
+                extensions['static_files'] = StaticFiles(
+                    current_app.static_folder,
+                    skip={bundle.output for bundle in bundles.values()})
+    return extensions['static_files']
+
+
+def init_static_files(app):
+    """Serve app/static through `StaticFiles` when `STATIC_FILES_INDEX` is
+    on."""
+    if not app.config['STATIC_FILES_INDEX']:
+        return
+
+    def serve(filename):
+        return get_static_files().serve(filename)
+
+    @app.url_defaults
+    def add_fingerprint(endpoint, values):
+        if endpoint == 'static' and 'v' not in values:
+            fingerprint = get_static_files().fingerprint(
+                values.get('filename'))
+            if fingerprint:
+                values['v'] = fingerprint
+
+    app.view_functions['static'] = serve
@@ -0,0 +1,43 @@
+import time
+
+from jinja2 import FileSystemBytecodeCache, MemcachedBytecodeCache
+
+# Template files compiled by the warm-up
+TEMPLATE_SUFFIXES = ('.html', '.txt')
+
+
+def init_template_cache(app):
+    """
+    Keep compiled templates across processes when `TEMPLATE_BYTECODE_CACHE`
+    is 'filesystem' (in `TEMPLATE_BYTECODE_CACHE_DIR`, or a temporary
+    folder) or 'redis' (shared by every host). A new worker then loads
+    a template's Python code instead of parsing and compiling it; a
+    template whose source changed is compiled again.
+    """
+    backend = app.config['TEMPLATE_BYTECODE_CACHE']
+    if backend == 'filesystem':
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+            app.config['TEMPLATE_BYTECODE_CACHE_DIR'])
+    elif backend == 'redis':
+        from flask_rq import get_connection
+        with app.app_context():
+            connection = get_connection()
+        # redis-py's get and set(key, value, ex) fit the memcached API;
+        # Redis being down only means templates are compiled
+        app.jinja_env.bytecode_cache = MemcachedBytecodeCache(
+            connection, prefix='jinja2/bytecode/', timeout=None)
+
+
+def warm_templates(app):
+    """
+    Load every template of `app` into its Jinja environment, compiling
+    those the bytecode cache lacks, so no request waits on that. Returns
+    how many were loaded and the seconds it took.
+    """
+    env = app.jinja_env
+    names = env.list_templates(filter_func=lambda name:
+                               name.endswith(TEMPLATE_SUFFIXES))
+    start = time.time()
+    for name in names:
+        env.get_template(name)
+    return len(names), time.time() - start
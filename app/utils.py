@@ -1,12 +1,33 @@
-from flask import url_for
+import hashlib
+import os
+from datetime import datetime
+
+from flask import (
+    current_app,
+    make_response,
+    render_template,
+    request,
+    session,
+    url_for,
+)
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
 from wtforms.fields import Field
 from wtforms.widgets import HiddenInput
 from wtforms.compat import text_type
 
+from app.asset_manifest import asset_urls, critical_css
+from app.fragment_cache import FragmentCacheExtension
+from app.page_cache import filling, page_cache_hole, tag_page
+
 
 def register_template_utils(app):
     """Register Jinja 2 helpers (called from __init__.py)."""
 
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache.maxsize = app.config['FRAGMENT_CACHE_SIZE']
+    app.jinja_env.fragment_cache.ttl = app.config['FRAGMENT_CACHE_TTL']
+
     @app.template_test()
     def equalto(value, other):
         return value == other
@@ -17,12 +38,74 @@ def register_template_utils(app):
         return isinstance(field, HiddenField)
 
     app.add_template_global(index_for_role)
+    app.add_template_global(asset_urls)
+    app.add_template_global(critical_css)
+    app.add_template_global(page_cache_hole)
 
 
 def index_for_role(role):
     return url_for(role.index)
 
 
+def _templates_modified():
+    """When the newest template was changed; reread per call in debug."""
+    modified = current_app.extensions.get('templates_modified')
+    if modified is None or current_app.debug:
+        latest = 0
+        for path in current_app.jinja_loader.searchpath:
+            for root, _, files in os.walk(
+                    os.path.join(current_app.root_path, path)):
+                for name in files:
+                    latest = max(latest,
+                                 os.path.getmtime(os.path.join(root, name)))
+        modified = datetime.utcfromtimestamp(int(latest))
+        current_app.extensions['templates_modified'] = modified
+    return modified
+
+
+def render_editable_page(template, editor_name, **context):
+    """
+    Render a page built around the inline editor `editor_name`, which the
+    template gets as `editable_html_obj`.
+
+    The content comes from `editable_html_store`, and the page carries an
+    ETag and Last-Modified made from it, the templates and who is looking,
+    so a conditional GET that matches is answered with a 304 and nothing
+    rendered. Administrators, whose page holds the editor and its CSRF
+    token, and requests with flashed messages waiting are always rendered
+    (unless the page is going into the page cache, which leaves flashes
+    out).
+    """
+    from app.models import editable_html_store
+
+    content = editable_html_store.get(editor_name)
+    tag_page('editable_html', 'editable_html:' + editor_name)
+    if current_user.is_admin() or ('_flashes' in session and not filling()):
+        return render_template(
+            template, editable_html_obj=content, **context)
+
+    templates_modified = _templates_modified()
+    viewer = 'anonymous'
+    if current_user.is_authenticated:
+        viewer = '%s:%s' % (current_user.id, current_user.role_id)
+    etag = hashlib.sha1(':'.join(
+        (template, content.etag, templates_modified.isoformat(),
+         viewer)).encode('utf-8')).hexdigest()
+    last_modified = max(content.last_modified, templates_modified)
+
+    if is_resource_modified(request.environ, etag='W/"%s"' % etag,
+                            last_modified=last_modified):
+        response = make_response(render_template(
+            template, editable_html_obj=content, **context))
+    else:
+        response = current_app.response_class(status=304)
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
 class CustomSelectField(Field):
     widget = HiddenInput()
 
@@ -0,0 +1,325 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from rq import Queue, SimpleWorker
+from rq.exceptions import DequeueTimeout
+from rq.logutils import setup_loghandlers
+from rq.registry import StartedJobRegistry
+from rq.timeouts import JobTimeoutException
+from rq.utils import utcnow
+from rq.worker import StopRequested, WorkerStatus
+
+EMAIL_JOB = 'app.email.send_email'
+
+
+class WorkerAppRegistry(object):
+    """Build the application once per worker process and reuse it per job.
+
+    `create_app` registers blueprints, builds the asset environment and
+    initializes every extension, which costs far more than rendering and
+    sending a single email. Jobs ask the registry for the app instead, so
+    only the first one pays for that setup.
+    """
+
+    def __init__(self, config_name=None):
+        self.config_name = config_name
+        self.app = None
+        self.build_seconds = None
+        self.jobs = 0
+        self.job_seconds = 0.0
+        # Jobs may run in several threads (AsyncEmailWorker)
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the worker application, building it on first use."""
+        if self.app is None:
+            with self._lock:
+                if self.app is None:
+                    from app import create_app
+
+                    config_name = self.config_name or \
+                        os.getenv('FLASK_CONFIG') or 'default'
+                    start = time.time()
+                    app = create_app(config_name)
+                    self.build_seconds = time.time() - start
+                    app.logger.info('Built worker application in %.3fs',
+                                    self.build_seconds)
+                    self.app = app
+        return self.app
+
+    def app_context(self):
+        """Push an application context for a single job."""
+        return _JobContext(self)
+
+    def stats(self):
+        """Return the first build time against the average time per job."""
+        return {
+            'build_seconds': self.build_seconds,
+            'jobs': self.jobs,
+            'avg_job_seconds': self.job_seconds / self.jobs
+            if self.jobs else None,
+        }
+
+    def reset(self):
+        self.app = None
+        self.build_seconds = None
+        self.jobs = 0
+        self.job_seconds = 0.0
+
+
+class _JobContext(object):
+    def __init__(self, registry):
+        self.registry = registry
+        self.ctx = None
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        self.ctx = self.registry.get().app_context()
+        self.ctx.push()
+        return self.ctx
+
+    def __exit__(self, exc_type, exc_value, tb):
+        elapsed = time.time() - self.start
+        with self.registry._lock:
+            self.registry.jobs += 1
+            self.registry.job_seconds += elapsed
+        current_app.logger.debug(
+            'Worker job finished in %.3fs (app built in %.3fs)', elapsed,
+            self.registry.build_seconds or 0.0)
+        self.ctx.pop(exc_value)
+
+
+worker_app = WorkerAppRegistry()
+
+
+class EmailWorker(SimpleWorker):
+    """Base for the email workers: runs jobs in-process with a warm app."""
+
+    def _fail_job(self, job, registry, exc_info):
+        job.ended_at = utcnow()
+        exc_string = self._get_safe_exception_string(
+            traceback.format_exception(*exc_info))
+        self.handle_job_failure(job, registry, exc_string=exc_string)
+        self.handle_exception(job, *exc_info)
+
+
+class BatchEmailWorker(EmailWorker):
+    """
+    An rq worker that sends queued emails in batches.
+
+    When it pops a `send_email` job it drains up to `batch_size` further email
+    jobs from the same queue and delivers all of them over one SMTP
+    connection. Every job still gets its own success or failure recorded. Any
+    other job is run one at a time, as a plain worker would.
+
+    Sending a batch is bounded by its jobs' timeouts, as `perform_job` bounds
+    a single job: a hung SMTP conversation fails the messages not sent yet,
+    and the worker goes back to idle after every batch.
+    """
+
+    def __init__(self, queues, batch_size=50, **kwargs):
+        super(BatchEmailWorker, self).__init__(queues, **kwargs)
+        self.batch_size = batch_size
+
+    def execute_job(self, job, queue):
+        if job.func_name != EMAIL_JOB:
+            return super(BatchEmailWorker, self).execute_job(job, queue)
+
+        jobs, other = [job], None
+        while len(jobs) < self.batch_size:
+            result = Queue.dequeue_any([queue], None,
+                                       connection=self.connection,
+                                       job_class=self.job_class)
+            if result is None:
+                break
+            if result[0].func_name != EMAIL_JOB:
+                other = result[0]
+                break
+            jobs.append(result[0])
+
+        self.perform_email_batch(jobs, queue)
+        self.set_state(WorkerStatus.IDLE)
+        if other is not None:
+            super(BatchEmailWorker, self).execute_job(other, queue)
+
+    @staticmethod
+    def batch_timeout(jobs):
+        """How long a batch may take to send: the longest timeout of its
+        jobs, or -1 (none) if one of them has none."""
+        timeouts = [job.timeout or Queue.DEFAULT_TIMEOUT for job in jobs]
+        if not timeouts or -1 in timeouts:
+            return -1
+        return max(timeouts)
+
+    def perform_email_batch(self, jobs, queue):
+        """Send a batch of email jobs and report each outcome to its job."""
+        from app.email import deliver_batch, load_users, messages_for_jobs
+
+        registry = StartedJobRegistry(queue.name, self.connection,
+                                      job_class=self.job_class)
+        with worker_app.app_context():
+            for job in jobs:
+                self.prepare_job_execution(job)
+                job.started_at = utcnow()
+            users = load_users([job.kwargs for job in jobs])
+            messages = messages_for_jobs(
+                [(job.args, job.kwargs) for job in jobs], users)
+
+            built = []
+            for job, msg in zip(jobs, messages):
+                if isinstance(msg, Exception):
+                    self._fail_job(job, registry,
+                                   (type(msg), msg, msg.__traceback__))
+                else:
+                    built.append((job, msg))
+
+            results = []
+            try:
+                with self.death_penalty_class(
+                        self.batch_timeout([job for job, _ in built]),
+                        JobTimeoutException, job_id=jobs[0].id):
+                    deliver_batch([msg for _, msg in built], results)
+            except JobTimeoutException as e:
+                # Every message not sent yet fails with the batch
+                results += [e] * (len(built) - len(results))
+            for (job, _), error in zip(built, results):
+                job.ended_at = utcnow()
+                if error is None:
+                    job._result = None
+                    self.handle_job_success(job, queue, registry)
+                else:
+                    self._fail_job(job, registry,
+                                   (type(error), error, error.__traceback__))
+        self.log.info('%s: sent %d of %d emails in one batch', queue.name,
+                      results.count(None), len(jobs))
+
+
+class AsyncEmailWorker(EmailWorker):
+    """
+    An rq worker that keeps many SMTP conversations in flight at once.
+
+    An asyncio event loop pulls jobs off the queues and hands them to a
+    thread pool, so up to `concurrency` jobs are rendered and sent at the same
+    time. At most `host_limit` of them talk to `MAIL_SERVER` at once, over
+    connections that are kept open and reused. Other jobs (imports, say) take
+    a thread of the pool too, so they never hold up the loop.
+
+    The threads only run the jobs. Job and worker state in Redis is only
+    changed from the loop, and a job that runs past its timeout is failed
+    there, though its thread keeps its slot until the job returns.
+    """
+
+    dequeue_timeout = 5
+
+    def __init__(self, queues, concurrency=20, host_limit=4, **kwargs):
+        super(AsyncEmailWorker, self).__init__(queues, **kwargs)
+        self.concurrency = concurrency
+        self.host_limit = host_limit
+
+    def work(self, burst=False, logging_level='INFO', **kwargs):
+        from app.email import SMTPConnectionPool
+
+        setup_loghandlers(logging_level)
+        self._install_signal_handlers()
+        self.register_birth()
+        self.log.info('Worker %s: started with %d concurrent sends (%d per '
+                      'host)', self.key, self.concurrency, self.host_limit)
+        # Stay BUSY so that a stop signal waits for in-flight sends to end.
+        self.set_state(WorkerStatus.BUSY)
+
+        self.pool = SMTPConnectionPool(self.host_limit)
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(self.concurrency + 1)
+        try:
+            return loop.run_until_complete(
+                self._serve(loop, executor, burst))
+        except StopRequested:
+            return False
+        finally:
+            executor.shutdown(wait=True)
+            loop.close()
+            self.pool.close()
+            self.register_death()
+
+    async def _serve(self, loop, executor, burst):
+        in_flight = asyncio.Semaphore(self.concurrency)
+        pending = set()
+        completed = 0
+        while not self._stop_requested:
+            await in_flight.acquire()
+            self.heartbeat()
+            result = await loop.run_in_executor(
+                executor, self._dequeue, burst)
+            if result is None:
+                in_flight.release()
+                if burst:
+                    break
+                continue
+
+            job, queue = result
+            task = loop.create_task(
+                self.perform_pooled(loop, executor, job, queue, in_flight))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            completed += 1
+
+        if pending:
+            await asyncio.wait(pending)
+        return bool(completed)
+
+    def _dequeue(self, burst):
+        try:
+            return Queue.dequeue_any(
+                self.queues, None if burst else self.dequeue_timeout,
+                connection=self.connection, job_class=self.job_class)
+        except DequeueTimeout:
+            return None
+
+    async def perform_pooled(self, loop, executor, job, queue, in_flight):
+        """Run one job in the pool and record how it went."""
+        registry = StartedJobRegistry(queue.name, self.connection,
+                                      job_class=self.job_class)
+        self.prepare_job_execution(job)
+        job.started_at = utcnow()
+        run = loop.run_in_executor(executor, self.run_job, job)
+        run.add_done_callback(lambda _: in_flight.release())
+        timeout = job.timeout or Queue.DEFAULT_TIMEOUT
+        try:
+            await asyncio.wait_for(asyncio.shield(run),
+                                   None if timeout == -1 else timeout)
+        except asyncio.TimeoutError:
+            error = JobTimeoutException(
+                'Job exceeded maximum timeout value ({} seconds)'.format(
+                    timeout))
+            self._fail_job(job, registry, (JobTimeoutException, error, None))
+            return
+        except Exception:  # noqa
+            self._fail_job(job, registry, sys.exc_info())
+            return
+        job.ended_at = utcnow()
+        self.handle_job_success(job, queue, registry)
+
+    def run_job(self, job):
+        """Run one job (in the thread pool): an email on a pooled
+        connection, anything else as rq would."""
+        if job.func_name == EMAIL_JOB:
+            self.send_email(job)
+        else:
+            job.perform()
+
+    def send_email(self, job):
+        """Render and send one email job on a pooled connection (runs in
+        the thread pool)."""
+        from app.email import load_users, message_for_job
+
+        with worker_app.app_context():
+            self.pool.send(
+                message_for_job(job.args, job.kwargs,
+                                load_users([job.kwargs])))
@@ -36,6 +36,11 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER')
+    # Reconnect after this many messages on one SMTP connection (batching)
+    MAIL_MAX_EMAILS = int(os.environ.get('MAIL_MAX_EMAILS', 100))
+    # Emails in flight and open SMTP connections for run_async_worker
+    MAIL_ASYNC_CONCURRENCY = int(os.environ.get('MAIL_ASYNC_CONCURRENCY', 20))
+    MAIL_ASYNC_HOST_LIMIT = int(os.environ.get('MAIL_ASYNC_HOST_LIMIT', 4))
 
     # Analytics
     GOOGLE_ANALYTICS_ID = os.environ.get('GOOGLE_ANALYTICS_ID', '')
@@ -53,6 +58,94 @@ class Config:
 
     RAYGUN_APIKEY = os.environ.get('RAYGUN_APIKEY')
 
+    # User search: 'auto' picks SQLite FTS5 or Postgres pg_trgm when the
+    # database supports them, else an in-process index ('ngram'), which
+    # only sees the writes of its own process
+    USER_SEARCH_BACKEND = os.environ.get('USER_SEARCH_BACKEND', 'auto')
+
+    # Link the files `manage.py build_assets` built instead of building
+    # assets on request
+    ASSETS_MANIFEST = os.environ.get('ASSETS_MANIFEST', 'False') == 'True'
+
+    # Serve app/static from an index made once, with fingerprinted URLs
+    # cached as immutable and precompressed .br/.gz files
+    STATIC_FILES_INDEX = os.environ.get('STATIC_FILES_INDEX',
+                                        'True') == 'True'
+
+    # Responses smaller than this many bytes are sent uncompressed; bodies
+    # with a strong ETag are kept compressed, this many per process
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+    COMPRESS_CACHE_SIZE = int(os.environ.get('COMPRESS_CACHE_SIZE', 256))
+
+    # Compiled templates kept between processes: 'filesystem' (in
+    # TEMPLATE_BYTECODE_CACHE_DIR, or a temporary folder), 'redis' or
+    # 'none'; and whether to compile every template before serving
+    TEMPLATE_BYTECODE_CACHE = os.environ.get('TEMPLATE_BYTECODE_CACHE',
+                                             'none')
+    TEMPLATE_BYTECODE_CACHE_DIR = os.environ.get(
+        'TEMPLATE_BYTECODE_CACHE_DIR')
+    TEMPLATE_WARMUP = os.environ.get('TEMPLATE_WARMUP', 'False') == 'True'
+
+    # Where uploaded user imports wait for the worker (a temporary folder
+    # if unset); the web and worker processes must both see it
+    IMPORT_UPLOAD_DIR = os.environ.get('IMPORT_UPLOAD_DIR')
+
+    # Seconds before the role registry rereads roles written elsewhere
+    ROLE_CACHE_TTL = int(os.environ.get('ROLE_CACHE_TTL', 300))
+
+    # Seconds before cached editable page content rereads edits made by
+    # other processes
+    EDITABLE_HTML_CACHE_TTL = int(
+        os.environ.get('EDITABLE_HTML_CACHE_TTL', 300))
+
+    # Pages cached for anonymous visitors: 'memory' (per process), 'redis'
+    # (shared) or 'none' (production defaults to 'memory'); pages per process
+    # and seconds to keep them
+    PAGE_CACHE = os.environ.get('PAGE_CACHE', 'none')
+    PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 256))
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 300))
+
+    # Template fragments kept by {% cache %} per process, and seconds to
+    # keep them (0 renders them every time)
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 512))
+    FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL', 300))
+
+    # Users cached for Flask-Login: entries per process, seconds to keep
+    # them, and whether to share them between processes through Redis.
+    # Without Redis, a process sees another's change to a user only once
+    # its own entry expires.
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    USER_CACHE_REDIS = os.environ.get('USER_CACHE_REDIS', 'False') == 'True'
+
+    # Password hashes run in this many processes (0 hashes in the request's
+    # own); up to PASSWORD_HASH_QUEUE more wait for one, for at most
+    # PASSWORD_HASH_WAIT seconds before the request gets a 503. Both are
+    # per web process, so they only matter with threaded or async workers
+    # (gunicorn --threads); sync workers hash one request at a time anyway.
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 8))
+    PASSWORD_HASH_WAIT = float(os.environ.get('PASSWORD_HASH_WAIT', 1.0))
+
+    # How new password hashes are made: 'pbkdf2:<digest>', 'scrypt' or
+    # 'argon2' (needs argon2-cffi), and the cost of each. Older hashes are
+    # remade under these settings when their owner next logs in.
+    # `python manage.py calibrate_hashing` suggests values for this host.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD',
+                                          'pbkdf2:sha256')
+    PASSWORD_HASH_ITERATIONS = int(
+        os.environ.get('PASSWORD_HASH_ITERATIONS', 150000))
+    PASSWORD_HASH_SCRYPT_N = int(os.environ.get('PASSWORD_HASH_SCRYPT_N',
+                                                32768))
+    PASSWORD_HASH_SCRYPT_R = int(os.environ.get('PASSWORD_HASH_SCRYPT_R', 8))
+    PASSWORD_HASH_SCRYPT_P = int(os.environ.get('PASSWORD_HASH_SCRYPT_P', 1))
+    PASSWORD_HASH_ARGON2_TIME_COST = int(
+        os.environ.get('PASSWORD_HASH_ARGON2_TIME_COST', 3))
+    PASSWORD_HASH_ARGON2_MEMORY_COST = int(
+        os.environ.get('PASSWORD_HASH_ARGON2_MEMORY_COST', 65536))
+    PASSWORD_HASH_ARGON2_PARALLELISM = int(
+        os.environ.get('PASSWORD_HASH_ARGON2_PARALLELISM', 4))
+
     # Parse the REDIS_URL to set RQ config variables
     if PYTHON_VERSION == 3:
         urllib.parse.uses_netloc.append('redis')
@@ -74,6 +167,8 @@ class Config:
 class DevelopmentConfig(Config):
     DEBUG = True
     ASSETS_DEBUG = True
+    # Static files change while developing
+    STATIC_FILES_INDEX = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL',
         'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite'))
 
@@ -88,6 +183,8 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL',
         'sqlite:///' + os.path.join(basedir, 'data-test.sqlite'))
     WTF_CSRF_ENABLED = False
+    PASSWORD_HASH_WORKERS = 0
+    PASSWORD_HASH_ITERATIONS = 1000
 
     @classmethod
     def init_app(cls, app):
@@ -98,6 +195,13 @@ class TestingConfig(Config):
 class ProductionConfig(Config):
     DEBUG = False
     USE_RELOADER = False
+    ASSETS_MANIFEST = os.environ.get('ASSETS_MANIFEST', 'True') == 'True'
+    # Templates only change on deploy: no checking them for changes
+    TEMPLATES_AUTO_RELOAD = False
+    TEMPLATE_BYTECODE_CACHE = os.environ.get('TEMPLATE_BYTECODE_CACHE',
+                                             'filesystem')
+    TEMPLATE_WARMUP = os.environ.get('TEMPLATE_WARMUP', 'True') == 'True'
+    PAGE_CACHE = os.environ.get('PAGE_CACHE', 'memory')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL',
         'sqlite:///' + os.path.join(basedir, 'data.sqlite'))
     SSL_DISABLE = (os.environ.get('SSL_DISABLE', 'True') == 'True')
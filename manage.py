@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 import os
 import subprocess
+import sys
+import time
 
 from flask_migrate import Migrate, MigrateCommand
 from flask_script import Manager, Shell, Server
@@ -8,7 +10,14 @@ from redis import Redis
 from rq import Connection, Queue, Worker
 
 from app import create_app, db
-from app.models import Role, User
+from app.admin.exporting import export_users as stream_users
+from app.admin.importing import UserImport
+from app.asset_manifest import build_assets as build_asset_files
+from app.hashing import HashPolicy, calibrate
+from app.models import Role, User, role_registry
+from app.search import setup_search as setup_search_index
+from app.static_files import precompress
+from app.worker import AsyncEmailWorker, BatchEmailWorker, worker_app
 from config import Config
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
@@ -52,11 +61,265 @@ def recreate_db():
     type=int,
     help='Number of each model type to create',
     dest='number_users')
-def add_fake_data(number_users):
+@manager.option(
+    '-b',
+    '--batch-size',
+    default=5000,
+    type=int,
+    help='Users to insert per transaction',
+    dest='batch_size')
+@manager.option(
+    '-p',
+    '--processes',
+    default=1,
+    type=int,
+    help='Insert batches from this many processes (not with SQLite)',
+    dest='processes')
+def add_fake_data(number_users, batch_size, processes):
     """
     Adds fake data to the database.
     """
-    User.generate_fake(count=number_users)
+
+    def progress(done, total, seconds):
+        sys.stdout.write('\r{} of {} users ({:.0f} rows/s)'.format(
+            done, total, done / seconds if seconds else 0))
+        sys.stdout.flush()
+
+    inserted = User.generate_fake(
+        count=number_users,
+        batch_size=batch_size,
+        processes=processes,
+        progress=progress)
+    print('\nAdded {} fake users'.format(inserted))
+
+
+@manager.option(
+    '-t',
+    '--target-ms',
+    default=250,
+    type=int,
+    help='How long verifying a password should take, in milliseconds',
+    dest='target_ms')
+@manager.option(
+    '-m',
+    '--method',
+    default=None,
+    help="Hash method to calibrate: 'pbkdf2:sha256', 'scrypt' or 'argon2'",
+    dest='method')
+def calibrate_hashing(target_ms, method):
+    """Suggests password hash settings for this machine."""
+    current = HashPolicy.from_config(app.config)
+    policy, elapsed = calibrate(method or current.method, target_ms / 1000.0,
+                                current)
+    print('Verifying a password takes {:.0f}ms with these settings '
+          '(target {}ms):'.format(elapsed * 1000, target_ms))
+    for name, value in policy.describe():
+        print('{}={}'.format(name, value))
+
+
+@manager.option('path', help='CSV file with an email column')
+@manager.option(
+    '--no-invite',
+    action='store_true',
+    help='Create the users without emailing invitations',
+    dest='no_invite')
+@manager.option(
+    '-c',
+    '--chunk-size',
+    default=1000,
+    type=int,
+    help='Rows to insert per transaction',
+    dest='chunk_size')
+@manager.option(
+    '-u',
+    '--base-url',
+    default='http://localhost:5000',
+    help='Site address used in invitation links',
+    dest='base_url')
+def import_users(path, no_invite, chunk_size, base_url):
+    """Creates and invites users from a CSV file."""
+    start = time.time()
+
+    def progress(result):
+        rows = result.created + result.skipped
+        sys.stdout.write('\r{} rows, {} users created ({:.0f} rows/s)'.format(
+            rows, result.created, rows / max(time.time() - start, 1e-6)))
+        sys.stdout.flush()
+
+    with app.test_request_context(base_url=base_url), \
+            open(path, newline='', encoding='utf-8-sig') as stream:
+        result = UserImport(
+            invite=not no_invite, chunk_size=chunk_size,
+            progress=progress).run(stream)
+    print('\nCreated {} users, skipped {} rows'.format(
+        result.created, result.skipped))
+    for line, message in result.errors:
+        print('  line {}: {}'.format(line, message))
+
+
+@manager.option(
+    '-f',
+    '--format',
+    default='csv',
+    choices=['csv', 'jsonl'],
+    help='csv or jsonl',
+    dest='fmt')
+@manager.option(
+    '-o',
+    '--output',
+    default=None,
+    help='File to write to (default: standard output)',
+    dest='output')
+@manager.option(
+    '-r', '--role', default=None, help='Only users with this role name',
+    dest='role')
+@manager.option(
+    '-q',
+    '--search',
+    default=None,
+    help='Only users whose name or email starts with this',
+    dest='search')
+def export_users(fmt, output, role, search):
+    """Writes the users out as CSV or JSON Lines."""
+    role_id = None
+    if role is not None:
+        found = role_registry.by_name(role)
+        if found is None:
+            sys.exit('No role named {}'.format(role))
+        role_id = found.id
+    stream = open(output, 'w', newline='') if output else sys.stdout
+    try:
+        for chunk in stream_users(fmt, role=role_id, search=search):
+            stream.write(chunk)
+    finally:
+        if output:
+            stream.close()
+
+
+@manager.option(
+    '-t',
+    '--template',
+    default='main/index.html',
+    help='Template to render',
+    dest='template')
+@manager.option(
+    '-n',
+    '--number',
+    default=500,
+    type=int,
+    help='Times to render it',
+    dest='number')
+def bench_templates(template, number):
+    """Times rendering a page with and without the fragment cache."""
+    from flask import render_template
+
+    fragments = app.jinja_env.fragment_cache
+    maxsize = fragments.maxsize
+    with app.test_request_context('/'):
+        app.preprocess_request()
+        for label, size in (('without', 0), ('with', maxsize or 512)):
+            fragments.maxsize = size
+            fragments.clear()
+            render_template(template)
+            start = time.time()
+            for _ in range(number):
+                render_template(template)
+            print('{} {} the fragment cache: {:.3f}ms per render'.format(
+                template, label, (time.time() - start) * 1000 / number))
+    fragments.maxsize = maxsize
+
+
+@manager.option(
+    '-n',
+    '--number',
+    default=5,
+    type=int,
+    help='New apps to start per setting',
+    dest='number')
+def bench_cold_start(number):
+    """
+    Times making a new app and its first requests with and without the
+    template bytecode cache and warm-up.
+    """
+    import shutil
+    import tempfile
+    from config import config as configs
+
+    urls = ('/', '/about', '/account/login', '/account/register')
+    cache_dir = tempfile.mkdtemp()
+    settings = (
+        ('no bytecode cache', 'none', False),
+        ('warm-up', 'none', True),
+        ('bytecode cache', 'filesystem', False),
+        ('bytecode cache and warm-up', 'filesystem', True),
+    )
+    base = configs[os.getenv('FLASK_CONFIG') or 'default']
+    try:
+        for label, backend, warmup in settings:
+            configs['bench'] = type('BenchConfig', (base, ), {
+                'TEMPLATE_BYTECODE_CACHE': backend,
+                'TEMPLATE_BYTECODE_CACHE_DIR': cache_dir,
+                'TEMPLATE_WARMUP': warmup,
+            })
+            # Fill the bytecode cache, as an earlier worker would have
+            create_app('bench').test_client().get('/')
+            startup = first_requests = 0
+            for _ in range(number):
+                start = time.time()
+                bench_app = create_app('bench')
+                started = time.time()
+                client = bench_app.test_client()
+                for url in urls:
+                    client.get(url)
+                startup += started - start
+                first_requests += time.time() - started
+            print('{}: {:.1f}ms to start, {:.1f}ms for the first '
+                  'requests'.format(label, startup * 1000 / number,
+                                    first_requests * 1000 / number))
+    finally:
+        configs.pop('bench', None)
+        shutil.rmtree(cache_dir)
+
+
+@manager.option(
+    '-f',
+    '--force',
+    action='store_true',
+    help='Rebuild bundles whose sources have not changed too',
+    dest='force')
+@manager.option(
+    '-c',
+    '--critical',
+    action='store_true',
+    help='Also extract the CSS the page shell needs, to inline in <head>',
+    dest='critical')
+def build_assets(force, critical):
+    """
+    Builds every asset bundle, writes the asset manifest and compresses
+    static files ahead of time.
+    """
+    manifest = build_asset_files(app, force=force, critical=critical)
+    for name, path in sorted(manifest['bundles'].items()):
+        print('{}: {}'.format(name, path))
+    for name, (before, after) in sorted(manifest['purged'].items()):
+        print('Purged unused CSS from {}: {:,} -> {:,} bytes'.format(
+            name, before, after))
+    if 'critical' in manifest:
+        print('critical: {} ({:,} bytes)'.format(
+            manifest['critical'],
+            os.path.getsize(os.path.join(app.static_folder,
+                                         manifest['critical']))))
+    print('Wrote {} compressed static files'.format(
+        precompress(app.static_folder)))
+
+
+@manager.command
+def setup_search():
+    """
+    Creates the user search index: an FTS5 table on SQLite, or pg_trgm and
+    a GIN index (built without blocking writes) on PostgreSQL.
+    """
+    print('User search uses the {} backend'.format(setup_search_index()))
 
 
 @manager.command
@@ -75,6 +338,7 @@ def setup_general():
     """Runs the set-up needed for both local development and production.
        Also sets up first admin user."""
     Role.insert_roles()
+    setup_search()
     admin_query = Role.query.filter_by(name='Administrator')
     if admin_query.first() is not None:
         if User.query.filter_by(email=Config.ADMIN_EMAIL).first() is None:
@@ -89,8 +353,14 @@ def setup_general():
             print('Added administrator {}'.format(user.full_name()))
 
 
-@manager.command
-def run_worker():
+@manager.option(
+    '-b',
+    '--batch-size',
+    default=0,
+    type=int,
+    help='Send up to this many queued emails per SMTP connection',
+    dest='batch_size')
+def run_worker(batch_size):
     """Initializes a slim rq task queue."""
     listen = ['default']
     conn = Redis(
@@ -99,8 +369,49 @@ def run_worker():
         db=0,
         password=app.config['RQ_DEFAULT_PASSWORD'])
 
+    # Build the job application before forking so that every work horse
+    # inherits it instead of calling create_app() itself.
+    worker_app.get()
+
+    with Connection(conn):
+        if batch_size > 1:
+            worker = BatchEmailWorker(
+                map(Queue, listen), batch_size=batch_size)
+        else:
+            worker = Worker(map(Queue, listen))
+        worker.work()
+
+
+@manager.option(
+    '-c',
+    '--concurrency',
+    default=None,
+    type=int,
+    help='Number of emails to send at the same time',
+    dest='concurrency')
+@manager.option(
+    '-l',
+    '--host-limit',
+    default=None,
+    type=int,
+    help='Maximum open connections to the mail server',
+    dest='host_limit')
+def run_async_worker(concurrency, host_limit):
+    """Runs a worker that sends many queued emails concurrently."""
+    listen = ['default']
+    conn = Redis(
+        host=app.config['RQ_DEFAULT_HOST'],
+        port=app.config['RQ_DEFAULT_PORT'],
+        db=0,
+        password=app.config['RQ_DEFAULT_PASSWORD'])
+
+    worker_app.get()
+
     with Connection(conn):
-        worker = Worker(map(Queue, listen))
+        worker = AsyncEmailWorker(
+            [Queue(name) for name in listen],
+            concurrency=concurrency or app.config['MAIL_ASYNC_CONCURRENCY'],
+            host_limit=host_limit or app.config['MAIL_ASYNC_HOST_LIMIT'])
         worker.work()
 
 
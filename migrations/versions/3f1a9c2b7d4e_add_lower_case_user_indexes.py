@@ -0,0 +1,54 @@
+"""Add lower-case indexes for the registered users search
+
+Revision ID: 3f1a9c2b7d4e
+Revises:
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3f1a9c2b7d4e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+COLUMNS = ('first_name', 'last_name', 'email')
+
+
+def _existing_indexes():
+    # Reflection skips expression indexes, so ask the catalogs directly
+    bind = op.get_bind()
+    if 'users' not in sa.inspect(bind).get_table_names():
+        return None
+    if bind.dialect.name == 'sqlite':
+        query = "SELECT name FROM sqlite_master " \
+            "WHERE type = 'index' AND tbl_name = 'users'"
+    else:
+        query = "SELECT indexname FROM pg_indexes WHERE tablename = 'users'"
+    return {row[0] for row in bind.execute(sa.text(query))}
+
+
+def upgrade():
+    # Databases are made with create_all, which already adds these indexes,
+    # so only add the ones an older database is missing.
+    existing = _existing_indexes()
+    if existing is None:
+        return
+    # text_pattern_ops lets Postgres use the index for LIKE 'prefix%'
+    ops = ' text_pattern_ops' \
+        if op.get_bind().dialect.name == 'postgresql' else ''
+    for column in COLUMNS:
+        name = 'ix_users_{}_lower'.format(column)
+        if name not in existing:
+            op.create_index(
+                name, 'users', [sa.text('lower({}){}'.format(column, ops))])
+
+
+def downgrade():
+    existing = _existing_indexes() or set()
+    for column in COLUMNS:
+        name = 'ix_users_{}_lower'.format(column)
+        if name in existing:
+            op.drop_index(name, table_name='users')
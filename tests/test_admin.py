@@ -0,0 +1,87 @@
+import unittest
+
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import Role, User
+
+
+class QueryCounter(object):
+    """Counts the SQL statements run against an engine while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+class RegisteredUsersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        # Enough roles that lazy-loading them per row would show up
+        for i in range(10):
+            db.session.add(
+                Role(name='Role%d' % i, index='main', permissions=1))
+        db.session.add(
+            User(
+                first_name='Admin',
+                last_name='Account',
+                email=self.app.config['ADMIN_EMAIL'],
+                password='password',
+                confirmed=True))
+        db.session.commit()
+        self.client = self.app.test_client()
+        self.client.post(
+            '/account/login',
+            data={
+                'email': self.app.config['ADMIN_EMAIL'],
+                'password': 'password'
+            })
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_users(self, count, start=0):
+        roles = Role.query.all()
+        for i in range(start, start + count):
+            db.session.add(
+                User(
+                    first_name='First%d' % i,
+                    last_name='Last%d' % i,
+                    email='user%d@example.com' % i,
+                    role=roles[i % len(roles)]))
+        db.session.commit()
+        db.session.remove()
+
+    def queries_for_users_page(self):
+        db.session.remove()
+        with QueryCounter(db.engine) as counter:
+            response = self.client.get('/admin/users')
+        self.assertEqual(response.status_code, 200)
+        return counter.count
+
+    def test_registered_users_query_count_is_constant(self):
+        self.add_users(3)
+        # The first page view loads the role registry
+        self.queries_for_users_page()
+        few = self.queries_for_users_page()
+        self.add_users(40, start=3)
+        many = self.queries_for_users_page()
+        self.assertEqual(few, many)
+        # The current user and the page of users; roles come from the registry
+        self.assertLessEqual(many, 2)
@@ -0,0 +1,75 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import render_template
+
+from app import create_app
+from app.asset_manifest import build_assets, load_manifest
+from app.assets import bundles
+
+basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+
+
+class AssetManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.static = tempfile.mkdtemp()
+        # Ruby sass may be missing here; an up to date output skips it
+        os.makedirs(os.path.join(self.static, 'styles'))
+        shutil.copy(
+            os.path.join(basedir, 'app', 'static', 'styles', 'app.css'),
+            os.path.join(self.static, 'styles', 'app.css'))
+        self.app = create_app('testing')
+        self.app.static_folder = self.static
+        self.app.config['ASSETS_DIRECTORY'] = self.static
+
+    def tearDown(self):
+        shutil.rmtree(self.static)
+
+    def test_build_and_link(self):
+        manifest = build_assets(self.app)
+        self.assertEqual(sorted(manifest['bundles']), sorted(bundles))
+        built = manifest['files']['scripts/app.js']
+        self.assertRegex(built, r'^build/app\.[0-9a-f]{12}\.js$')
+        path = os.path.join(self.static, built)
+        with open(path, 'rb') as f, gzip.open(path + '.gz') as gz:
+            self.assertEqual(f.read(), gz.read())
+
+        self.app.config['ASSETS_MANIFEST'] = True
+        load_manifest(self.app)
+        with self.app.test_request_context('/'):
+            self.app.preprocess_request()
+            html = render_template('main/index.html')
+        for name in ('app_css', 'app_js', 'jquery_js', 'vendor_js'):
+            self.assertIn('/static/' + manifest['bundles'][name], html)
+        self.assertNotIn('/static/scripts/', html)
+        self.assertNotIn('<style>', html)
+
+    def test_purge_and_critical(self):
+        manifest = build_assets(self.app, critical=True)
+        before, after = manifest['purged']['vendor_css']
+        self.assertLess(after, before)
+        with open(os.path.join(self.static,
+                               manifest['bundles']['vendor_css'])) as f:
+            vendor = f.read()
+        self.assertEqual(len(vendor.encode('utf-8')), after)
+        self.assertIn('.ui.menu', vendor)
+        self.assertNotIn('.ui.feed', vendor)
+        self.assertRegex(manifest['critical'],
+                         r'^build/critical\.[0-9a-f]{12}\.css$')
+
+        self.app.config['ASSETS_MANIFEST'] = True
+        load_manifest(self.app)
+        with self.app.test_request_context('/'):
+            self.app.preprocess_request()
+            html = render_template('main/index.html')
+        self.assertIn('<style>/*', html)
+        self.assertIn('<link rel="preload" href="/static/%s" as="style"' %
+                      manifest['bundles']['vendor_css'], html)
+
+    def test_missing_manifest_falls_back(self):
+        self.app.config['ASSETS_MANIFEST'] = True
+        load_manifest(self.app)
+        self.assertIsNone(self.app.extensions['asset_manifest'])
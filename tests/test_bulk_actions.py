@@ -0,0 +1,140 @@
+import unittest
+
+from app import create_app, db
+from app.admin.bulk import BulkUserAction
+from app.models import Role, User, get_user_cache, load_user
+from app.search import search_users
+from tests.test_admin import QueryCounter
+
+
+class BulkUserActionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.admin_role = Role.query.filter_by(name='Administrator').first()
+        self.admin = User(
+            first_name='Admin',
+            last_name='Account',
+            email=self.app.config['ADMIN_EMAIL'],
+            password='password',
+            confirmed=True)
+        db.session.add(self.admin)
+        for i in range(30):
+            db.session.add(
+                User(
+                    first_name='First%d' % i,
+                    last_name='Last%d' % i,
+                    email='user%d@example.com' % i,
+                    confirmed=i % 3 != 0))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self):
+        client = self.app.test_client()
+        client.post(
+            '/account/login',
+            data={
+                'email': self.app.config['ADMIN_EMAIL'],
+                'password': 'password'
+            })
+        return client
+
+    def test_change_role_is_one_statement(self):
+        action = BulkUserAction(self.admin)
+        role = self.admin_role
+        # Load both before counting; the commit in setUp expired them
+        self.admin.id, role.id
+        with QueryCounter(db.engine) as counter:
+            self.assertEqual(action.change_role(role), 30)
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(
+            User.query.filter_by(role_id=self.admin_role.id).count(), 31)
+
+    def test_acting_user_is_left_out(self):
+        db.session.add(Role(name='Member', index='main', permissions=1))
+        db.session.commit()
+        member = Role.query.filter_by(name='Member').first()
+        action = BulkUserAction(self.admin, ids=[self.admin.id, 2, 3])
+        self.assertTrue(action.includes_acting_user())
+        self.assertEqual(action.change_role(member), 2)
+        self.assertEqual(self.admin.role.name, 'Administrator')
+        self.assertEqual(action.delete(), 2)
+        self.assertIsNotNone(User.query.get(self.admin.id))
+
+    def test_filters_select_users(self):
+        action = BulkUserAction(self.admin, search='First1')
+        self.assertFalse(action.includes_acting_user())
+        # First1 and First10 to First19
+        self.assertEqual(action.delete(), 11)
+        self.assertEqual(User.query.count(), 20)
+
+    def test_delete_updates_search_and_cache(self):
+        search_users('First5')
+        user_id = User.query.filter_by(email='user5@example.com').first().id
+        load_user(str(user_id))
+        self.assertIsNotNone(get_user_cache().local.get(user_id))
+        BulkUserAction(self.admin, ids=[user_id]).delete()
+        self.assertIsNone(get_user_cache().local.get(user_id))
+        self.assertIsNone(load_user(str(user_id)))
+        self.assertNotIn(user_id,
+                         [row[0] for _, row in search_users('First5')])
+
+    def test_resend_confirmation(self):
+        user = User.query.filter_by(email='user3@example.com').first()
+        user.password = 'password'
+        db.session.commit()
+        emails = []
+        with self.app.test_request_context():
+            count = BulkUserAction(self.admin).resend_confirmation(
+                emails.extend)
+        self.assertEqual(count, 10)
+        confirm = [e for e in emails if e['template'].endswith('confirm')]
+        self.assertEqual([e['recipient'] for e in confirm],
+                         ['user3@example.com'])
+        self.assertEqual(len(emails), 10)
+
+    def test_bulk_view(self):
+        client = self.login()
+        response = client.get('/admin/users')
+        self.assertIn(b'name="user_id"', response.data)
+        response = client.post(
+            '/admin/users/bulk',
+            data={
+                'action': 'change_role',
+                'role': str(self.admin_role.id),
+                'user_id': ['2', '3', str(self.admin.id)],
+            },
+            follow_redirects=True)
+        self.assertIn(b'Changed 2 users to Administrator.', response.data)
+        self.assertIn(b'Your own account was left out.', response.data)
+
+        response = client.post(
+            '/admin/users/bulk',
+            data={
+                'action': 'delete',
+                'all_matching': 'y',
+                'q': 'First2',
+            },
+            follow_redirects=True)
+        self.assertIn(b'Deleted 11 users.', response.data)
+
+    def test_bulk_view_needs_role_and_selection(self):
+        client = self.login()
+        response = client.post(
+            '/admin/users/bulk',
+            data={'action': 'change_role', 'user_id': ['2']},
+            follow_redirects=True)
+        self.assertIn(b'Choose the new account type.', response.data)
+        response = client.post(
+            '/admin/users/bulk',
+            data={'action': 'delete'},
+            follow_redirects=True)
+        self.assertIn(b'Select some users first.', response.data)
+        self.assertEqual(User.query.count(), 31)
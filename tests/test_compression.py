@@ -0,0 +1,141 @@
+import gzip
+import io
+import unittest
+
+from flask import Response
+
+from app import create_app
+from app.compression import (LARGE_SIZE, STATIC_LEVELS, brotli,
+                             compression_level, gzip_compress)
+
+BODY = 'flask-base ' * 200
+
+
+class CompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+
+        @self.app.route('/_text/<etag>')
+        def text(etag):
+            response = Response(BODY, mimetype='text/plain')
+            if etag != 'none':
+                response.set_etag(etag.lstrip('W'), weak=etag[0] == 'W')
+            return response
+
+        @self.app.route('/_file')
+        def file():
+            response = Response(io.BytesIO(BODY.encode('utf-8')),
+                                mimetype='text/plain', direct_passthrough=True)
+            response.content_length = len(BODY)
+            return response
+
+        @self.app.route('/_stream')
+        def stream():
+            return Response((BODY for _ in range(3)), mimetype='text/csv')
+
+        self.client = self.app.test_client()
+        self.compressor = self.app.extensions['compress']
+
+    def get(self, url, encoding='gzip'):
+        return self.client.get(url, headers={'Accept-Encoding': encoding})
+
+    def test_gzip(self):
+        response = self.get('/_text/none')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.data).decode(), BODY)
+        self.assertEqual(int(response.headers['Content-Length']),
+                         len(response.data))
+        stats = self.compressor.stats()
+        self.assertEqual(stats['responses'], 1)
+        self.assertEqual(stats['bytes_in'], len(BODY))
+        self.assertEqual(stats['bytes_saved'], len(BODY) - len(response.data))
+
+    def test_not_accepted(self):
+        response = self.get('/_text/none', encoding='identity')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(response.data.decode(), BODY)
+
+    def test_strong_etag_is_compressed_once(self):
+        first = self.get('/_text/abc')
+        second = self.get('/_text/abc')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(self.compressor.stats()['responses'], 1)
+        self.assertEqual(self.compressor.stats()['cache']['hits'], 1)
+
+        # Weak ETags do not promise the same bytes
+        self.get('/_text/Wabc')
+        self.get('/_text/Wabc')
+        self.assertEqual(self.compressor.stats()['responses'], 3)
+
+    def test_strong_etag_names_the_encoding(self):
+        response = self.get('/_text/abc')
+        self.assertEqual(response.headers['ETag'], '"abc-gzip"')
+        plain = self.get('/_text/abc', encoding='identity')
+        self.assertEqual(plain.headers['ETag'], '"abc"')
+        self.assertEqual(self.get('/_text/Wabc').headers['ETag'], 'W/"abc"')
+
+        response = self.client.get('/_text/abc', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': '"abc-gzip"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], '"abc-gzip"')
+        response = self.client.get('/_text/abc', headers={
+            'Accept-Encoding': 'identity', 'If-None-Match': '"abc-gzip"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_quality(self):
+        self.assertEqual(
+            self.get('/_text/none', 'br;q=0.5, gzip').headers.get(
+                'Content-Encoding'), 'gzip')
+        self.assertNotIn('Content-Encoding',
+                         self.get('/_text/none', 'gzip;q=0').headers)
+        self.assertNotIn(
+            'Content-Encoding',
+            self.get('/_text/none', 'gzip;q=0.5, identity').headers)
+
+    def test_file_is_left_alone(self):
+        response = self.get('/_file')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data.decode(), BODY)
+
+    def test_stream(self):
+        response = self.get('/_stream')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertEqual(gzip.decompress(response.data).decode(), BODY * 3)
+        self.assertEqual(self.compressor.stats()['streamed'], 1)
+
+    def test_page(self):
+        response = self.get('/')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn(b'</html>', gzip.decompress(response.data))
+
+    def test_levels(self):
+        self.assertEqual(compression_level('gzip', 'text/css', 10000),
+                         STATIC_LEVELS[0])
+        self.assertEqual(compression_level('br', 'text/css', 10000),
+                         STATIC_LEVELS[1])
+        self.assertLess(compression_level('gzip', 'text/html', 10000),
+                        compression_level('gzip', 'text/css', 10000))
+        self.assertLess(compression_level('gzip', 'text/css', LARGE_SIZE + 1),
+                        compression_level('gzip', 'text/html', 10000))
+        self.assertEqual(compression_level('gzip', 'text/csv', None),
+                         compression_level('gzip', 'text/csv', LARGE_SIZE + 1))
+
+    def test_gzip_compress_is_reproducible(self):
+        data = BODY.encode('utf-8')
+        self.assertEqual(gzip_compress(data), gzip_compress(data))
+        self.assertEqual(gzip.decompress(gzip_compress(data)), data)
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+        response = self.get('/_text/none', encoding='gzip, br')
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.data).decode(), BODY)
+        response = self.get('/_text/abc', encoding='br;q=0.8, gzip;q=0.9')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        response = self.get('/_text/abc', encoding='gzip, br')
+        self.assertEqual(response.headers['ETag'], '"abc-br"')
@@ -0,0 +1,55 @@
+import unittest
+
+from app.css_purge import critical_css, purge_css
+
+CSS = ('/* License */'
+       '@import url(https://fonts.example/lato.css);'
+       '@font-face{font-family:Icons;src:url(icons.woff)}'
+       'body{margin:0}'
+       '.ui.button{color:red}'
+       '.ui.rating .icon,.ui.button .icon{margin:0}'
+       '.ui.button:not(.basic){border:0}'
+       '.ui.button:hover{color:blue}'
+       '.ui.modal.active{display:block}'
+       '/* a comment */'
+       '.ui.feed{content:"a } b"}'
+       '@media only screen and (max-width:767px){'
+       '.ui.button{width:100%}.ui.feed{width:100%}}'
+       '@media print{.ui.feed{display:none}}'
+       '@keyframes spin{from{transform:rotate(0)}}')
+
+
+class CSSPurgeTestCase(unittest.TestCase):
+    def test_purge(self):
+        css = purge_css(CSS, {'ui', 'button', 'icon'})
+        self.assertTrue(css.startswith('/* License */@import url('))
+        self.assertIn('@font-face{', css)
+        self.assertIn('body{margin:0}', css)
+        self.assertIn('.ui.button{color:red}', css)
+        # Only the selectors of a list that may match are kept
+        self.assertIn('.ui.button .icon{margin:0}', css)
+        self.assertNotIn('rating', css)
+        # `:not(.basic)` matches without .basic on the page
+        self.assertIn('.ui.button:not(.basic){border:0}', css)
+        self.assertIn('.ui.button:hover{color:blue}', css)
+        self.assertNotIn('feed', css)
+        self.assertNotIn('a comment', css)
+        self.assertIn('@media only screen and (max-width:767px)'
+                      '{.ui.button{width:100%}}', css)
+        self.assertNotIn('@media print', css)
+        self.assertIn('@keyframes spin{from{transform:rotate(0)}}', css)
+
+    def test_safelist(self):
+        words = {'ui', 'modal'}
+        self.assertIn('.ui.modal.active{display:block}',
+                      purge_css(CSS, words))
+        self.assertNotIn('.ui.modal.active', purge_css(CSS, words, set()))
+
+    def test_critical(self):
+        css = critical_css(CSS, {'ui', 'button', 'modal'})
+        self.assertIn('.ui.button{color:red}', css)
+        self.assertNotIn('@import', css)
+        self.assertNotIn('@font-face', css)
+        self.assertNotIn('@keyframes', css)
+        self.assertNotIn(':hover', css)
+        self.assertNotIn('.active', css)
@@ -0,0 +1,84 @@
+import unittest
+
+from app import create_app, db
+from app.models import EditableHTML, Role, User, editable_html_store
+from tests.test_admin import QueryCounter
+
+
+class EditableHTMLCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(EditableHTML(editor_name='about', value='<p>Hi</p>'))
+        db.session.add(
+            User(
+                first_name='Admin',
+                last_name='Account',
+                email=self.app.config['ADMIN_EMAIL'],
+                password='password',
+                confirmed=True))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_store_is_invalidated_on_commit(self):
+        first = editable_html_store.get('about')
+        self.assertEqual(first.value, '<p>Hi</p>')
+        with QueryCounter(db.engine) as counter:
+            self.assertIs(editable_html_store.get('about'), first)
+        self.assertEqual(counter.count, 0)
+
+        EditableHTML.query.filter_by(editor_name='about').first().value = \
+            '<p>Bye</p>'
+        db.session.commit()
+        second = editable_html_store.get('about')
+        self.assertEqual(second.value, '<p>Bye</p>')
+        self.assertGreater(second.version, first.version)
+        self.assertNotEqual(second.etag, first.etag)
+        self.assertEqual(editable_html_store.get('missing').value, '')
+
+    def test_anonymous_conditional_get(self):
+        client = self.app.test_client()
+        response = client.get('/about')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<p>Hi</p>', response.data)
+        etag = response.headers['ETag']
+        self.assertIsNotNone(response.last_modified)
+
+        with QueryCounter(db.engine) as counter:
+            again = client.get('/about', headers={'If-None-Match': etag})
+            self.assertEqual(again.status_code, 304)
+            self.assertEqual(again.headers['ETag'], etag)
+            self.assertEqual(client.get('/about').status_code, 200)
+        self.assertEqual(counter.count, 0)
+
+    def test_saving_changes_etag(self):
+        client = self.app.test_client()
+        etag = client.get('/about').headers['ETag']
+        client.post(
+            '/account/login',
+            data={
+                'email': self.app.config['ADMIN_EMAIL'],
+                'password': 'password'
+            })
+        admin_page = client.get('/about')
+        self.assertNotIn('ETag', admin_page.headers)
+        client.post(
+            '/admin/_update_editor_contents',
+            data={
+                'editor_name': 'about',
+                'edit_data': '<p>New</p>'
+            })
+        client.get('/account/logout')
+        client.get('/')  # Show the logout flash
+
+        response = client.get('/about', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<p>New</p>', response.data)
+        self.assertNotEqual(response.headers['ETag'], etag)
@@ -0,0 +1,405 @@
+import pickle
+import smtplib
+import socketserver
+import threading
+import time
+import unittest
+
+import fakeredis
+from flask import render_template
+from flask_mail import Message
+from jinja2 import ChoiceLoader, DictLoader
+from rq import Queue
+from rq.worker import WorkerStatus
+
+from app import create_app, db, mail
+from app.email import (
+    EmailRenderer,
+    SMTPConnectionPool,
+    deliver_batch,
+    enqueue_email,
+    load_users,
+    message_for_job,
+    messages_for_jobs,
+    send_email,
+)
+from app.models import Role, User
+from app.worker import AsyncEmailWorker, BatchEmailWorker, worker_app
+
+
+class StandInSMTPHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough SMTP for smtplib; rejects `reject@` recipients
+    and takes two seconds over `slow@` ones."""
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost stand-in ESMTP')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO', 'NOOP', 'RSET'):
+                self.reply('250 OK')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                if 'reject@' in command:
+                    self.reply('550 No such user')
+                elif 'slow@' in command:
+                    time.sleep(2)
+                    recipients.append(command)
+                    self.reply('250 OK')
+                else:
+                    recipients.append(command)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.messages.append(recipients)
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class StandInSMTPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(
+            self, ('127.0.0.1', 0), StandInSMTPHandler)
+        self.connections = 0
+        self.messages = []
+
+
+class EmailJobTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(
+            first_name='Ada',
+            last_name='Lovelace',
+            email='ada@example.com',
+            password='password')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_context_must_be_plain_values(self):
+        with self.assertRaises(TypeError):
+            enqueue_email(
+                recipient=self.user.email,
+                subject='Confirm Your Account',
+                template='account/email/confirm',
+                confirm_link=self.user)
+
+    def test_job_rehydrates_user(self):
+        kwargs = dict(user_id=self.user.id, confirm_link='http://link')
+        msg = message_for_job(
+            (self.user.email, 'Confirm Your Account',
+             'account/email/confirm'), kwargs, load_users([kwargs]))
+        self.assertIn('Dear Ada Lovelace', msg.body)
+        self.assertIn('http://link', msg.html)
+
+    def test_job_for_deleted_user_fails(self):
+        with self.assertRaises(LookupError):
+            message_for_job(
+                ('a@example.com', 'Subject', 'account/email/confirm'),
+                dict(user_id=12345), {})
+
+    def test_id_payload_is_smaller_than_orm_payload(self):
+        self.user.role.name  # load the relationship, as the views did
+        common = dict(
+            recipient=self.user.email,
+            subject='Confirm Your Account',
+            template='account/email/confirm',
+            confirm_link='http://link')
+        orm = pickle.dumps(dict(common, user=self.user), 2)
+        compact = pickle.dumps(dict(common, user_id=self.user.id), 2)
+        self.assertTrue(len(compact) * 3 < len(orm))
+
+    def test_batch_of_jobs_isolates_failures(self):
+        good = dict(
+            recipient='a@example.com',
+            subject='Confirm',
+            template='account/email/confirm',
+            user_id=self.user.id,
+            confirm_link='http://link')
+        missing = dict(good, user_id=12345)
+        jobs = [((), good), ((), missing), ((), good)]
+        results = messages_for_jobs(jobs, load_users([good, missing]))
+        self.assertIsInstance(results[0], Message)
+        self.assertIsInstance(results[1], LookupError)
+        self.assertEqual(results[0].body, results[2].body)
+
+
+class EmailRendererTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.renderer = EmailRenderer()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_render_matches_render_template(self):
+        user = User(first_name='Ada', last_name='Lovelace')
+        body, html = self.renderer.render(
+            'account/email/confirm', user=user, confirm_link='http://link')
+        self.assertEqual(
+            body,
+            render_template(
+                'account/email/confirm.txt',
+                user=user,
+                confirm_link='http://link'))
+        self.assertEqual(
+            html,
+            render_template(
+                'account/email/confirm.html',
+                user=user,
+                confirm_link='http://link'))
+
+    def test_render_many_builds_context_once(self):
+        calls = []
+
+        @self.app.context_processor
+        def count():
+            calls.append(1)
+            return {}
+
+        self.renderer.render_many('account/email/confirm', [
+            dict(user=User(first_name=name, last_name='X'), confirm_link='l')
+            for name in ('Ada', 'Grace', 'Alan')
+        ])
+        self.assertEqual(len(calls), 1)
+
+    def test_render_many(self):
+        rendered = self.renderer.render_many('account/email/confirm', [
+            dict(user=User(first_name=name, last_name='X'), confirm_link='l')
+            for name in ('Ada', 'Grace')
+        ])
+        self.assertIn('Dear Ada X', rendered[0][0])
+        self.assertIn('Dear Grace X', rendered[1][0])
+
+    def test_changed_templates_reload(self):
+        sources = {'t.txt': 'Hi {{ name }}', 't.html': '<p>{{ name }}</p>'}
+        env = self.app.jinja_env
+        env.loader = ChoiceLoader([DictLoader(sources), env.loader])
+        env.auto_reload = True
+        self.assertEqual(self.renderer.render('t', name='A')[0], 'Hi A')
+        sources['t.txt'] = 'Hello {{ name }}'
+        self.assertEqual(self.renderer.render('t', name='A')[0], 'Hello A')
+
+
+class BatchDeliveryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInSMTPServer()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.app = create_app('testing')
+        self.app.config.update(
+            MAIL_SERVER='127.0.0.1',
+            MAIL_PORT=self.server.server_address[1],
+            MAIL_USE_TLS=False,
+            MAIL_USE_SSL=False,
+            MAIL_USERNAME=None,
+            MAIL_PASSWORD=None,
+            MAIL_SUPPRESS_SEND=False,
+            MAIL_MAX_EMAILS=10)
+        mail.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def messages(self, *recipients):
+        return [
+            Message('Hello', sender='admin@example.com', recipients=[r],
+                    body='Hello')
+            for r in recipients
+        ]
+
+    def test_batch_uses_one_connection(self):
+        results = deliver_batch(
+            self.messages('a@example.com', 'b@example.com', 'c@example.com'))
+        self.assertEqual(results, [None, None, None])
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.server.messages), 3)
+
+    def test_batch_reconnects_after_max_emails(self):
+        self.app.config['MAIL_MAX_EMAILS'] = 2
+        mail.init_app(self.app)
+        results = deliver_batch(
+            self.messages(*['u%d@example.com' % i for i in range(5)]))
+        self.assertEqual(results, [None] * 5)
+        self.assertEqual(self.server.connections, 3)
+
+    def test_batch_reports_failures_per_message(self):
+        results = deliver_batch(
+            self.messages('a@example.com', 'reject@example.com',
+                          'c@example.com'))
+        self.assertTrue(results[0] is None)
+        self.assertIsInstance(results[1], smtplib.SMTPRecipientsRefused)
+        self.assertTrue(results[2] is None)
+        self.assertEqual(len(self.server.messages), 2)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_connection_pool_bounds_connections(self):
+        pool = SMTPConnectionPool(2)
+        errors = []
+
+        def send(msg):
+            with self.app.app_context():
+                try:
+                    pool.send(msg)
+                except Exception as e:  # noqa
+                    errors.append(e)
+
+        threads = [
+            threading.Thread(target=send, args=(msg, ))
+            for msg in self.messages(
+                *['u%d@example.com' % i for i in range(10)])
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        pool.close()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.server.messages), 10)
+        self.assertTrue(self.server.connections <= 2)
+
+
+class AsyncEmailWorkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInSMTPServer()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.app = create_app('testing')
+        self.app.config.update(
+            MAIL_SERVER='127.0.0.1',
+            MAIL_PORT=self.server.server_address[1],
+            MAIL_USE_TLS=False,
+            MAIL_USE_SSL=False,
+            MAIL_USERNAME=None,
+            MAIL_PASSWORD=None,
+            MAIL_SUPPRESS_SEND=False)
+        mail.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(
+            first_name='Ada',
+            last_name='Lovelace',
+            email='ada@example.com',
+            password='password')
+        db.session.add(self.user)
+        db.session.commit()
+        worker_app.app = self.app
+
+        self.redis = fakeredis.FakeStrictRedis()
+        self.queue = Queue(connection=self.redis)
+
+    def tearDown(self):
+        worker_app.reset()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def enqueue(self, recipient, user_id, timeout=None):
+        return self.queue.enqueue(
+            send_email,
+            job_timeout=timeout,
+            recipient=recipient,
+            subject='Confirm Your Account',
+            template='account/email/confirm',
+            user_id=user_id,
+            confirm_link='http://link')
+
+    def test_jobs_are_sent_and_recorded(self):
+        sent = [self.enqueue('u%d@example.com' % i, self.user.id)
+                for i in range(4)]
+        rejected = self.enqueue('reject@example.com', self.user.id)
+        missing = self.enqueue('gone@example.com', 12345)
+        slow = self.enqueue('slow@example.com', self.user.id, timeout=1)
+        other = self.queue.enqueue(sum, [1, 2])
+
+        worker = AsyncEmailWorker([self.queue], connection=self.redis,
+                                  concurrency=3, host_limit=2)
+        self.assertTrue(worker.work(burst=True))
+
+        for job in sent:
+            job.refresh()
+            self.assertEqual(job.get_status(), 'finished')
+        for job in (rejected, missing, slow):
+            job.refresh()
+            self.assertEqual(job.get_status(), 'failed')
+        self.assertIn('SMTPRecipientsRefused', rejected.exc_info)
+        self.assertIn('LookupError', missing.exc_info)
+        self.assertIn('JobTimeoutException', slow.exc_info)
+        other.refresh()
+        self.assertEqual(other.result, 3)
+        self.assertTrue(self.server.connections <= 3)
+        worker.refresh()
+        self.assertEqual(worker.successful_job_count, 5)
+        self.assertEqual(worker.failed_job_count, 3)
+
+    def test_batch_worker_enforces_timeout(self):
+        states = []
+
+        class Worker(BatchEmailWorker):
+            def execute_job(self, job, queue):
+                super(Worker, self).execute_job(job, queue)
+                states.append(self.get_state())
+
+        sent = self.enqueue('u@example.com', self.user.id, timeout=1)
+        slow = self.enqueue('slow@example.com', self.user.id, timeout=1)
+        cut = self.enqueue('v@example.com', self.user.id, timeout=1)
+        worker = Worker([self.queue], connection=self.redis, batch_size=10)
+        start = time.time()
+        self.assertTrue(worker.work(burst=True))
+        self.assertLess(time.time() - start, 2)
+
+        sent.refresh()
+        self.assertEqual(sent.get_status(), 'finished')
+        for job in (slow, cut):
+            job.refresh()
+            self.assertEqual(job.get_status(), 'failed')
+            self.assertIn('JobTimeoutException', job.exc_info)
+        # One batch, after which the worker is idle again
+        self.assertEqual(states, [WorkerStatus.IDLE])
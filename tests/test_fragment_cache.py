@@ -0,0 +1,76 @@
+import unittest
+
+from jinja2 import Environment
+
+from app import create_app, db
+from app.fragment_cache import FragmentCacheExtension
+from app.models import Role, User
+
+
+class FragmentCacheExtensionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.env = Environment(extensions=[FragmentCacheExtension])
+        self.calls = []
+        self.env.globals['render'] = lambda: self.calls.append(1) or 'body'
+        self.template = self.env.from_string(
+            '{% cache name, 1 %}{{ render() }} {{ name }}{% endcache %}')
+
+    def test_renders_once_per_key(self):
+        self.assertEqual(self.template.render(name='a'), 'body a')
+        self.assertEqual(self.template.render(name='a'), 'body a')
+        self.assertEqual(self.template.render(name='b'), 'body b')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_least_recently_used_is_evicted(self):
+        self.env.fragment_cache.maxsize = 1
+        self.template.render(name='a')
+        self.template.render(name='b')
+        self.template.render(name='a')
+        self.assertEqual(len(self.calls), 3)
+
+    def test_disabled(self):
+        self.env.fragment_cache.maxsize = 0
+        self.template.render(name='a')
+        self.template.render(name='a')
+        self.assertEqual(len(self.calls), 2)
+
+
+class NavCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['PAGE_CACHE'] = 'none'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(
+            User(
+                first_name='Admin',
+                last_name='Account',
+                email=self.app.config['ADMIN_EMAIL'],
+                password='password',
+                confirmed=True))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_nav_is_cached_per_role_and_endpoint(self):
+        fragments = self.app.jinja_env.fragment_cache
+        client = self.app.test_client()
+        client.get('/')
+        client.get('/')
+        self.assertEqual(len(fragments), 1)
+        self.assertNotIn(b'Dashboard', client.get('/about').data)
+        self.assertEqual(len(fragments), 2)
+
+        client.post(
+            '/account/login',
+            data={
+                'email': self.app.config['ADMIN_EMAIL'],
+                'password': 'password'
+            })
+        self.assertIn(b'Administrator Dashboard', client.get('/about').data)
+        self.assertEqual(len(fragments), 3)
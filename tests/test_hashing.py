@@ -0,0 +1,141 @@
+import threading
+import time
+import unittest
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app import create_app, db
+from app.hashing import (
+    HashingBusy,
+    HashingService,
+    HashPolicy,
+    argon2,
+    calibrate,
+    get_hashing_service,
+    verify_hash,
+)
+from app.models import Role, User
+
+
+class HashingServiceTestCase(unittest.TestCase):
+    def test_pool_hashes_and_verifies(self):
+        service = HashingService(workers=1, queue_size=1)
+        try:
+            pwhash = service.run(generate_password_hash, 'password')
+            self.assertTrue(service.run(check_password_hash, pwhash,
+                                        'password'))
+            stats = service.stats()
+            self.assertEqual(stats['hashes'], 2)
+            self.assertGreater(stats['avg_hash_seconds'], 0)
+            self.assertIsNotNone(stats['avg_wait_seconds'])
+        finally:
+            service.shutdown()
+
+    def test_full_queue_is_rejected(self):
+        service = HashingService(workers=0, queue_size=0, wait=0.01)
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            time.sleep(0.2)
+
+        thread = threading.Thread(target=service.run, args=(slow, ))
+        thread.start()
+        started.wait()
+        with self.assertRaises(HashingBusy):
+            service.run(time.sleep, 0)
+        thread.join()
+        self.assertEqual(service.stats()['rejected'], 1)
+        service.run(time.sleep, 0)
+        self.assertEqual(service.stats()['hashes'], 2)
+
+
+class HashPolicyTestCase(unittest.TestCase):
+    def test_methods_round_trip(self):
+        for policy in (HashPolicy('pbkdf2:sha256', iterations=1000),
+                       HashPolicy('scrypt', scrypt_n=2**10)):
+            pwhash = policy.hash('password')
+            self.assertTrue(verify_hash(pwhash, 'password'))
+            self.assertFalse(verify_hash(pwhash, 'notpassword'))
+            self.assertFalse(policy.needs_rehash(pwhash))
+
+    def test_needs_rehash_on_other_method_or_cost(self):
+        policy = HashPolicy('pbkdf2:sha256', iterations=2000)
+        self.assertTrue(policy.needs_rehash(
+            HashPolicy('pbkdf2:sha256', iterations=1000).hash('password')))
+        self.assertTrue(policy.needs_rehash(
+            HashPolicy('scrypt', scrypt_n=2**10).hash('password')))
+        self.assertTrue(policy.needs_rehash(None))
+
+    def test_werkzeug_hashes_still_verify(self):
+        self.assertTrue(
+            verify_hash(generate_password_hash('password'), 'password'))
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            HashPolicy('md5')
+
+    def test_calibrate(self):
+        policy, elapsed = calibrate('pbkdf2:sha256', 0.01)
+        self.assertEqual(policy.method, 'pbkdf2:sha256')
+        self.assertGreaterEqual(policy.iterations, 1000)
+        self.assertGreater(elapsed, 0)
+
+
+class HashingBackpressureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(User(email='user@example.com', password='password',
+                            confirmed=True))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self):
+        return self.app.test_client().post(
+            '/account/login',
+            data={'email': 'user@example.com', 'password': 'password'})
+
+    def test_login_rehashes_outdated_hash(self):
+        user = User.query.filter_by(email='user@example.com').first()
+        user.password_hash = generate_password_hash('password')
+        db.session.commit()
+        self.assertTrue(user.password_needs_rehash())
+        self.assertEqual(self.login().status_code, 302)
+        db.session.remove()
+        user = User.query.filter_by(email='user@example.com').first()
+        self.assertFalse(user.password_needs_rehash())
+        self.assertTrue(user.verify_password('password'))
+
+    def test_every_policy_fits_the_column(self):
+        policies = [HashPolicy('pbkdf2:sha256'), HashPolicy('pbkdf2:sha512'),
+                    HashPolicy('scrypt')]
+        if argon2 is not None:
+            policies.append(HashPolicy('argon2'))
+        length = User.__table__.c.password_hash.type.length
+        for policy in policies:
+            self.app.extensions['hash_policy'] = policy
+            user = User.query.filter_by(email='user@example.com').first()
+            user.password = 'password'
+            db.session.commit()
+            db.session.remove()
+            user = User.query.filter_by(email='user@example.com').first()
+            self.assertLessEqual(len(user.password_hash), length)
+            self.assertTrue(user.password_hash.startswith(policy.prefix()))
+            self.assertTrue(user.verify_password('password'))
+
+    def test_busy_login_gets_503(self):
+        service = get_hashing_service()
+        service.wait = 0
+        for _ in range(service.queue_size + 1):
+            service._slots.acquire()
+        response = self.login()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '5')
@@ -0,0 +1,38 @@
+import unittest
+
+from flask import render_template_string
+
+from app import create_app
+
+
+class PageBundlesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.client = self.app.test_client()
+
+    def scripts(self, html):
+        return [
+            line.strip() for line in html.splitlines()
+            if line.strip().startswith('<script type="text/javascript" src')
+        ]
+
+    def test_only_jquery_blocks_rendering(self):
+        html = self.client.get('/account/login').get_data(as_text=True)
+        scripts = self.scripts(html)
+        self.assertIn('/scripts/jquery.js', scripts[0])
+        self.assertNotIn(' defer', scripts[0])
+        self.assertTrue(all(' defer' in script for script in scripts[1:]))
+        self.assertNotIn('zxcvbn', html)
+
+    def test_password_meter_fetches_zxcvbn_on_demand(self):
+        html = self.client.get('/account/register').get_data(as_text=True)
+        self.assertNotIn('zxcvbn', ''.join(self.scripts(html)))
+        self.assertIn('script.src = "/static/scripts/zxcvbn.js', html)
+
+    def test_pages_declare_bundles(self):
+        with self.app.test_request_context('/'):
+            self.app.preprocess_request()
+            html = render_template_string(
+                "{% extends 'layouts/base.html' %}"
+                "{% set page_bundles = ['zxcvbn_js'] %}")
+        self.assertIn('/scripts/zxcvbn.js', ''.join(self.scripts(html)))
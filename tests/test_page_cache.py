@@ -0,0 +1,112 @@
+import re
+import unittest
+
+from flask import g, template_rendered
+from itsdangerous import URLSafeTimedSerializer
+
+from app import create_app, db
+from app.models import EditableHTML, Role, User
+from app.page_cache import HOLE, MemoryPageStore, get_page_store
+
+
+class MemoryPageStoreTestCase(unittest.TestCase):
+    def test_lru_and_tags(self):
+        store = MemoryPageStore(maxsize=2)
+        store.set('a', ('A', []), ['x'])
+        store.set('b', ('B', []), ['x', 'y'])
+        store.get('a')
+        store.set('c', ('C', []), ['y'])
+        self.assertIsNone(store.get('b'))
+        self.assertEqual(store.get('a'), ('A', []))
+        store.invalidate('x')
+        self.assertIsNone(store.get('a'))
+        self.assertEqual(store.get('c'), ('C', []))
+        store.invalidate('y')
+        self.assertIsNone(store.get('c'))
+
+
+class PageCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['PAGE_CACHE'] = 'memory'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(EditableHTML(editor_name='about', value='<p>Hi</p>'))
+        db.session.add(
+            User(
+                first_name='Admin',
+                last_name='Account',
+                email=self.app.config['ADMIN_EMAIL'],
+                password='password',
+                confirmed=True))
+        db.session.commit()
+        self.rendered = []
+        template_rendered.connect(self._rendered, self.app)
+
+    def tearDown(self):
+        template_rendered.disconnect(self._rendered, self.app)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _rendered(self, sender, template, context, **extra):
+        self.rendered.append(template.name)
+
+    def csrf_token(self, client, page):
+        token = re.search(rb'name="csrf_token" value="([^"]+)"',
+                          page).group(1).decode('ascii')
+        with client.session_transaction() as session:
+            raw = session['csrf_token']
+        serializer = URLSafeTimedSerializer(
+            self.app.secret_key, salt='wtf-csrf-token')
+        self.assertEqual(serializer.loads(token), raw)
+        return token
+
+    def test_hits_skip_rendering_and_get_their_own_token(self):
+        first, second = self.app.test_client(), self.app.test_client()
+        page = first.get('/account/login')
+        self.assertEqual(self.rendered, ['account/login.html'])
+        self.rendered = []
+        # Requests share the test's app context, and so its g
+        g.pop('csrf_token')
+        cached = second.get('/account/login')
+        self.assertEqual(self.rendered, [])
+        self.assertNotIn(b'page-cache:', cached.data)
+        self.assertNotEqual(
+            self.csrf_token(first, page.data),
+            self.csrf_token(second, cached.data))
+
+    def test_flashes_fill_their_hole(self):
+        client = self.app.test_client()
+        client.get('/')
+        with client.session_transaction() as session:
+            session['_flashes'] = [('success', 'Saved the thing')]
+        self.assertIn(b'Saved the thing', client.get('/').data)
+        self.assertNotIn(b'Saved the thing', client.get('/').data)
+
+    def test_editor_save_invalidates_page(self):
+        client = self.app.test_client()
+        client.get('/about')
+        key = next(iter(get_page_store()._pages))
+        body = get_page_store().get(key)[0]
+        self.assertIn(HOLE % 'csrf_token', body)
+        self.assertIn(HOLE % 'flashes', body)
+
+        EditableHTML.query.filter_by(editor_name='about').first().value = \
+            '<p>Bye</p>'
+        db.session.commit()
+        self.assertIsNone(get_page_store().get(key))
+        self.assertIn(b'<p>Bye</p>', client.get('/about').data)
+
+    def test_logged_in_users_are_not_cached(self):
+        client = self.app.test_client()
+        client.post(
+            '/account/login',
+            data={
+                'email': self.app.config['ADMIN_EMAIL'],
+                'password': 'password'
+            })
+        client.get('/')
+        self.assertEqual(len(get_page_store()._pages), 0)
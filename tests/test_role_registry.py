@@ -0,0 +1,76 @@
+import unittest
+
+from app import create_app, db
+from app.models import Permission, Role, User, role_registry
+from tests.test_admin import QueryCounter
+
+
+class RoleRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_lookups(self):
+        self.assertEqual([r.name for r in role_registry.all()],
+                         ['User', 'Administrator'])
+        self.assertEqual(role_registry.default().name, 'User')
+        self.assertEqual(
+            role_registry.by_permissions(Permission.ADMINISTER).name,
+            'Administrator')
+        admin = role_registry.by_name('Administrator')
+        self.assertEqual(role_registry.get(admin.id).name, 'Administrator')
+        self.assertIsNone(role_registry.by_name('Nobody'))
+
+    def test_no_queries_once_loaded(self):
+        role_registry.all()
+        db.session.remove()
+        with QueryCounter(db.engine) as counter:
+            u = User(email='user@example.com', password='password')
+            role_registry.all()
+            role_registry.by_name('Administrator')
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(u.role.name, 'User')
+
+    def test_roles_are_attached_to_the_session(self):
+        role = role_registry.default()
+        self.assertIn(role, db.session)
+        u = User(email='user@example.com', password='password', role=role)
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(User.query.get(u.id).role_id, role.id)
+
+    def test_role_writes_invalidate(self):
+        role_registry.all()
+        role = Role.query.filter_by(name='User').first()
+        role.name = 'Member'
+        db.session.commit()
+        self.assertEqual(role_registry.default().name, 'Member')
+        db.session.add(Role(name='Editor', index='main', permissions=3))
+        db.session.commit()
+        self.assertIsNotNone(role_registry.by_name('Editor'))
+
+    def test_rollback_keeps_registry(self):
+        role_registry.all()
+        role = Role.query.filter_by(name='User').first()
+        role.name = 'Member'
+        db.session.flush()
+        db.session.rollback()
+        with QueryCounter(db.engine) as counter:
+            self.assertEqual(role_registry.default().name, 'User')
+        self.assertEqual(counter.count, 0)
+
+    def test_insert_roles_invalidates(self):
+        role_registry.all()
+        Role.query.filter_by(name='Administrator').delete()
+        db.session.commit()
+        self.assertIsNone(role_registry.by_name('Administrator'))
+        Role.insert_roles()
+        self.assertIsNotNone(role_registry.by_name('Administrator'))
@@ -0,0 +1,189 @@
+import unittest
+
+from sqlalchemy import event, text
+
+from app import create_app, db
+from app.models import Role, User
+from app.search import NGramBackend, SQLiteFTSBackend, get_backend, \
+    reset_search_index, search_users, setup_search
+
+
+class SearchTestMixin(object):
+    backend = None
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['USER_SEARCH_BACKEND'] = self.backend
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        for first, last in [('Grace', 'Hopper'), ('Ada', 'Lovelace'),
+                            ('Alan', 'Turing'), ('Barbara', 'Liskov')]:
+            db.session.add(
+                User(
+                    first_name=first,
+                    last_name=last,
+                    email='%s@example.com' % first.lower()))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def names(self, query):
+        return [row[2] for _, row in search_users(query)]
+
+    def test_prefix(self):
+        self.assertEqual(self.names('hop'), ['Hopper'])
+        self.assertEqual(self.names('Ad'), ['Lovelace'])
+        self.assertEqual(self.names('barbara@ex'), ['Liskov'])
+
+    def test_fuzzy(self):
+        self.assertEqual(self.names('Lovelase'), ['Lovelace'])
+        self.assertEqual(self.names('zzzz'), [])
+
+    def test_prefix_ranks_first(self):
+        db.session.add(
+            User(first_name='Turner', last_name='X', email='t@example.com'))
+        db.session.commit()
+        self.assertEqual(self.names('turing')[0], 'Turing')
+
+    def test_hooks_keep_index_current(self):
+        self.names('warm up')
+        grace = User.query.filter_by(first_name='Grace').first()
+        grace.last_name = 'Brewster'
+        db.session.add(
+            User(first_name='Edsger', last_name='Dijkstra',
+                 email='edsger@example.com'))
+        db.session.delete(User.query.filter_by(first_name='Ada').first())
+        db.session.commit()
+        self.assertEqual(self.names('hopper'), [])
+        self.assertEqual(self.names('brews'), ['Brewster'])
+        self.assertEqual(self.names('dijk'), ['Dijkstra'])
+        self.assertEqual(self.names('lovelace'), [])
+
+
+class SQLiteSearchTestCase(SearchTestMixin, unittest.TestCase):
+    backend = 'sqlite'
+
+    def test_backend(self):
+        self.assertIsInstance(get_backend(), SQLiteFTSBackend)
+
+    def test_table_created_with_users(self):
+        self.assertTrue(SQLiteFTSBackend.exists(db.session.connection()))
+
+    def test_rollback_keeps_index(self):
+        db.session.add(
+            User(first_name='Edsger', last_name='Dijkstra',
+                 email='edsger@example.com'))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self.names('dijk'), [])
+        db.session.add(
+            User(first_name='Donald', last_name='Knuth',
+                 email='donald@example.com'))
+        db.session.commit()
+        self.assertEqual(self.names('knuth'), ['Knuth'])
+
+    def test_reset_refills_in_place(self):
+        with db.engine.begin() as connection:
+            connection.execute(text(
+                "INSERT INTO users (first_name, last_name, email) "
+                "VALUES ('Donald', 'Knuth', 'donald@example.com')"))
+        self.assertEqual(self.names('knuth'), [])
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        reset_search_index()
+        event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertFalse([s for s in statements if 'DROP' in s])
+        self.assertEqual(self.names('knuth'), ['Knuth'])
+        self.assertEqual(self.names('hop'), ['Hopper'])
+
+    def test_missing_table(self):
+        self.names('warm up')
+        with db.engine.begin() as connection:
+            connection.execute(text('DROP TABLE user_search'))
+        db.session.add(
+            User(first_name='Donald', last_name='Knuth',
+                 email='donald@example.com'))
+        db.session.commit()
+        # Prefix matches on `users` only, until the table is set up again
+        self.assertEqual(self.names('knuth'), ['Knuth'])
+        self.assertEqual(self.names('nuth'), [])
+        self.assertEqual(setup_search(), 'sqlite')
+        self.assertEqual(self.names('nuth'), ['Knuth'])
+
+    def test_search_runs_no_ddl(self):
+        self.names('warm up')
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        self.names('hopper')
+        event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertTrue(statements)
+        self.assertFalse([s for s in statements
+                          if 'CREATE' in s or 'sqlite_master' in s])
+
+    def test_table_created_for_older_database(self):
+        with db.engine.begin() as connection:
+            connection.execute(text('DROP TABLE user_search'))
+        self.app.extensions['user_search'] = None
+        self.assertIsInstance(get_backend(), SQLiteFTSBackend)
+        self.assertTrue(SQLiteFTSBackend.exists(db.session.connection()))
+        self.assertEqual(self.names('lovelase'), ['Lovelace'])
+
+
+class NGramSearchTestCase(SearchTestMixin, unittest.TestCase):
+    backend = 'ngram'
+
+    def test_backend(self):
+        self.assertIsInstance(get_backend(), NGramBackend)
+
+
+class SearchEndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(
+            User(
+                first_name='Admin',
+                last_name='Account',
+                email=self.app.config['ADMIN_EMAIL'],
+                password='password',
+                confirmed=True))
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_search_requires_admin(self):
+        response = self.client.get('/admin/users/search?q=adm')
+        self.assertEqual(response.status_code, 302)
+
+    def test_search_returns_json(self):
+        self.client.post(
+            '/account/login',
+            data={
+                'email': self.app.config['ADMIN_EMAIL'],
+                'password': 'password'
+            })
+        response = self.client.get('/admin/users/search?q=adm')
+        results = response.get_json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['name'], 'Admin Account')
+        self.assertTrue(results[0]['url'].startswith(
+            '/admin/user/%d' % results[0]['id']))
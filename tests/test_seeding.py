@@ -0,0 +1,64 @@
+import unittest
+
+from app import create_app, db
+from app.models import Role, User
+from app.search import search_users
+from app.seeding import UserSeeder
+
+
+class UserSeederTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_generate_fake(self):
+        self.assertEqual(User.generate_fake(250), 250)
+        self.assertEqual(User.query.count(), 250)
+        emails = db.session.query(User.email).distinct().count()
+        self.assertEqual(emails, 250)
+        user = User.query.first()
+        self.assertTrue(user.confirmed)
+        self.assertIsNotNone(user.role)
+        self.assertTrue(user.verify_password('password'))
+
+    def test_batches_and_progress(self):
+        reports = []
+        seeder = UserSeeder(
+            25, batch_size=10,
+            progress=lambda done, total, _: reports.append((done, total)))
+        self.assertEqual(seeder.run(), 25)
+        self.assertEqual(reports, [(10, 25), (20, 25), (25, 25)])
+
+    def test_fields_override(self):
+        User.generate_fake(5, confirmed=False)
+        self.assertEqual(User.query.filter_by(confirmed=False).count(), 5)
+
+    def test_taken_emails_are_skipped(self):
+        seeder = UserSeeder(10)
+        seeder.prepare()
+        start = seeder.batches()[0][0]
+        taken = seeder.rows(start, 10)[3]['email']
+        db.session.add(User(email=taken, password='password'))
+        db.session.commit()
+        self.assertEqual(seeder.insert_batch(start, 10), 9)
+        self.assertEqual(User.query.filter_by(email=taken).count(), 1)
+
+    def test_repeated_runs_do_not_collide(self):
+        User.generate_fake(20)
+        self.assertEqual(User.generate_fake(20), 20)
+        self.assertEqual(User.query.count(), 40)
+
+    def test_seeded_users_are_searchable(self):
+        search_users('anything')
+        User.generate_fake(20)
+        user = User.query.get(5)
+        ids = [row[0] for _, row in search_users(user.email, limit=5)]
+        self.assertIn(user.id, ids)
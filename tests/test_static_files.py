@@ -0,0 +1,82 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import url_for
+
+from app import create_app
+from app.static_files import IMMUTABLE, get_static_files, precompress
+
+
+class StaticFilesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.static = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.static, 'build'))
+        self.script = b'var answer = 42;\n' * 200
+        self.write('scripts/page.js', self.script)
+        self.write('images/dot.png', b'\x89PNG....')
+        self.write('build/app.0123456789ab.css', b'body { margin: 0 }\n' * 80)
+        self.app = create_app('testing')
+        # Pages (like the 404) still link the real bundles
+        self.app.config['ASSETS_DIRECTORY'] = self.app.static_folder
+        self.app.static_folder = self.static
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.assertEqual(precompress(self.static), 2)
+        self.assertEqual(precompress(self.static), 0)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.app_context.pop()
+        shutil.rmtree(self.static)
+
+    def write(self, name, data):
+        path = os.path.join(self.static, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def test_fingerprinted_urls_are_immutable(self):
+        with self.app.test_request_context():
+            url = url_for('static', filename='scripts/page.js')
+        fingerprint = get_static_files().fingerprint('scripts/page.js')
+        self.assertTrue(url.endswith('?v=' + fingerprint))
+        response = self.client.get(url)
+        self.assertEqual(response.data, self.script)
+        self.assertEqual(response.headers['Cache-Control'], IMMUTABLE)
+        self.assertIn('javascript', response.mimetype)
+
+        plain = self.client.get('/static/scripts/page.js')
+        self.assertNotIn('immutable', plain.headers['Cache-Control'])
+        built = self.client.get('/static/build/app.0123456789ab.css')
+        self.assertEqual(built.headers['Cache-Control'], IMMUTABLE)
+
+    def test_compressed_sibling_and_304(self):
+        response = self.client.get(
+            '/static/scripts/page.js',
+            headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.data), self.script)
+        self.assertEqual(int(response.headers['Content-Length']),
+                         len(response.data))
+
+        again = self.client.get(
+            '/static/scripts/page.js',
+            headers={
+                'Accept-Encoding': 'gzip',
+                'If-None-Match': response.headers['ETag']
+            })
+        self.assertEqual(again.status_code, 304)
+        image = self.client.get(
+            '/static/images/dot.png', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', image.headers)
+
+    def test_files_added_later_are_still_served(self):
+        get_static_files()
+        self.write('late.txt', b'late')
+        self.assertEqual(self.client.get('/static/late.txt').data, b'late')
+        self.assertEqual(
+            self.client.get('/static/missing.txt').status_code, 404)
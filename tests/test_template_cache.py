@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from jinja2 import FileSystemBytecodeCache
+
+from app import create_app
+from app.template_cache import init_template_cache, warm_templates
+from config import ProductionConfig
+
+
+class TemplateCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def make_app(self):
+        app = create_app('testing')
+        app.config['TEMPLATE_BYTECODE_CACHE'] = 'filesystem'
+        app.config['TEMPLATE_BYTECODE_CACHE_DIR'] = self.cache_dir
+        init_template_cache(app)
+        return app
+
+    def test_warm_up_fills_bytecode_cache(self):
+        app = self.make_app()
+        self.assertIsInstance(app.jinja_env.bytecode_cache,
+                              FileSystemBytecodeCache)
+        count, _ = warm_templates(app)
+        self.assertGreater(count, 20)
+        self.assertEqual(len(os.listdir(self.cache_dir)), count)
+        self.assertIn('layouts/base.html',
+                      [key[1] for key in app.jinja_env.cache.keys()])
+
+        # A new app loads the compiled templates instead of writing them
+        written = {name: os.path.getmtime(os.path.join(self.cache_dir, name))
+                   for name in os.listdir(self.cache_dir)}
+        second = self.make_app()
+        warm_templates(second)
+        self.assertEqual(written, {
+            name: os.path.getmtime(os.path.join(self.cache_dir, name))
+            for name in os.listdir(self.cache_dir)})
+        response = second.test_client().get('/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_production_mode(self):
+        self.assertFalse(ProductionConfig.TEMPLATES_AUTO_RELOAD)
+        self.assertEqual(ProductionConfig.TEMPLATE_BYTECODE_CACHE,
+                         'filesystem')
+        self.assertTrue(ProductionConfig.TEMPLATE_WARMUP)
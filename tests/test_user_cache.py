@@ -0,0 +1,133 @@
+import unittest
+
+import fakeredis
+
+from app import create_app, db
+from app.models import Role, User, UserCache, get_user_cache, load_user
+from tests.test_admin import QueryCounter
+
+
+class UserCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(
+            first_name='Ada',
+            last_name='Lovelace',
+            email='ada@example.com',
+            password='password',
+            confirmed=True)
+        db.session.add(self.user)
+        db.session.commit()
+        self.user_id = self.user.id
+        db.session.remove()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def load(self):
+        db.session.remove()
+        return load_user(str(self.user_id))
+
+    def test_cached_load_runs_no_queries(self):
+        self.load()
+        db.session.remove()
+        with QueryCounter(db.engine) as counter:
+            user = load_user(str(self.user_id))
+            self.assertEqual(user.email, 'ada@example.com')
+            self.assertTrue(user.confirmed)
+            self.assertEqual(user.role.name, 'User')
+        self.assertEqual(counter.count, 0)
+
+    def test_password_hash_is_not_cached(self):
+        self.load()
+        self.assertNotIn('password_hash', get_user_cache().local.get(
+            self.user_id)[1])
+        self.assertTrue(self.load().verify_password('password'))
+
+    def test_cached_user_can_be_changed(self):
+        user = self.load()
+        user = self.load()
+        user.first_name = 'Augusta'
+        db.session.commit()
+        self.assertEqual(self.load().first_name, 'Augusta')
+
+    def test_reset_password_invalidates(self):
+        self.load()
+        user = User.query.get(self.user_id)
+        token = user.generate_password_reset_token()
+        self.assertTrue(user.reset_password(token, 'new password'))
+        self.assertIsNone(get_user_cache().local.get(self.user_id))
+        self.assertTrue(self.load().verify_password('new password'))
+
+    def test_change_email_invalidates(self):
+        self.load()
+        user = User.query.get(self.user_id)
+        token = user.generate_email_change_token('countess@example.com')
+        self.assertTrue(user.change_email(token))
+        self.assertEqual(self.load().email, 'countess@example.com')
+
+    def test_confirm_account_invalidates(self):
+        user = User.query.get(self.user_id)
+        user.confirmed = False
+        db.session.commit()
+        self.assertFalse(self.load().confirmed)
+        user = User.query.get(self.user_id)
+        self.assertTrue(
+            user.confirm_account(user.generate_confirmation_token()))
+        self.assertTrue(self.load().confirmed)
+
+    def test_role_change_invalidates(self):
+        self.load()
+        user = User.query.get(self.user_id)
+        user.role = Role.query.filter_by(name='Administrator').first()
+        db.session.commit()
+        self.assertTrue(self.load().is_admin())
+
+    def test_delete_invalidates(self):
+        self.load()
+        db.session.delete(User.query.get(self.user_id))
+        db.session.commit()
+        self.assertIsNone(self.load())
+
+    def test_bulk_write_clears(self):
+        self.load()
+        User.query.filter_by(id=self.user_id).update({'first_name': 'A.'})
+        db.session.commit()
+        self.assertEqual(self.load().first_name, 'A.')
+
+    def test_rollback_keeps_entry(self):
+        self.load()
+        user = self.load()
+        user.first_name = 'Augusta'
+        db.session.flush()
+        db.session.rollback()
+        self.assertIsNotNone(get_user_cache().local.get(self.user_id))
+        self.assertEqual(self.load().first_name, 'Ada')
+
+    def test_invalidation_reaches_other_processes(self):
+        redis = fakeredis.FakeStrictRedis()
+        caches = UserCache(redis=redis), UserCache(redis=redis)
+        for cache in caches:
+            self.assertEqual(cache.get(self.user_id).first_name, 'Ada')
+            db.session.remove()
+        User.query.filter_by(id=self.user_id).update(
+            {'first_name': 'Augusta'})
+        db.session.commit()
+        caches[0].invalidate(self.user_id)
+        self.assertEqual(caches[1].get(self.user_id).first_name, 'Augusta')
+        db.session.remove()
+
+        User.query.filter_by(id=self.user_id).update({'first_name': 'A.'})
+        db.session.commit()
+        caches[1].clear()
+        self.assertEqual(caches[0].get(self.user_id).first_name, 'A.')
+        db.session.remove()
+        with QueryCounter(db.engine) as counter:
+            caches[1].get(self.user_id)
+        self.assertEqual(counter.count, 0)
@@ -0,0 +1,78 @@
+import csv
+import io
+import json
+import unittest
+
+from app import create_app, db
+from app.admin.exporting import COLUMNS, export_users
+from app.models import Role, User
+
+
+class UserExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(
+            User(
+                first_name='Admin',
+                last_name='Account',
+                email=self.app.config['ADMIN_EMAIL'],
+                password='password',
+                confirmed=True))
+        for i in range(25):
+            db.session.add(
+                User(
+                    first_name='First%d' % i,
+                    last_name='Last%d' % i,
+                    email='user%d@example.com' % i))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_csv(self):
+        chunks = list(export_users('csv', batch_size=10))
+        self.assertEqual(len(chunks), 3)
+        rows = list(csv.reader(io.StringIO(''.join(chunks))))
+        self.assertEqual(tuple(rows[0]), COLUMNS)
+        self.assertEqual(len(rows), 27)
+        self.assertEqual(rows[1][3], self.app.config['ADMIN_EMAIL'])
+        self.assertEqual(rows[1][5], 'Administrator')
+        self.assertEqual(rows[2][1:4],
+                         ['First0', 'Last0', 'user0@example.com'])
+
+    def test_jsonl_filters(self):
+        user_role = Role.query.filter_by(name='User').first()
+        lines = ''.join(
+            export_users('jsonl', role=user_role.id,
+                         search='First1')).splitlines()
+        users = [json.loads(line) for line in lines]
+        self.assertEqual(
+            sorted(u['first_name'] for u in users),
+            ['First1'] + ['First%d' % i for i in range(10, 20)])
+        self.assertEqual({u['role'] for u in users}, {'User'})
+        self.assertEqual(set(users[0]), set(COLUMNS))
+
+    def test_export_view_streams(self):
+        client = self.app.test_client()
+        client.post(
+            '/account/login',
+            data={
+                'email': self.app.config['ADMIN_EMAIL'],
+                'password': 'password'
+            })
+        response = client.get('/admin/users/export.csv?q=user2')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual([row[3] for row in rows[1:]],
+                         ['user2@example.com'] +
+                         ['user%d@example.com' % i for i in range(20, 25)])
+        self.assertEqual(
+            client.get('/admin/users/export.xml').status_code, 404)
@@ -0,0 +1,165 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import fakeredis
+from rq import Queue
+
+from app import create_app, db
+from app.admin.importing import UserImport
+from app.models import Role, User
+from app.search import search_users
+from app.worker import worker_app
+
+CSV = '''Email,First_Name,Last_Name,Role
+ada@example.com,Ada,Lovelace,
+grace@example.com,Grace,Hopper,Administrator
+not-an-email,Alan,Turing,
+taken@example.com,Taken,Already,
+ada@example.com,Ada,Again,
+edsger@example.com,Edsger,Dijkstra,Nobody
+barbara@example.com,Barbara,Liskov,
+'''
+
+
+class UserImportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(User(email='taken@example.com', password='password'))
+        db.session.commit()
+        self.emails = []
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def run_import(self, text=CSV, **kwargs):
+        with self.app.test_request_context(base_url='https://example.org'):
+            return UserImport(enqueue=self.emails.extend, **kwargs).run(
+                io.StringIO(text))
+
+    def test_import(self):
+        result = self.run_import(chunk_size=2)
+        self.assertEqual(result.created, 3)
+        self.assertEqual(result.skipped, 4)
+        self.assertEqual(
+            sorted(line for line, _ in result.errors), [4, 5, 6, 7])
+        grace = User.query.filter_by(email='grace@example.com').first()
+        self.assertEqual(grace.role.name, 'Administrator')
+        self.assertFalse(grace.confirmed)
+        self.assertIsNone(grace.password_hash)
+        ada = User.query.filter_by(email='ada@example.com').first()
+        self.assertEqual(ada.last_name, 'Lovelace')
+        self.assertEqual(ada.role.name, 'User')
+
+    def test_email_taken_during_import(self):
+        class Racing(UserImport):
+            looked_up = False
+
+            def _lookup(self, emails):
+                # The first lookup misses taken@, as if it signed up just
+                # after
+                if not self.looked_up:
+                    self.looked_up = True
+                    emails = [e for e in emails if e != 'taken@example.com']
+                return super(Racing, self)._lookup(emails)
+
+        with self.app.test_request_context(base_url='https://example.org'):
+            result = Racing(enqueue=self.emails.extend).run(io.StringIO(CSV))
+        self.assertEqual(result.created, 3)
+        self.assertIn(
+            (5, 'Email taken@example.com is already registered.'),
+            result.errors)
+        self.assertEqual(
+            sorted(email['recipient'] for email in self.emails),
+            ['ada@example.com', 'barbara@example.com', 'grace@example.com'])
+
+    def test_invitations(self):
+        self.run_import()
+        self.assertEqual(len(self.emails), 3)
+        ada = User.query.filter_by(email='ada@example.com').first()
+        email = self.emails[0]
+        self.assertEqual(email['recipient'], 'ada@example.com')
+        self.assertEqual(email['user_id'], ada.id)
+        prefix = 'https://example.org/account/join-from-invite/{}/'.format(
+            ada.id)
+        self.assertTrue(email['invite_link'].startswith(prefix))
+        token = email['invite_link'][len(prefix):]
+        self.assertTrue(ada.confirm_account(token))
+
+    def test_no_invite(self):
+        result = self.run_import(invite=False)
+        self.assertEqual(result.created, 3)
+        self.assertEqual(self.emails, [])
+
+    def test_missing_email_column(self):
+        result = self.run_import('name\nAda\n')
+        self.assertEqual(result.created, 0)
+        self.assertEqual(result.errors, [(1, 'The file has no email column.')])
+
+    def test_imported_users_are_searchable(self):
+        search_users('anything')
+        self.run_import()
+        ids = [row[0] for _, row in search_users('Lovelace')]
+        ada = User.query.filter_by(email='ada@example.com').first()
+        self.assertEqual(ids, [ada.id])
+
+    def test_upload(self):
+        db.session.add(
+            User(
+                email=self.app.config['ADMIN_EMAIL'],
+                password='password',
+                confirmed=True))
+        db.session.commit()
+        client = self.app.test_client()
+        client.post(
+            '/account/login',
+            data={
+                'email': self.app.config['ADMIN_EMAIL'],
+                'password': 'password'
+            })
+        self.assertEqual(client.get('/admin/import-users').status_code, 200)
+
+        # Jobs run as they are queued, in this process
+        queue = Queue(is_async=False, connection=fakeredis.FakeStrictRedis())
+        uploads = tempfile.mkdtemp()
+        self.app.config['IMPORT_UPLOAD_DIR'] = uploads
+        worker_app.app = self.app
+        try:
+            with mock.patch('app.admin.importing.get_queue',
+                            return_value=queue), \
+                    mock.patch('app.admin.views.get_queue',
+                               return_value=queue):
+                response = client.post(
+                    '/admin/import-users',
+                    data={
+                        'file': (io.BytesIO(CSV.encode('utf-8')),
+                                 'users.csv'),
+                        'role': str(
+                            Role.query.filter_by(name='User').first().id),
+                    },
+                    content_type='multipart/form-data')
+                self.assertEqual(response.status_code, 302)
+                location = response.headers['Location']
+                response = client.get(location)
+                self.assertEqual(
+                    client.get('/admin/import-users/nope').status_code, 404)
+        finally:
+            worker_app.reset()
+        # The job got the file's path, and removed the file when done
+        job = queue.fetch_job(location.rsplit('/', 1)[1])
+        self.assertTrue(job.args[0].startswith(uploads))
+        self.assertEqual(os.listdir(uploads), [])
+        os.rmdir(uploads)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Imported 3 users; skipped 4 rows.', response.data)
+        self.assertIn(b'is already registered', response.data)
+        self.assertEqual(
+            User.query.filter_by(email='barbara@example.com').count(), 1)
@@ -0,0 +1,100 @@
+import unittest
+
+from werkzeug.datastructures import MultiDict
+
+from app import create_app, db
+from app.admin.listing import UserListing
+from app.models import Role, User
+
+
+class UserListingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.admin_role = Role.query.filter_by(name='Administrator').first()
+        names = ['Hopper', 'Lovelace', 'Turing', 'Hopper', 'Knuth', None,
+                 'Liskov', 'Hamilton']
+        for i, name in enumerate(names):
+            db.session.add(
+                User(
+                    first_name='User%d' % i,
+                    last_name=name,
+                    email='user%d@example.com' % i,
+                    role=self.admin_role if i % 3 == 0 else None))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def walk(self, **kwargs):
+        """Collect every page of a listing by following next cursors."""
+        pages = []
+        listing = UserListing(**kwargs).fetch()
+        pages.append(listing)
+        while listing.next_cursor:
+            listing = UserListing(after=listing.next_cursor, **kwargs).fetch()
+            pages.append(listing)
+        return pages
+
+    def expected(self, key, reverse=False):
+        users = sorted(
+            User.query.all(), key=lambda u: (key(u) is not None, key(u), u.id))
+        return list(reversed(users)) if reverse else users
+
+    def test_pages_follow_sort_order(self):
+        pages = self.walk(sort='last_name', per_page=3)
+        self.assertEqual([len(p.users) for p in pages], [3, 3, 2])
+        users = [u for p in pages for u in p.users]
+        self.assertEqual(users, self.expected(lambda u: u.last_name))
+
+    def test_descending_order(self):
+        pages = self.walk(sort='last_name', order='desc', per_page=3)
+        users = [u for p in pages for u in p.users]
+        self.assertEqual(users,
+                         self.expected(lambda u: u.last_name, reverse=True))
+
+    def test_sort_by_role(self):
+        pages = self.walk(sort='role', per_page=3)
+        users = [u for p in pages for u in p.users]
+        self.assertEqual(users, self.expected(lambda u: u.role_id))
+        pages = self.walk(sort='role', order='desc', per_page=3)
+        users = [u for p in pages for u in p.users]
+        self.assertEqual(users,
+                         self.expected(lambda u: u.role_id, reverse=True))
+
+    def test_previous_page(self):
+        first = UserListing(sort='email', per_page=3).fetch()
+        second = UserListing(
+            sort='email', per_page=3, after=first.next_cursor).fetch()
+        back = UserListing(
+            sort='email', per_page=3, before=second.prev_cursor).fetch()
+        self.assertEqual(back.users, first.users)
+        self.assertTrue(back.prev_cursor is None)
+        self.assertTrue(back.next_cursor is not None)
+
+    def test_filter_by_role(self):
+        listing = UserListing(role=self.admin_role.id).fetch()
+        self.assertEqual(len(listing.users), 3)
+        self.assertTrue(
+            all(u.role_id == self.admin_role.id for u in listing.users))
+
+    def test_search_prefix(self):
+        listing = UserListing(search='hop').fetch()
+        self.assertEqual(
+            sorted(u.last_name for u in listing.users), ['Hopper', 'Hopper'])
+        listing = UserListing(search='USER5@').fetch()
+        self.assertEqual(len(listing.users), 1)
+
+    def test_search_escapes_wildcards(self):
+        self.assertEqual(UserListing(search='%').fetch().users, [])
+
+    def test_invalid_cursor_starts_over(self):
+        listing = UserListing.from_args(
+            MultiDict({'after': 'garbage', 'per_page': '3'})).fetch()
+        self.assertEqual(listing.users,
+                         self.expected(lambda u: u.last_name)[:3])
@@ -0,0 +1,29 @@
+import unittest
+
+from flask import current_app
+
+from app.worker import WorkerAppRegistry
+
+
+class WorkerAppRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = WorkerAppRegistry('testing')
+
+    def tearDown(self):
+        self.registry.reset()
+
+    def test_app_is_built_once(self):
+        app = self.registry.get()
+        self.assertTrue(app.config['TESTING'])
+        self.assertIs(self.registry.get(), app)
+        self.assertTrue(self.registry.build_seconds is not None)
+
+    def test_job_context_reuses_app(self):
+        with self.registry.app_context():
+            first = current_app._get_current_object()
+        with self.registry.app_context():
+            second = current_app._get_current_object()
+        self.assertIs(first, second)
+        stats = self.registry.stats()
+        self.assertEqual(stats['jobs'], 2)
+        self.assertTrue(stats['avg_job_seconds'] is not None)